@@ -0,0 +1,417 @@
+"""
+Aggregation query trên chuỗi thời gian đã ingest (/api/aggregate)
+- Dữ liệu raw lưu dạng cột numpy theo timestamp đã sắp xếp; rollup 5m/1h được cập nhật tăng dần khi ingest
+- Gom nhóm theo bucket bất kỳ bằng segment reduction (searchsorted + ufunc.reduceat), không lặp Python theo bản ghi
+- Bucket là bội số của một rollup (15m, 1h, 1d, ...) thì đọc từ rollup lớn nhất phù hợp thay vì raw
+- Trung bình hướng gió tính từ tổng vector u/v (vector_fields) thay vì trung bình cộng số độ
+"""
+
+import re
+import threading
+import time
+
+import numpy as np
+
+from derived_metrics import vector_direction
+
+AGGREGATIONS = ('mean', 'min', 'max', 'sum', 'last', 'count')
+
+# In-memory rollups (same bucket sizes as the retention tiers)
+ROLLUPS = (('5m', 5 * 60 * 1000), ('1h', 60 * 60 * 1000))
+
+BUCKET_UNITS = {'m': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000}
+_BUCKET_PATTERN = re.compile(r'^(\d+)([mhd])$')
+
+PART_NAMES = ('count', 'sum', 'min', 'max', 'last')
+
+
+def parse_bucket(text):
+    """'15m' / '1h' / '1d' -> bucket size in ms"""
+    match = _BUCKET_PATTERN.match((text or '').strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid bucket {text!r} (e.g. 15m, 1h, 1d)")
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+
+def align(timestamps, bucket_ms, offset_ms=0):
+    """Start of the bucket each timestamp (ms) falls in; buckets start at local midnight for offset_ms"""
+    return (timestamps + offset_ms) // bucket_ms * bucket_ms - offset_ms
+
+
+def raw_parts(values):
+    """Partial aggregates of single readings (NaN = missing)"""
+    valid = ~np.isnan(values)
+    return {
+        'count': valid.astype(np.int64),
+        'sum': np.where(valid, values, 0.0),
+        'min': values,
+        'max': values,
+        'last': values,
+    }
+
+
+def reduce_parts(parts, group_starts):
+    """
+    Merge consecutive partial aggregates into groups; group i spans
+    group_starts[i]:group_starts[i + 1] (the last one runs to the end). Groups must be non-empty.
+    """
+    has_last = ~np.isnan(parts['last'])
+    positions = np.where(has_last, np.arange(len(has_last)), -1)
+    last_pos = np.maximum.reduceat(positions, group_starts)
+    return {
+        'count': np.add.reduceat(parts['count'], group_starts),
+        'sum': np.add.reduceat(parts['sum'], group_starts),
+        'min': np.fmin.reduceat(parts['min'], group_starts),
+        'max': np.fmax.reduceat(parts['max'], group_starts),
+        'last': np.where(last_pos >= 0, parts['last'][np.maximum(last_pos, 0)], np.nan),
+    }
+
+
+def merge_part(old, new):
+    """Combine two partial aggregates of the same bucket (scalars)"""
+    return {
+        'count': old['count'] + new['count'],
+        'sum': old['sum'] + new['sum'],
+        'min': np.fmin(old['min'], new['min']),
+        'max': np.fmax(old['max'], new['max']),
+        'last': new['last'] if not np.isnan(new['last']) else old['last'],
+    }
+
+
+def finalize(parts, aggs):
+    """Requested aggregations from partial aggregates (NaN where a bucket has no data)"""
+    count = parts['count']
+    empty = count == 0
+    result = {}
+    for agg in aggs:
+        if agg == 'count':
+            values = count
+        elif agg == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = parts['sum'] / count
+        else:
+            values = parts[agg]
+        if agg != 'count':
+            values = np.where(empty, np.nan, values)
+        result[agg] = values
+    return result
+
+
+def segment_aggregate(times, parts, edges, aggs):
+    """Aggregate partials at sorted `times` into the buckets [edges[i], edges[i + 1])"""
+    n = len(edges) - 1
+    bounds = np.searchsorted(times, edges, side='left')
+    lo, hi = bounds[:-1], bounds[1:]
+    nonempty = hi > lo
+    grouped = {name: np.zeros(n, dtype=np.int64) if name == 'count' else np.full(n, np.nan)
+               for name in PART_NAMES}
+    if nonempty.any():
+        end = bounds[-1]
+        reduced = reduce_parts({name: values[:end] for name, values in parts.items()}, lo[nonempty])
+        for name in PART_NAMES:
+            grouped[name][nonempty] = reduced[name]
+    return finalize(grouped, aggs)
+
+
+class GrowableColumns:
+    """Named numpy columns with amortized O(1) appends"""
+
+    def __init__(self, dtypes, capacity=1024):
+        self.length = 0
+        self._arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def __len__(self):
+        return self.length
+
+    def column(self, name):
+        return self._arrays[name][:self.length]
+
+    def append(self, columns):
+        added = len(next(iter(columns.values())))
+        needed = self.length + added
+        capacity = len(next(iter(self._arrays.values())))
+        if needed > capacity:
+            capacity = max(needed, capacity * 2)
+            for name, array in self._arrays.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.length] = array[:self.length]
+                self._arrays[name] = grown
+        for name, values in columns.items():
+            self._arrays[name][self.length:needed] = values
+        self.length = needed
+
+    def replace(self, columns):
+        """Replace all rows (used for prepending seeded history or dropping old rows)"""
+        self.length = 0
+        self.append(columns)
+
+
+class RollupSeries:
+    """Per-bucket partial aggregates (count/sum/min/max/last per field) for one bucket size"""
+
+    def __init__(self, fields, bucket_ms, offset_ms=0):
+        self.fields = tuple(fields)
+        self.bucket_ms = bucket_ms
+        self.offset_ms = offset_ms
+        dtypes = {'start': np.int64}
+        for field in self.fields:
+            for name in PART_NAMES:
+                dtypes[f'{name}:{field}'] = np.int64 if name == 'count' else float
+        self.columns = GrowableColumns(dtypes)
+
+    def parts(self, field):
+        return {name: self.columns.column(f'{name}:{field}') for name in PART_NAMES}
+
+    def add(self, times, field_parts):
+        """Fold sorted partials (raw readings or smaller buckets) into the rollup"""
+        if not len(times):
+            return
+        starts = align(times, self.bucket_ms, self.offset_ms)
+        group_starts = np.flatnonzero(np.concatenate(([True], starts[1:] != starts[:-1])))
+        bucket_starts = starts[group_starts]
+        reduced = {field: reduce_parts(field_parts[field], group_starts) for field in self.fields}
+
+        # The first new bucket may continue the current last bucket
+        existing = self.columns.column('start')
+        if len(existing) and existing[-1] == bucket_starts[0]:
+            index = len(existing) - 1
+            for field in self.fields:
+                old = {name: self.columns.column(f'{name}:{field}')[index] for name in PART_NAMES}
+                new = {name: reduced[field][name][0] for name in PART_NAMES}
+                for name, value in merge_part(old, new).items():
+                    self.columns.column(f'{name}:{field}')[index] = value
+            bucket_starts = bucket_starts[1:]
+            reduced = {field: {name: values[1:] for name, values in parts.items()}
+                       for field, parts in reduced.items()}
+        if len(bucket_starts):
+            self.columns.append(self._flatten(bucket_starts, reduced))
+
+    def prepend(self, times, field_parts):
+        """Add partials older than everything held (e.g. compacted history) in front of the rollup"""
+        if not len(times):
+            return 0
+        older = RollupSeries(self.fields, self.bucket_ms, self.offset_ms)
+        older.add(times, field_parts)
+        older_columns = {name: older.columns.column(name) for name in self._column_names()}
+        existing = self.columns.column('start')
+        if len(existing) and older_columns['start'][-1] == existing[0]:
+            # The newest older bucket is the first bucket held: merge it in place
+            for field in self.fields:
+                old = {name: older_columns[f'{name}:{field}'][-1] for name in PART_NAMES}
+                new = {name: self.columns.column(f'{name}:{field}')[0] for name in PART_NAMES}
+                for name, value in merge_part(old, new).items():
+                    self.columns.column(f'{name}:{field}')[0] = value
+            older_columns = {name: values[:-1] for name, values in older_columns.items()}
+        combined = {name: np.concatenate([older_columns[name], self.columns.column(name)])
+                    for name in self._column_names()}
+        self.columns.replace(combined)
+        return len(older_columns['start'])
+
+    def _column_names(self):
+        return ['start'] + [f'{name}:{field}' for field in self.fields for name in PART_NAMES]
+
+    def _flatten(self, bucket_starts, reduced):
+        columns = {'start': bucket_starts}
+        for field in self.fields:
+            for name in PART_NAMES:
+                columns[f'{name}:{field}'] = reduced[field][name]
+        return columns
+
+
+class TimeSeriesStore:
+    """Columnar raw readings + incremental rollups per station, answering bucketed aggregate queries"""
+
+    def __init__(self, fields, rollups=ROLLUPS, offset_ms=0, max_buckets=20000, vector_fields=None):
+        self.fields = tuple(fields)
+        self.rollups = tuple(rollups)
+        self.vector_fields = dict(vector_fields or {})     # direction field -> (u field, v field)
+        self.offset_ms = offset_ms
+        self.max_buckets = max_buckets
+        self._raw = {}          # station -> GrowableColumns(ts, fields...)
+        self._rollups = {}      # station -> {name: RollupSeries}
+        self._last_keys = {}    # station -> push ID of the newest appended reading
+        self._lock = threading.Lock()
+
+    def _station(self, station):
+        if station not in self._raw:
+            dtypes = {'ts': np.int64, **{field: float for field in self.fields}}
+            self._raw[station] = GrowableColumns(dtypes)
+            self._rollups[station] = {name: RollupSeries(self.fields, size, self.offset_ms)
+                                      for name, size in self.rollups}
+        return self._raw[station], self._rollups[station]
+
+    def stations(self):
+        return sorted(self._raw)
+
+    def append(self, station, timestamps, columns, keys=None):
+        """
+        Append sorted readings (timestamps in ms, {field: float array}); older/duplicate ones are skipped.
+        With `keys` (push IDs, sorted) duplicates are detected by key, so distinct readings that share a
+        millisecond are all kept, like in WeatherStore; without keys by timestamp.
+        """
+        with self._lock:
+            raw, rollups = self._station(station)
+            timestamps = np.asarray(timestamps, dtype=np.int64)
+            last_key = self._last_keys.get(station)
+            newer = None
+            if keys is not None and last_key is not None:
+                newer = np.asarray(keys) > last_key
+            elif len(raw):
+                newer = timestamps > raw.column('ts')[-1]
+            if newer is not None:
+                timestamps = timestamps[newer]
+                columns = {field: np.asarray(columns[field], dtype=float)[newer] for field in self.fields}
+                keys = [key for key, keep in zip(keys, newer) if keep] if keys is not None else None
+            if not len(timestamps):
+                return 0
+            if keys is not None:
+                self._last_keys[station] = keys[-1]
+            columns = {field: np.asarray(columns.get(field, np.full(len(timestamps), np.nan)), dtype=float)
+                       for field in self.fields}
+            raw.append({'ts': timestamps, **columns})
+            field_parts = {field: raw_parts(columns[field]) for field in self.fields}
+            for rollup in rollups.values():
+                rollup.add(timestamps, field_parts)
+            return len(timestamps)
+
+    def drop_raw_before(self, station, cutoff_ms):
+        """Forget raw readings older than cutoff; rollups keep covering them"""
+        with self._lock:
+            raw = self._raw.get(station)
+            if raw is None:
+                return 0
+            index = int(np.searchsorted(raw.column('ts'), cutoff_ms, side='left'))
+            if index:
+                raw.replace({name: raw.column(name)[index:].copy() for name in ('ts',) + self.fields})
+            return index
+
+    def seed_rollup(self, station, name, buckets):
+        """
+        Prepend compacted history, e.g. retention buckets {bucket_ms: {'count', 'counts', 'sum', 'min', 'max'}}.
+        Only buckets ending before the first reading/bucket already held are used, so nothing is counted twice.
+        """
+        size = dict(self.rollups)[name]
+        # Check what is held and prepend under one lock hold, so concurrent seeds cannot both add
+        with self._lock:
+            first = self._first_held(station, name)
+            starts = np.array(sorted(start for start in buckets if first is None or start + size <= first),
+                              dtype=np.int64)
+            if not len(starts):
+                return 0
+            field_parts = {}
+            for field in self.fields:
+                count, total, low, high = [], [], [], []
+                for start in starts.tolist():
+                    bucket = buckets[start]
+                    has_field = field in bucket.get('sum', {})
+                    # Per-field reading count; older buckets only have the row count
+                    count.append((bucket.get('counts') or {}).get(field, bucket.get('count', 0)) if has_field else 0)
+                    total.append(bucket['sum'][field] if has_field else 0.0)
+                    low.append(bucket.get('min', {}).get(field, np.nan) if has_field else np.nan)
+                    high.append(bucket.get('max', {}).get(field, np.nan) if has_field else np.nan)
+                field_parts[field] = {
+                    'count': np.array(count, dtype=np.int64),
+                    'sum': np.array(total, dtype=float),
+                    'min': np.array(low, dtype=float),
+                    'max': np.array(high, dtype=float),
+                    # Compacted buckets do not keep their last reading
+                    'last': np.full(len(starts), np.nan),
+                }
+            added = 0
+            _, rollups = self._station(station)
+            # Seed this rollup and every coarser one that can be built from it
+            for rollup_name, rollup in rollups.items():
+                if rollup.bucket_ms >= size and rollup.bucket_ms % size == 0:
+                    count = rollup.prepend(starts, field_parts)
+                    if rollup_name == name:
+                        added = count
+        return added
+
+    def _first_held(self, station, name):
+        """Earliest raw timestamp or `name` rollup bucket held for a station"""
+        firsts = []
+        raw = self._raw.get(station)
+        if raw is not None and len(raw):
+            firsts.append(int(raw.column('ts')[0]))
+        rollup = self._rollups.get(station, {}).get(name)
+        if rollup is not None and len(rollup.columns):
+            firsts.append(int(rollup.columns.column('start')[0]))
+        return min(firsts) if firsts else None
+
+    def _source(self, station, bucket_ms):
+        """Largest rollup the bucket is a multiple of, else the raw readings"""
+        rollups = self._rollups.get(station, {})
+        for name, size in sorted(self.rollups, key=lambda rollup: rollup[1], reverse=True):
+            if bucket_ms % size == 0 and name in rollups and len(rollups[name].columns):
+                return f'rollup:{name}', rollups[name]
+        return 'raw', self._raw.get(station)
+
+    def bounds(self, station):
+        """(first, last) timestamp held for a station across raw and rollups, or None"""
+        firsts, lasts = [], []
+        raw = self._raw.get(station)
+        if raw is not None and len(raw):
+            firsts.append(int(raw.column('ts')[0]))
+            lasts.append(int(raw.column('ts')[-1]))
+        for rollup in self._rollups.get(station, {}).values():
+            if len(rollup.columns):
+                firsts.append(int(rollup.columns.column('start')[0]))
+        if not firsts:
+            return None
+        return min(firsts), max(lasts) if lasts else max(firsts)
+
+    def query(self, station, fields, aggs, bucket_ms, from_ms, to_ms):
+        """
+        Aggregates of `fields` in buckets of bucket_ms covering [from_ms, to_ms).
+        from/to are widened to whole buckets. Returns None for an unknown station.
+        """
+        started = time.perf_counter()
+        start = int(align(np.int64(from_ms), bucket_ms, self.offset_ms))
+        end = int(align(np.int64(to_ms - 1), bucket_ms, self.offset_ms)) + bucket_ms
+        n = (end - start) // bucket_ms
+        if n > self.max_buckets:
+            raise ValueError(f"Too many buckets ({n} > {self.max_buckets}), use a larger bucket or a shorter range")
+        edges = start + bucket_ms * np.arange(n + 1, dtype=np.int64)
+
+        with self._lock:
+            if station not in self._raw:
+                return None
+            source_name, source = self._source(station, bucket_ms)
+            if source_name == 'raw':
+                times = source.column('ts')
+                parts = lambda field: raw_parts(source.column(field))
+            else:
+                times = source.columns.column('start')
+                parts = source.parts
+            data = {}
+            for field in fields:
+                data[field] = segment_aggregate(times, parts(field), edges, aggs)
+                if 'mean' in aggs and field in self.vector_fields:
+                    u, v = (segment_aggregate(times, parts(name), edges, ('sum',))['sum']
+                            for name in self.vector_fields[field])
+                    data[field]['mean'] = vector_direction(u, v)
+
+        return {
+            'station': station,
+            'bucket_ms': bucket_ms,
+            'from': start,
+            'to': end,
+            'source': source_name,
+            'buckets': edges[:-1],
+            'data': data,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+        }
+
+
+def to_json_lists(result, decimals=3):
+    """numpy arrays of a query result -> plain lists (NaN -> None) for jsonify"""
+    data = {}
+    for field, aggs in result['data'].items():
+        data[field] = {}
+        for agg, values in aggs.items():
+            if agg == 'count':
+                data[field][agg] = values.tolist()
+                continue
+            rounded = np.round(values, decimals)
+            data[field][agg] = [None if value != value else value for value in rounded.tolist()]
+    return {**result, 'buckets': result['buckets'].tolist(), 'data': data}
@@ -0,0 +1,368 @@
+"""
+Alert rule engine đánh giá tăng dần khi ingest
+- ThresholdRule: vượt ngưỡng (có hysteresis)
+- RateOfChangeRule: thay đổi trong một cửa sổ thời gian (vd. áp suất giảm 3 hPa / 3h)
+- NoDataRule: không có dữ liệu trong N phút (kiểm tra qua tick())
+Mỗi reading mới chỉ tốn O(1) cho mỗi rule (rolling window bằng deque).
+"""
+
+import json
+import math
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import datetime, timezone
+
+OPERATORS = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+
+
+def reading_value(record, field):
+    """Field value of a reading, or None when missing/NaN"""
+    value = record.get(field)
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+class AlertRule:
+    """Base rule; evaluate() returns (active, value) or (None, value) when undecided"""
+    kind = 'rule'
+
+    def __init__(self, name, field=None, severity='warning', description=''):
+        self.name = name
+        self.field = field
+        self.severity = severity
+        self.description = description
+
+    def new_state(self):
+        return {}
+
+    def evaluate(self, state, timestamp, record):
+        return None, None
+
+    def tick(self, state, now_ms):
+        return None, None
+
+    def watch(self, state, now_ms):
+        """Called when a station is registered before it has reported"""
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'field': self.field,
+            'severity': self.severity,
+            'description': self.description,
+        }
+
+
+class ThresholdRule(AlertRule):
+    """Fires when field <op> value; resolves once the opposite side of `clear` is reached"""
+    kind = 'threshold'
+
+    def __init__(self, name, field, op, value, clear=None, **kwargs):
+        super().__init__(name, field, **kwargs)
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator {op!r} in rule {name}")
+        self.op = op
+        self.value = value
+        self.clear = value if clear is None else clear
+
+    def evaluate(self, state, timestamp, record):
+        value = reading_value(record, self.field)
+        if value is None:
+            return None, None
+        if OPERATORS[self.op](value, self.value):
+            return True, value
+        if state.get('active') and OPERATORS[self.op](value, self.clear):
+            # Inside the hysteresis band: stay firing
+            return True, value
+        return False, value
+
+    def to_dict(self):
+        return {**super().to_dict(), 'op': self.op, 'value': self.value, 'clear': self.clear}
+
+
+class RateOfChangeRule(AlertRule):
+    """
+    Fires when the change of a field over `window_minutes` reaches `change` (negative = drop).
+    The reference reading must be within `tolerance_minutes` before the window start, so a
+    change across a data gap is not reported as a change over the window.
+    """
+    kind = 'rate_of_change'
+
+    def __init__(self, name, field, window_minutes, change, tolerance_minutes=15, **kwargs):
+        super().__init__(name, field, **kwargs)
+        self.window_ms = int(window_minutes * 60 * 1000)
+        self.window_minutes = window_minutes
+        self.change = change
+        self.tolerance_minutes = tolerance_minutes
+        self.tolerance_ms = int(tolerance_minutes * 60 * 1000)
+
+    def new_state(self):
+        return {'window': deque()}
+
+    def evaluate(self, state, timestamp, record):
+        value = reading_value(record, self.field)
+        if value is None:
+            return None, None
+        window = state['window']
+        window.append((timestamp, value))
+        # Keep exactly one reading at or before the window start (amortized O(1))
+        start = timestamp - self.window_ms
+        while len(window) > 1 and window[1][0] <= start:
+            window.popleft()
+        oldest_ts, oldest_value = window[0]
+        if oldest_ts > start or oldest_ts < start - self.tolerance_ms:
+            # Not enough history to cover the window yet, or only from before a gap
+            return None, None
+        delta = round(value - oldest_value, 3)
+        if self.change < 0:
+            return delta <= self.change, delta
+        return delta >= self.change, delta
+
+    def to_dict(self):
+        return {**super().to_dict(), 'window_minutes': self.window_minutes, 'change': self.change,
+                'tolerance_minutes': self.tolerance_minutes}
+
+
+class NoDataRule(AlertRule):
+    """Fires when no reading has arrived for `minutes`"""
+    kind = 'no_data'
+
+    def __init__(self, name, minutes, **kwargs):
+        super().__init__(name, None, **kwargs)
+        self.minutes = minutes
+        self.timeout_ms = int(minutes * 60 * 1000)
+
+    def evaluate(self, state, timestamp, record):
+        # A reading arriving can only resolve; firing is decided by tick()
+        state['last_ts'] = max(state.get('last_ts', 0), timestamp)
+        return False, 0.0
+
+    def watch(self, state, now_ms):
+        state.setdefault('watched_at', now_ms)
+
+    def tick(self, state, now_ms):
+        # A station that has never reported is silent since it was registered
+        last_ts = state.get('last_ts', state.get('watched_at'))
+        if last_ts is None:
+            return None, None
+        silence_minutes = round((now_ms - last_ts) / 60000, 1)
+        return now_ms - last_ts > self.timeout_ms, silence_minutes
+
+    def to_dict(self):
+        return {**super().to_dict(), 'minutes': self.minutes}
+
+
+RULE_KINDS = {
+    ThresholdRule.kind: ThresholdRule,
+    RateOfChangeRule.kind: RateOfChangeRule,
+    NoDataRule.kind: NoDataRule,
+}
+
+
+def build_rule(spec):
+    """Build a rule from a dict like {"kind": "threshold", "name": ..., ...}"""
+    spec = dict(spec)
+    kind = spec.pop('kind')
+    if kind not in RULE_KINDS:
+        raise ValueError(f"Unknown alert rule kind: {kind}")
+    return RULE_KINDS[kind](**spec)
+
+
+def default_rules():
+    return [
+        ThresholdRule('high_temperature', 'temperature', '>', 38.0, clear=37.0,
+                      description='Nhiệt độ trên 38°C'),
+        ThresholdRule('strong_gust', 'gust_windSpd', '>', 60.0, clear=50.0, severity='critical',
+                      description='Gió giật trên 60 km/h'),
+        RateOfChangeRule('pressure_drop_3h', 'pressure', 180, -3.0, severity='critical',
+                         description='Áp suất giảm ≥ 3 hPa trong 3 giờ (dấu hiệu bão)'),
+        NoDataRule('no_data', 15, description='Không nhận được dữ liệu trong 15 phút'),
+    ]
+
+
+def load_rules(path=None):
+    """Rules from a JSON file (list of rule specs), or the defaults"""
+    if not path:
+        return default_rules()
+    with open(path, 'r') as f:
+        return [build_rule(spec) for spec in json.load(f)]
+
+
+class LogSink:
+    """Prints events and keeps the last ones in memory (for testing)"""
+
+    def __init__(self, max_events=200):
+        self.events = deque(maxlen=max_events)
+
+    def send(self, event):
+        icon = '🚨' if event['state'] == 'firing' else '✅'
+        print(f"{icon} Alert {event['rule']} {event['state']} ({event['station']}): value={event['value']}")
+        self.events.append(event)
+
+
+class WebhookSink:
+    """POSTs events as JSON to a URL from a background thread"""
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=1000)
+        self._thread = threading.Thread(target=self._run, name='alert-webhook', daemon=True)
+        self._thread.start()
+
+    def send(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            print(f"⚠️ Alert webhook queue full, dropping {event['rule']} {event['state']}")
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            try:
+                body = json.dumps(event).encode('utf-8')
+                req = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+                urllib.request.urlopen(req, timeout=self.timeout).close()
+            except Exception as e:
+                print(f"❌ Alert webhook failed: {e}")
+
+
+class AlertEngine:
+    """Keeps per-(station, rule) state and emits firing/resolved events to the sinks"""
+
+    def __init__(self, rules, sinks=None, max_events=200, max_event_age_minutes=60):
+        self.rules = list(rules)
+        self.sinks = list(sinks or [])
+        self.max_event_age_ms = int(max_event_age_minutes * 60 * 1000)
+        self._states = {}       # (station, rule name) -> state dict
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def _state(self, station, rule):
+        key = (station, rule.name)
+        if key not in self._states:
+            self._states[key] = {**rule.new_state(), 'active': False, 'since': None, 'value': None}
+        return self._states[key]
+
+    def observe(self, station, pairs):
+        """Evaluate every rule on new (push_id, record) pairs, oldest first"""
+        now_ms = int(time.time() * 1000)
+        with self._lock:
+            for _, record in sorted(pairs, key=lambda pair: pair[0]):
+                timestamp = int(record['datetime'].timestamp() * 1000)
+                # Backfilled history only builds state; events are for recent readings
+                live = now_ms - timestamp <= self.max_event_age_ms
+                for rule in self.rules:
+                    state = self._state(station, rule)
+                    active, value = rule.evaluate(state, timestamp, record)
+                    self._apply(station, rule, state, active, value, timestamp, live)
+
+    def watch(self, station, now_ms=None):
+        """Register a station before its first reading, so no-data rules can fire for it"""
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        with self._lock:
+            for rule in self.rules:
+                rule.watch(self._state(station, rule), now_ms)
+
+    def tick(self, now_ms=None):
+        """Time-based checks (e.g. no data for N minutes)"""
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        with self._lock:
+            for (station, name), state in list(self._states.items()):
+                rule = next((rule for rule in self.rules if rule.name == name), None)
+                if rule is None:
+                    continue
+                active, value = rule.tick(state, now_ms)
+                self._apply(station, rule, state, active, value, now_ms, True)
+
+    def _apply(self, station, rule, state, active, value, timestamp, live):
+        if active is None:
+            return
+        state['value'] = value
+        if active == state['active']:
+            return
+        state['active'] = active
+        state['since'] = timestamp
+        event = {
+            'rule': rule.name,
+            'station': station,
+            'state': 'firing' if active else 'resolved',
+            'severity': rule.severity,
+            'value': value,
+            'description': rule.description,
+            'at': datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).isoformat(),
+        }
+        if not live:
+            return
+        self._events.append(event)
+        for sink in self.sinks:
+            try:
+                sink.send(event)
+            except Exception as e:
+                print(f"❌ Alert sink {type(sink).__name__} failed: {e}")
+
+    def status(self, station=None):
+        with self._lock:
+            result = []
+            for rule in self.rules:
+                for (st, name), state in self._states.items():
+                    if name != rule.name or (station is not None and st != station):
+                        continue
+                    since = state['since']
+                    result.append({
+                        **rule.to_dict(),
+                        'station': st,
+                        'state': 'firing' if state['active'] else 'ok',
+                        'value': state['value'],
+                        'since': datetime.fromtimestamp(since / 1000, tz=timezone.utc).isoformat() if since else None,
+                    })
+            return result
+
+    def events(self, limit=50):
+        """Newest first, at most `limit` events (none for limit <= 0)"""
+        if limit <= 0:
+            return []
+        with self._lock:
+            return list(self._events)[-limit:][::-1]
+
+
+class AlertTicker:
+    """Background thread: sync new data, then run the time-based checks"""
+
+    def __init__(self, engine, sync=None, interval_seconds=60):
+        self.engine = engine
+        self.sync = sync
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='alert-ticker', daemon=True)
+        self._thread.start()
+        print(f"⏰ Alert ticker started (every {self.interval_seconds}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                if self.sync:
+                    self.sync()
+                self.engine.tick()
+            except Exception as e:
+                print(f"❌ Alert tick failed: {e}")
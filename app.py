@@ -1,34 +1,116 @@
 from flask import Flask, render_template, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 import firebase_admin
 from firebase_admin import credentials, db
 import os
 from dotenv import load_dotenv
-from datetime import datetime, timedelta, timezone, date
+from datetime import datetime, timedelta, timezone
 import json
+import math
+import threading
 import pytz
+from config import Config
+from quantile_sketch import DailySketchStore
+from push_ids import decode_firebase_timestamp, parse_cursor
+from retention import RetentionEngine, RetentionWorker, default_tiers
+from alerts import AlertEngine, AlertTicker, LogSink, WebhookSink, load_rules
+from chart_views import MaterializedViews
+from profiling import RequestProfiler, is_admin, span
+from firebase_access import CircuitBreaker, FirebaseAccess, FirebaseUnavailable, StaleWhileRevalidate
+from data_sources import FirebaseSource, ReplaySource
+from validation import READING_FIELDS, BatchValidator, QuarantineStore
+from aggregation import AGGREGATIONS, TimeSeriesStore, parse_bucket, to_json_lists
+from derived_metrics import DERIVED_FIELDS, VECTOR_DIRECTIONS, WIND_VECTORS, DerivedMetrics, mean_wind_direction
+from wind_rose import WindRoseStore
+from weather_store import WeatherStore
 
 # Load environment variables
 load_dotenv()
 
+class CleanJSON(dict):
+    """Payload already free of NaN (e.g. to_json_lists output): nan_to_none does not walk it again"""
+
+def nan_to_none(value):
+    """Replace NaN (missing readings) with None so responses stay valid JSON"""
+    if isinstance(value, CleanJSON):
+        return value
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, dict):
+        return {key: nan_to_none(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [nan_to_none(item) for item in value]
+    return value
+
+class WeatherJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes missing readings (NaN) as null"""
+    def dumps(self, obj, **kwargs):
+        with span('jsonify'):
+            return super().dumps(nan_to_none(obj), **kwargs)
+
 app = Flask(__name__)
+app.json = WeatherJSONProvider(app)
+
+# Opt-in per-request profiling; slow requests are kept in a ring buffer
+request_profiler = RequestProfiler(
+    admin_token=Config.ADMIN_TOKEN,
+    sample_rate=Config.PROFILE_SAMPLE_RATE,
+    slow_ms=Config.PROFILE_SLOW_MS,
+    max_entries=Config.PROFILE_MAX_ENTRIES,
+    public_timing=Config.PROFILE_PUBLIC_TIMING,
+    stack_sample_ms=Config.PROFILE_STACK_SAMPLE_MS
+)
+request_profiler.init_app(app)
 
 # Vietnam timezone
 VN_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
 
-# Firebase Push ID decoding constants
-PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+# Station ID (Firebase path prefix, e.g. "0001/push")
+STATION_ID = Config.STATION_ID
 
-def decode_firebase_timestamp(push_id):
-    """Decode Firebase Push ID to get actual timestamp"""
-    try:
-        timestamp_b64 = push_id[0:8]
-        timestamp = 0
-        for i in range(0, 8):
-            timestamp += PUSH_CHARS.index(timestamp_b64[i]) * (64**(7-i))
-        return timestamp
-    except Exception as e:
-        print(f"Error decoding timestamp from {push_id}: {e}")
-        return None
+# Per-station, per-day quantile sketches updated on ingest
+sketch_store = DailySketchStore(k=Config.QUANTILE_SKETCH_K)
+
+# Validated records, grown incrementally from new push IDs only
+weather_store = WeatherStore()
+
+# Buckets and days aligned to Vietnam midnight
+VN_OFFSET_MS = int(datetime.now(VN_TZ).utcoffset().total_seconds() * 1000)
+
+# Derived fields (dew point, heat index, rain rate, pressure tendency, wind u/v) computed once at ingest
+derived_metrics = DerivedMetrics()
+AGGREGATE_FIELDS = READING_FIELDS + DERIVED_FIELDS
+
+# Columnar copy of the readings + 5m/1h rollups for /api/aggregate (wind direction means from u/v sums)
+series_store = TimeSeriesStore(
+    AGGREGATE_FIELDS,
+    offset_ms=VN_OFFSET_MS,
+    max_buckets=Config.AGGREGATE_MAX_BUCKETS,
+    vector_fields=VECTOR_DIRECTIONS
+)
+
+# Per-day direction x speed histograms for /api/wind-rose
+wind_rose_store = WindRoseStore(offset_ms=VN_OFFSET_MS)
+
+# Batch validation of ingest chunks; rejected/masked rows go to quarantine
+quarantine_store = QuarantineStore(max_items=Config.QUARANTINE_MAX_ITEMS)
+batch_validator = BatchValidator(
+    quarantine=quarantine_store,
+    spike_window=Config.VALIDATION_SPIKE_WINDOW,
+    stuck_run=Config.VALIDATION_STUCK_RUN
+)
+
+# Alert rules evaluated incrementally on every ingested reading
+alert_sinks = [LogSink()]
+if Config.ALERT_WEBHOOK_URL:
+    alert_sinks.append(WebhookSink(Config.ALERT_WEBHOOK_URL))
+alert_engine = AlertEngine(
+    load_rules(Config.ALERT_RULES_FILE),
+    sinks=alert_sinks,
+    max_event_age_minutes=Config.ALERT_MAX_EVENT_AGE_MINUTES
+)
+# no_data also fires for a station that has not reported since startup
+alert_engine.watch(STATION_ID)
 
 # Initialize Firebase Admin SDK
 def initialize_firebase():
@@ -60,7 +142,8 @@ def initialize_firebase():
                     return None
             
             firebase_admin.initialize_app(cred, {
-                'databaseURL': 'https://esp-sensor-station-default-rtdb.asia-southeast1.firebasedatabase.app'
+                'databaseURL': 'https://esp-sensor-station-default-rtdb.asia-southeast1.firebasedatabase.app',
+                'httpTimeout': Config.FIREBASE_INITIAL_TIMEOUT_SECONDS
             })
             print("✅ Firebase initialized successfully")
         except Exception as e:
@@ -79,127 +162,426 @@ def initialize_firebase():
 # Initialize Firebase
 db_ref = initialize_firebase()
 
-# Get weather data from Firebase Realtime Database
-def get_firebase_weather_data():
-    """Get weather data from Firebase Realtime Database"""
-    if not db_ref:
-        print("❌ Firebase not available")
-        return []
+def ingest_weather_records(station, raw_items):
+    """Ingest path: validate a chunk of raw (push_id, record) pairs, store accepted rows, update statistics"""
+    if not raw_items:
+        return 0
+    with span('validate'):
+        result = batch_validator.validate(station, raw_items)
+    with span('derive'):
+        result.columns.update(derived_metrics.compute(station, result.timestamps, result.columns))
+        pairs = result.records(VN_TZ)
+    with span('ingest'):
+        added = weather_store.append(station, pairs, watermark=max(key for key, _ in raw_items))
+        sketch_store.ingest(station, pairs)
+        series_store.append(station, result.timestamps, result.columns, keys=result.keys)
+        wind_rose_store.ingest(station, result.timestamps, result.columns)
+        alert_engine.observe(station, pairs)
     
+    stats = result.stats
+    print(f"📥 Ingested {added} new records for station {station} "
+          f"({stats['rejected']} rejected, {stats['masked']} masked, {stats['duration_ms']} ms)")
+    return added
+
+# Firebase reads (push records, compacted history, retention batches) go through timeouts, retries
+# and a circuit breaker; retention writes and deletes are plain update() calls on its worker thread
+firebase_access = FirebaseAccess(
+    timeout=Config.FIREBASE_TIMEOUT_SECONDS,
+    retries=Config.FIREBASE_RETRIES,
+    backoff_seconds=Config.FIREBASE_BACKOFF_SECONDS,
+    breaker=CircuitBreaker(
+        failure_threshold=Config.FIREBASE_BREAKER_FAILURES,
+        reset_seconds=Config.FIREBASE_BREAKER_RESET_SECONDS
+    )
+)
+
+# Retention: compact old raw readings into 5m/1h aggregates, optionally archive and prune
+retention_engine = RetentionEngine(
+    db.reference,
+    STATION_ID,
+    tiers=default_tiers(Config.RETENTION_RAW_DAYS, Config.RETENTION_ROLLUP_DAYS),
+    state_file=Config.RETENTION_STATE_FILE,
+    archive_dir=Config.RETENTION_ARCHIVE_DIR or None,
+    prune=Config.RETENTION_PRUNE,
+    batch_size=Config.RETENTION_BATCH_SIZE,
+    validator=BatchValidator(
+        quarantine=quarantine_store,
+        spike_window=Config.VALIDATION_SPIKE_WINDOW,
+        stuck_run=Config.VALIDATION_STUCK_RUN
+    ),
+    access=firebase_access.call,
+    load_timeout=Config.FIREBASE_INITIAL_TIMEOUT_SECONDS
+)
+retention_worker = RetentionWorker(
+    retention_engine,
+    interval_seconds=Config.RETENTION_INTERVAL_SECONDS,
+    dry_run=Config.RETENTION_DRY_RUN
+)
+if db_ref and Config.RETENTION_ENABLED:
+    retention_worker.start()
+
+# Only one sync at a time (requests and the background ticker share it)
+sync_lock = threading.Lock()
+
+def create_data_source():
+    """Firebase by default; DATA_SOURCE=replay replays a captured push export (load/soak testing)"""
+    if Config.DATA_SOURCE == 'replay':
+        source = ReplaySource.from_file(
+            Config.REPLAY_FILE,
+            station=STATION_ID,
+            speed=Config.REPLAY_SPEED,
+            loop=Config.REPLAY_LOOP,
+            preload_minutes=Config.REPLAY_PRELOAD_MINUTES
+        )
+        print(f"🔁 Replay data source: {Config.REPLAY_FILE} at {Config.REPLAY_SPEED}× real time")
+        return source
+    return FirebaseSource(
+        db.reference,
+        firebase_access,
+        db_ref=db_ref,
+        initial_timeout=Config.FIREBASE_INITIAL_TIMEOUT_SECONDS
+    )
+
+data_source = create_data_source()
+
+# Persisted day sketches are restored once before any day is written back
+day_sketches_restored = False
+
+def sync_day_sketches():
+    """Restore persisted day sketches (days pruned from raw), then persist finished days at <station>/sketch"""
+    global day_sketches_restored
+    ref = db.reference(f'{STATION_ID}/sketch')
     try:
-        print("🔍 Đang lấy dữ liệu từ Firebase Realtime Database...")
+        if not day_sketches_restored:
+            oldest = datetime.now(VN_TZ).date() - timedelta(days=Config.RETENTION_RAW_DAYS + Config.RETENTION_ROLLUP_DAYS)
+            with span('sketch_get'):
+                stored = firebase_access.call(lambda: ref.order_by_key().start_at(oldest.isoformat()).get(),
+                                              'sketch_get', timeout=Config.FIREBASE_INITIAL_TIMEOUT_SECONDS)
+            restored = sketch_store.restore(STATION_ID, stored)
+            day_sketches_restored = True
+            if restored:
+                print(f"📊 Restored {restored} day sketches")
         
-        # Get data from path "0001/push" based on the export structure
-        ref = db.reference('0001/push')
-        data = ref.get()
+        days = sketch_store.unpersisted_days(STATION_ID, datetime.now(VN_TZ).date())
+        if days:
+            with span('sketch_save'):
+                firebase_access.call(lambda: ref.update(days), 'sketch_save')
+            sketch_store.mark_persisted(STATION_ID, days)
+    except FirebaseUnavailable as e:
+        print(f"⚠️ Day sketches not synced, retrying on the next sync: {e}")
+
+def sync_firebase_weather_data():
+    """Fetch push IDs newer than the watermark from the data source and run them through the ingest path"""
+    with sync_lock:
+        # Records of "<station>/push" newer than the last ingested one
+        watermark = weather_store.watermark(STATION_ID)
+        with span('firebase_get'):
+            data = data_source.fetch_since(STATION_ID, watermark)
         
-        if not data:
-            print("⚠️ Không có dữ liệu từ Firebase")
-            return []
+        # Validate and ingest the new chunk
+        added = ingest_weather_records(STATION_ID, list(data.items()))
         
-        # Convert Firebase data to list format
-        weather_data = []
-        for push_id, record in data.items():
+        # Compacted history is (re)loaded here after each retention run, never on the request path
+        if db_ref and not retention_engine.rollups_loaded:
             try:
-                # Decode timestamp from push ID
-                timestamp = decode_firebase_timestamp(push_id)
-                if timestamp:
-                    dt = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).astimezone(VN_TZ)
-                else:
-                    dt = datetime.now(VN_TZ)
-                
-                # Extract weather data
-                weather_record = {
-                    'datetime': dt,
-                    'temperature': float(record.get('temperature', 0)),
-                    'humidity': float(record.get('humidity', 0)),
-                    'pressure': float(record.get('pressure', 0)),
-                    'rain': float(record.get('rain', 0)),
-                    'sustain_windSpd': float(record.get('sustain_windSpd', 0)),
-                    'sustain_windDir': float(record.get('sustain_windDir', 0)),
-                    'gust_windSpd': float(record.get('gust_windSpd', 0)),
-                    'gust_windDir': float(record.get('gust_windDir', 0))
-                }
-                weather_data.append(weather_record)
-            except Exception as e:
-                print(f"Error processing record {push_id}: {e}")
-                continue
+                with span('rollup_get'):
+                    retention_engine.load_rollups()
+            except FirebaseUnavailable as e:
+                print(f"⚠️ Compacted history not loaded, retrying on the next sync: {e}")
         
-        # Sort by datetime (newest first)
-        weather_data.sort(key=lambda x: x['datetime'], reverse=True)
+        # Day sketches outlive the raw readings retention prunes
+        if db_ref and Config.RETENTION_PRUNE:
+            sync_day_sketches()
         
-        print(f"✅ Firebase data loaded: {len(weather_data)} records")
-        return weather_data
+        # Forget raw records retention has already compacted (and pruned from push)
+        if Config.RETENTION_PRUNE:
+            checkpoint = retention_engine.status().get('raw_checkpoint')
+            if checkpoint:
+                cutoff_ms = decode_firebase_timestamp(checkpoint)
+                weather_store.drop_before(STATION_ID, datetime.fromtimestamp(cutoff_ms / 1000, tz=timezone.utc))
+                series_store.drop_raw_before(STATION_ID, cutoff_ms)
         
-    except Exception as e:
-        print(f"❌ Error getting Firebase data: {e}")
-        return []
+        return added
+
+# Stale-while-revalidate: requests serve the last good data, syncs run in the background
+weather_refresher = StaleWhileRevalidate(
+    sync_firebase_weather_data,
+    fresh_seconds=Config.SYNC_FRESH_SECONDS,
+    stale_after_seconds=Config.STALE_AFTER_SECONDS
+)
+
+# Background sync + time-based alert checks (e.g. no data for N minutes)
+alert_ticker = AlertTicker(alert_engine, sync=weather_refresher.refresh_now, interval_seconds=Config.ALERT_TICK_SECONDS)
+if data_source.available and Config.ALERTS_BACKGROUND_SYNC:
+    alert_ticker.start()
 
-# Default weather data when Firebase is not available
-def get_default_weather_data():
-    """Return default weather data when Firebase is not available"""
-    now = datetime.now(VN_TZ)
-    data = []
+def refresh_weather_data():
+    """Refresh Firebase data if due (blocking only when nothing is cached yet)"""
+    if not data_source.available:
+        print("❌ Firebase not available")
+        return False
     
-    # Generate sample data for the last 30 days to test week/month views
-    for i in range(30):
-        dt = now - timedelta(days=i)
-        data.append({
-            'datetime': dt,
-            'temperature': 25.0 + (i % 10) - 5,  # Vary temperature
-            'humidity': 60.0 + (i % 20),  # Vary humidity
-            'pressure': 1013.25 + (i % 10) - 5,  # Vary pressure
-            'rain': round((i % 3) * 2.5 * 0.4, 0),  # Some rain days
-            'sustain_windSpd': 5.0 + (i % 8),  # Vary wind speed
-            'sustain_windDir': 180.0 + (i % 180),  # Vary wind direction
-            'gust_windSpd': 8.0 + (i % 12),  # Vary gust wind speed
-            'gust_windDir': 180.0 + (i % 180)  # Vary gust wind direction
-        })
+    print(f"🔍 Đang lấy dữ liệu từ {data_source.name}...")
+    return weather_refresher.ensure_fresh(has_data=weather_store.watermark(STATION_ID) is not None)
+
+def data_freshness():
+    """Staleness marker for API responses (last good sync, last error, circuit state)"""
+    return {
+        **weather_refresher.freshness(),
+        'circuit': firebase_access.breaker.status()['state']
+    }
+
+def no_data_response():
+    """503 when there is neither fresh nor cached Firebase data (never synthetic data)"""
+    print("⚠️ Không có dữ liệu Firebase (kể cả dữ liệu đã lưu)")
+    return jsonify({
+        'success': False,
+        'error': 'Không có dữ liệu: Firebase không khả dụng và chưa có dữ liệu đã lưu',
+        'freshness': data_freshness()
+    }), 503
+
+def load_weather_records():
+    """Ingested records plus compacted history, newest first (no Firebase call)"""
+    with span('load_records'):
+        weather_data = weather_store.records(STATION_ID)
+        if not weather_data:
+            return []
+        
+        # Add compacted history older than the oldest raw reading still in push (Firebase only)
+        if db_ref:
+            oldest = weather_data[-1]['datetime']
+            weather_data.extend(retention_engine.history_records(VN_TZ, before=oldest))
     
-    return data
+    # Sort by datetime (newest first)
+    with span('sort'):
+        weather_data.sort(key=lambda x: x['datetime'], reverse=True)
+    return weather_data
+
+def total_record_count():
+    """Number of records load_weather_records() would return, without copying them"""
+    count = weather_store.count(STATION_ID)
+    oldest = weather_store.oldest(STATION_ID)
+    if db_ref and oldest is not None:
+        count += len(retention_engine.history_records(VN_TZ, before=oldest))
+    return count
+
+def data_version(station):
+    """Changes whenever ingested data, compacted history or restored day sketches change"""
+    return f"{weather_store.version(station)}.{retention_engine.generation}.{sketch_store.generation}"
+
+# Get weather data from Firebase Realtime Database
+def get_firebase_weather_data():
+    """Get weather data from Firebase Realtime Database (last good data while Firebase is down)"""
+    refresh_weather_data()
+    
+    weather_data = load_weather_records()
+    if not weather_data:
+        print("⚠️ Không có dữ liệu từ Firebase")
+        return []
+    
+    print(f"✅ Firebase data loaded: {len(weather_data)} records")
+    return weather_data
 
 def filter_today_data(weather_data):
     """Filter weather data to only include today's records"""
-    today = date.today()
-    today_data = []
-    
-    for item in weather_data:
-        item_datetime = item.get('datetime')
-        if isinstance(item_datetime, datetime):
-            item_date = item_datetime.date()
-        elif isinstance(item_datetime, str):
-            try:
-                item_date = datetime.fromisoformat(item_datetime.replace('Z', '+00:00')).date()
-            except:
+    with span('filter_today_data'):
+        # Station day (same as today_weather_stats), not the server's local date
+        today = datetime.now(VN_TZ).date()
+        today_data = []
+        
+        for item in weather_data:
+            item_datetime = item.get('datetime')
+            if isinstance(item_datetime, str):
+                try:
+                    item_datetime = datetime.fromisoformat(item_datetime.replace('Z', '+00:00'))
+                except:
+                    continue
+            if not isinstance(item_datetime, datetime):
                 continue
-        else:
-            continue
-            
-        if item_date == today:
-            today_data.append(item)
+            if item_datetime.tzinfo is not None:
+                item_datetime = item_datetime.astimezone(VN_TZ)
+            item_date = item_datetime.date()
+                
+            if item_date == today:
+                today_data.append(item)
     
     return today_data
 
+def valid_values(values):
+    """Drop missing readings (None/NaN) before aggregating"""
+    return [value for value in values if value is not None and not math.isnan(value)]
+
+def mean_or_none(values):
+    """Mean of already-filtered values; None (JSON null) for an empty bucket instead of a fake 0"""
+    return float(sum(values) / len(values)) if values else None
+
+def rain_total(rains):
+    """Rain (mm) of a bucket's tip counts; None when no rain reading survived validation"""
+    return round(sum(rains) * 0.4, 0) if rains else None
+
+def reading_value(record, field):
+    """A record's reading as float; None when missing or masked (NaN)"""
+    value = record.get(field)
+    if value is None or math.isnan(value):
+        return None
+    return float(value)
+
+# Bucket list name -> reading field, for the week/month averages (directions come from the u/v lists)
+BUCKET_FIELDS = (
+    ('temperatures', 'temperature'), ('humidities', 'humidity'), ('pressures', 'pressure'), ('rains', 'rain'),
+    ('gust_windSpds', 'gust_windSpd'), ('gust_us', 'gust_u'), ('gust_vs', 'gust_v'),
+    ('sustain_windSpds', 'sustain_windSpd'), ('sustain_us', 'sustain_u'), ('sustain_vs', 'sustain_v')
+)
+
+def bucket_wind_direction(bucket, kind):
+    """Vector-mean wind direction of a week/month bucket (None when calm or the vectors cancel out)"""
+    direction = mean_wind_direction(bucket[f'{kind}_us'], bucket[f'{kind}_vs'])
+    return round(direction, 1) if direction is not None else None
+
+def get_percentiles(start_day, end_day=None):
+    """Percentiles (p5/p50/p95) for a day range, from the merged daily sketches"""
+    return sketch_store.percentiles(STATION_ID, start_day, end_day)
+
+def get_bucket_percentiles(day_ranges):
+    """Per-bucket percentile series (e.g. 'temperature_p95') for chart buckets given as (start_day, end_day)"""
+    series = {}
+    for start_day, end_day in day_ranges:
+        for field, values in get_percentiles(start_day, end_day).items():
+            for name, value in values.items():
+                series.setdefault(f'{field}_{name}', []).append(value)
+    return series
+
 @app.route('/')
 def index():
     """Trang chủ hiển thị dashboard"""
     return render_template('index.html')
 
+def build_weather_stats(today_data, total_records, last_update):
+    """Today's statistics shown on the dashboard"""
+    if not today_data:
+        # No data for today
+        return {
+            'total_records': total_records,
+            'today_records': 0,
+            'latest_temperature': None,
+            'latest_humidity': None,
+            'latest_pressure': None,
+            'avg_temperature': None,
+            'avg_humidity': None,
+            'max_temperature': None,
+            'min_temperature': None,
+            'percentiles': {},
+            'last_update': 'Không có dữ liệu hôm nay'
+        }
+    
+    temps = valid_values(item.get('temperature') for item in today_data)
+    humidities = valid_values(item.get('humidity') for item in today_data)
+    pressures = valid_values(item.get('pressure') for item in today_data)
+    
+    return {
+        'total_records': total_records,
+        'today_records': len(today_data),
+        'latest_temperature': float(temps[0]) if temps else None,
+        'latest_humidity': float(humidities[0]) if humidities else None,
+        'latest_pressure': float(pressures[0]) if pressures else None,
+        'avg_temperature': mean_or_none(temps),
+        'avg_humidity': mean_or_none(humidities),
+        'max_temperature': float(max(temps)) if temps else None,
+        'min_temperature': float(min(temps)) if temps else None,
+        'percentiles': get_percentiles(datetime.now(VN_TZ).date()),
+        'last_update': last_update
+    }
+
+def datetime_to_ms(value):
+    return int(value.timestamp() * 1000)
+
+def parse_since_arg():
+    """
+    `since` query parameter as a timestamp (ms), None when absent; ValueError when malformed.
+    Also None when the client's `history` version is not the current one: compacted history
+    changed behind the cursor, so the client gets a full response instead of a delta.
+    """
+    since = request.args.get('since')
+    if not since:
+        return None
+    since_ms = parse_cursor(since, VN_TZ)
+    history = request.args.get('history')
+    if history is not None and history != str(retention_engine.generation):
+        return None
+    return since_ms
+
+def bad_cursor_response(error):
+    return jsonify({
+        'success': False,
+        'error': f"Tham số since không hợp lệ (push ID, timestamp hoặc ISO datetime): {error}"
+    }), 400
+
+# Today's stats for delta polls: (data version, day) -> stats, rebuilt only when one of them changes
+today_stats_cache = {}
+
+def today_weather_stats():
+    """Stats of today's records, built once per data version and day instead of on every delta poll"""
+    today = datetime.now(VN_TZ).date()
+    key = (data_version(STATION_ID), today)
+    cached = today_stats_cache.get(STATION_ID)
+    if cached and cached[0] == key:
+        return cached[1]
+    
+    with span('today_stats'):
+        today_start = VN_TZ.localize(datetime.combine(today, datetime.min.time()))
+        today_data = weather_store.records_since(STATION_ID, today_start - timedelta(microseconds=1))
+        last_update = today_data[0]['datetime'].isoformat() if today_data else None
+        stats = build_weather_stats(today_data, total_record_count(), last_update)
+    today_stats_cache[STATION_ID] = (key, stats)
+    return stats
+
+def get_weather_data_since(since_ms):
+    """Delta of /api/weather-data: only records newer than the cursor, stats from today's records"""
+    refresh_weather_data()
+    since_dt = datetime.fromtimestamp(since_ms / 1000, tz=timezone.utc)
+    new_data = weather_store.records_since(STATION_ID, since_dt)
+    stats = today_weather_stats()
+    
+    # Newest record held, so a cursor past it (clock skew, bogus value) is not echoed back forever
+    newest = weather_store.newest(STATION_ID)
+    cursor = datetime_to_ms(newest) if newest is not None else since_ms
+    for item in new_data:
+        item['datetime'] = item['datetime'].isoformat()
+    
+    print(f"✅ Firebase data delta since {since_ms}: {len(new_data)} new records")
+    return jsonify({
+        'success': True,
+        'data': new_data,
+        'stats': stats,
+        'count': len(new_data),
+        'delta': True,
+        'cursor': cursor,
+        'history': retention_engine.generation,
+        'source': 'firebase',
+        'freshness': data_freshness()
+    })
+
 @app.route('/api/weather-data')
 def get_weather_data():
-    """API endpoint để lấy dữ liệu thời tiết từ CSV hoặc Firebase"""
+    """API endpoint để lấy dữ liệu thời tiết từ Firebase (?since= để chỉ lấy bản ghi mới)"""
     try:
+        try:
+            since_ms = parse_since_arg()
+        except ValueError as e:
+            return bad_cursor_response(e)
+        if since_ms is not None:
+            return get_weather_data_since(since_ms)
+        
         # Always use Firebase data
         print("🔥 Sử dụng Firebase data")
         firebase_data = get_firebase_weather_data()
         
         if not firebase_data:
-            # Fallback to default data if Firebase is empty
-            print("⚠️ Firebase data empty, falling back to default")
-            firebase_data = get_default_weather_data()
+            return no_data_response()
         
         # Sort data by datetime (newest first) for proper display
         firebase_data.sort(key=lambda x: x.get('datetime', datetime.now(VN_TZ)), reverse=True)
+        cursor = datetime_to_ms(firebase_data[0]['datetime'])
         
         # Convert datetime objects to ISO string format for JSON serialization
         for item in firebase_data:
@@ -210,37 +592,7 @@ def get_weather_data():
         today_data = filter_today_data(firebase_data)
         
         # Calculate statistics from today's data only
-        if today_data:
-            temps = [item.get('temperature', 0) for item in today_data]
-            humidities = [item.get('humidity', 0) for item in today_data]
-            pressures = [item.get('pressure', 0) for item in today_data]
-            
-            stats = {
-                'total_records': len(firebase_data),
-                'today_records': len(today_data),
-                'latest_temperature': float(temps[0]) if temps else 0,
-                'latest_humidity': float(humidities[0]) if humidities else 0,
-                'latest_pressure': float(pressures[0]) if pressures else 0,
-                'avg_temperature': float(sum(temps) / len(temps)) if temps else 0,
-                'avg_humidity': float(sum(humidities) / len(humidities)) if humidities else 0,
-                'max_temperature': float(max(temps)) if temps else 0,
-                'min_temperature': float(min(temps)) if temps else 0,
-                'last_update': firebase_data[0].get('datetime', datetime.now(VN_TZ).isoformat())
-            }
-        else:
-            # No data for today
-            stats = {
-                'total_records': len(firebase_data),
-                'today_records': 0,
-                'latest_temperature': 0,
-                'latest_humidity': 0,
-                'latest_pressure': 0,
-                'avg_temperature': 0,
-                'avg_humidity': 0,
-                'max_temperature': 0,
-                'min_temperature': 0,
-                'last_update': 'Không có dữ liệu hôm nay'
-            }
+        stats = build_weather_stats(today_data, len(firebase_data), firebase_data[0].get('datetime'))
         
         print(f"✅ Firebase data processed: {len(firebase_data)} records")
         return jsonify({
@@ -248,7 +600,11 @@ def get_weather_data():
             'data': firebase_data,
             'stats': stats,
             'count': len(firebase_data),
-            'source': 'firebase'
+            'delta': False,
+            'cursor': cursor,
+            'history': retention_engine.generation,
+            'source': 'firebase',
+            'freshness': data_freshness()
         })
     except Exception as e:
         print(f"❌ Error in get_weather_data: {e}")
@@ -259,19 +615,24 @@ def get_weather_data():
 
 @app.route('/api/weather-chart-data')
 def get_weather_chart_data():
-    """API endpoint để lấy dữ liệu cho biểu đồ"""
+    """API endpoint để lấy dữ liệu cho biểu đồ (?since= chỉ trả điểm mới)"""
     try:
+        try:
+            since_ms = parse_since_arg()
+        except ValueError as e:
+            return bad_cursor_response(e)
+        
         # Always use Firebase data
         print("🔥 Sử dụng Firebase data cho chart")
         firebase_data = get_firebase_weather_data()
         
         if not firebase_data:
-            # Fallback to default data if Firebase is empty
-            print("⚠️ Firebase data empty for chart, falling back to default")
-            firebase_data = get_default_weather_data()
+            return no_data_response()
         
         # Get last 10 records for chart
         chart_data = firebase_data[:10] if len(firebase_data) > 10 else firebase_data
+        if since_ms is not None:
+            chart_data = [item for item in chart_data if datetime_to_ms(item['datetime']) > since_ms]
         
         # Prepare data for charts with better formatting
         chart_data_dict = {
@@ -284,14 +645,19 @@ def get_weather_chart_data():
             'gust_windSpd': [item.get('gust_windSpd', 0) for item in chart_data],
             'gust_windDir': [item.get('gust_windDir', 0) for item in chart_data],
             'sustain_windSpd': [item.get('sustain_windSpd', 0) for item in chart_data],
-            'sustain_windDir': [item.get('sustain_windDir', 0) for item in chart_data]
+            'sustain_windDir': [item.get('sustain_windDir', 0) for item in chart_data],
+            'bucket_end_ms': [datetime_to_ms(item['datetime']) for item in chart_data]
         }
         
         print(f"✅ Firebase chart data prepared: {len(chart_data_dict['timestamps'])} points")
         return jsonify({
             'success': True,
             'data': chart_data_dict,
-            'source': 'firebase'
+            'source': 'firebase',
+            'delta': since_ms is not None,
+            'cursor': datetime_to_ms(firebase_data[0]['datetime']),
+            'history': retention_engine.generation,
+            'freshness': data_freshness()
         })
     except Exception as e:
         print(f"❌ Error in get_weather_chart_data: {e}")
@@ -300,91 +666,96 @@ def get_weather_chart_data():
             'error': str(e)
         }), 500
 
+def build_weather_summary(today_data, latest):
+    """Dashboard summary: current readings of the latest record, today's high/low/averages"""
+    if today_data:
+        # Use latest data from today
+        latest = today_data[0]
+        
+        # Calculate today's statistics
+        today_temps = valid_values(item.get('temperature') for item in today_data)
+        today_humidities = valid_values(item.get('humidity') for item in today_data)
+        today_rains = valid_values(item.get('rain') for item in today_data)
+        today_stats = {
+            'today_high': float(max(today_temps)) if today_temps else None,
+            'today_low': float(min(today_temps)) if today_temps else None,
+            'today_avg_temp': mean_or_none(today_temps),
+            'today_avg_humidity': mean_or_none(today_humidities),
+            'rain_today': rain_total(today_rains),
+            'today_percentiles': get_percentiles(datetime.now(VN_TZ).date()),
+            'last_update': latest.get('datetime', datetime.now()).strftime('%I:%M:%S %p')
+        }
+    else:
+        # No data for today - use latest available data for current readings but null for today's stats
+        today_stats = {
+            'today_high': None,
+            'today_low': None,
+            'today_avg_temp': None,
+            'today_avg_humidity': None,
+            'rain_today': None,
+            'today_percentiles': {},
+            'last_update': 'Không có dữ liệu hôm nay'
+        }
+    
+    return {
+        'current_temp': reading_value(latest, 'temperature'),
+        'current_humidity': reading_value(latest, 'humidity'),
+        'current_pressure': reading_value(latest, 'pressure'),
+        'today_high': today_stats['today_high'],
+        'today_low': today_stats['today_low'],
+        'today_avg_temp': today_stats['today_avg_temp'],
+        'today_avg_humidity': today_stats['today_avg_humidity'],
+        'wind_speed': reading_value(latest, 'sustain_windSpd'),
+        'wind_direction': reading_value(latest, 'sustain_windDir'),
+        'rain_today': today_stats['rain_today'],
+        'gust_wind_speed': reading_value(latest, 'gust_windSpd'),
+        'gust_wind_direction': reading_value(latest, 'gust_windDir'),
+        'sustain_wind_direction': reading_value(latest, 'sustain_windDir'),
+        'dew_point': latest.get('dew_point'),
+        'heat_index': latest.get('heat_index'),
+        'rain_rate': latest.get('rain_rate'),
+        'pressure_tendency_3h': latest.get('pressure_tendency_3h'),
+        'today_percentiles': today_stats['today_percentiles'],
+        'last_update': today_stats['last_update']
+    }
+
+# Today's summary: (data version, day) -> summary, like today_stats_cache
+today_summary_cache = {}
+
+def today_weather_summary():
+    """Summary built from today's records once per data version and day (None when nothing is stored)"""
+    today = datetime.now(VN_TZ).date()
+    key = (data_version(STATION_ID), today)
+    cached = today_summary_cache.get(STATION_ID)
+    if cached and cached[0] == key:
+        return cached[1]
+    
+    latest = weather_store.latest(STATION_ID)
+    if latest is None:
+        return None
+    with span('today_summary'):
+        today_start = VN_TZ.localize(datetime.combine(today, datetime.min.time()))
+        today_data = weather_store.records_since(STATION_ID, today_start - timedelta(microseconds=1))
+        summary = build_weather_summary(today_data, latest)
+    today_summary_cache[STATION_ID] = (key, summary)
+    return summary
+
 @app.route('/api/weather-summary')
 def get_weather_summary():
     """API endpoint để lấy tổng quan thời tiết"""
     try:
-        # Always use Firebase data
-        print("🔥 Sử dụng Firebase data cho summary")
-        firebase_data = get_firebase_weather_data()
-        
-        if not firebase_data:
-            # Fallback to default data if Firebase is empty
-            print("⚠️ Firebase data empty for summary, falling back to default")
-            firebase_data = get_default_weather_data()
-        
-        # Filter data for today only
-        today_data = filter_today_data(firebase_data)
-        
-        if today_data:
-            # Use latest data from today
-            latest = today_data[0]
-            
-            # Calculate today's statistics
-            today_temps = [item.get('temperature', 0) for item in today_data]
-            today_humidities = [item.get('humidity', 0) for item in today_data]
-            today_rains = [item.get('rain', 0) for item in today_data]
-            
-            summary = {
-                'current_temp': float(latest.get('temperature', 0)),
-                'current_humidity': float(latest.get('humidity', 0)),
-                'current_pressure': float(latest.get('pressure', 0)),
-                'today_high': float(max(today_temps)) if today_temps else 0,
-                'today_low': float(min(today_temps)) if today_temps else 0,
-                'today_avg_temp': float(sum(today_temps) / len(today_temps)) if today_temps else 0,
-                'today_avg_humidity': float(sum(today_humidities) / len(today_humidities)) if today_humidities else 0,
-                'wind_speed': float(latest.get('sustain_windSpd', 0)),
-                'wind_direction': float(latest.get('sustain_windDir', 0)),
-                'rain_today': round(sum([rain * 0.4 for rain in today_rains]), 0) if today_rains else 0,
-                'gust_wind_speed': float(latest.get('gust_windSpd', 0)),
-                'gust_wind_direction': float(latest.get('gust_windDir', 0)),
-                'sustain_wind_direction': float(latest.get('sustain_windDir', 0)),
-                'last_update': latest.get('datetime', datetime.now()).strftime('%I:%M:%S %p')
-            }
-        else:
-            # No data for today - use latest available data for current readings but zero for today's stats
-            if firebase_data:
-                latest = firebase_data[0]
-                summary = {
-                    'current_temp': float(latest.get('temperature', 0)),
-                    'current_humidity': float(latest.get('humidity', 0)),
-                    'current_pressure': float(latest.get('pressure', 0)),
-                    'today_high': 0,
-                    'today_low': 0,
-                    'today_avg_temp': 0,
-                    'today_avg_humidity': 0,
-                    'wind_speed': float(latest.get('sustain_windSpd', 0)),
-                    'wind_direction': float(latest.get('sustain_windDir', 0)),
-                    'rain_today': 0,
-                    'gust_wind_speed': float(latest.get('gust_windSpd', 0)),
-                    'gust_wind_direction': float(latest.get('gust_windDir', 0)),
-                    'sustain_wind_direction': float(latest.get('sustain_windDir', 0)),
-                    'last_update': 'Không có dữ liệu hôm nay'
-                }
-            else:
-                # No data at all
-                summary = {
-                    'current_temp': 0,
-                    'current_humidity': 0,
-                    'current_pressure': 0,
-                    'today_high': 0,
-                    'today_low': 0,
-                    'today_avg_temp': 0,
-                    'today_avg_humidity': 0,
-                    'wind_speed': 0,
-                    'wind_direction': 0,
-                    'rain_today': 0,
-                    'gust_wind_speed': 0,
-                    'gust_wind_direction': 0,
-                    'sustain_wind_direction': 0,
-                    'last_update': 'Không có dữ liệu'
-                }
+        # Only today's records (and the latest one) are read, never the whole history
+        refresh_weather_data()
+        summary = today_weather_summary()
+        if summary is None:
+            return no_data_response()
         
         print(f"✅ Firebase summary prepared: temp={summary['current_temp']}°C")
         return jsonify({
             'success': True,
             'summary': summary,
-            'source': 'firebase'
+            'source': 'firebase',
+            'freshness': data_freshness()
         })
     except Exception as e:
         print(f"❌ Error in get_weather_summary: {e}")
@@ -398,161 +769,224 @@ def get_data_sources():
     """API endpoint để kiểm tra nguồn dữ liệu có sẵn"""
     sources = {
         'firebase': db_ref is not None,
-        'default': True  # Always available as fallback
+        'replay': data_source.name == 'replay',
+        'cache': len(weather_store) > 0  # Last good data, served while Firebase is down
     }
     
     print(f"🌐 API call: data-sources, available={sources}")
     return jsonify({
         'success': True,
-        'sources': sources
+        'sources': sources,
+        'active_source': data_source.status(),
+        'firebase_access': firebase_access.status(),
+        'freshness': data_freshness()
     })
 
+# Number of points/buckets each chart period shows (the client trims appended deltas to this)
+CHART_WINDOWS = {'day': 10, 'week': 7, 'month': 7}
+
+def day_end_ms(day):
+    """End (exclusive, ms) of a calendar day in Vietnam time"""
+    return datetime_to_ms(VN_TZ.localize(datetime.combine(day + timedelta(days=1), datetime.min.time())))
+
+def chart_delta(chart_data_dict, since_ms):
+    """Only the points/buckets added or changed after the cursor (bucket end later than since)"""
+    keep = [i for i, end in enumerate(chart_data_dict['bucket_end_ms']) if end > since_ms]
+    return {key: [values[i] for i in keep] for key, values in chart_data_dict.items()}
+
+def build_period_chart(firebase_data, period):
+    """Chart payload (chart_data_dict, period percentiles) for day/week/month"""
+    if period == 'day':
+        # Last 24 hours - show 10 points
+        now = datetime.now(VN_TZ)
+        start_time = now - timedelta(days=1)
+        print(f"🔍 Day period: now={now}, start_time={start_time}")
+        print(f"🔍 Total firebase data: {len(firebase_data)} records")
+        
+        filtered_data = [item for item in firebase_data if item.get('datetime', now) >= start_time]
+        print(f"🔍 Filtered data (last 24h): {len(filtered_data)} records")
+        
+        # If no data in last 24 hours, use last 10 records
+        if not filtered_data:
+            print("⚠️ No data in last 24h, using last 10 records")
+            filtered_data = firebase_data[:10] if len(firebase_data) > 10 else firebase_data
+        
+        chart_data = filtered_data[:10] if len(filtered_data) > 10 else filtered_data
+        print(f"🔍 Final chart data: {len(chart_data)} records")
+        
+        # Sort by datetime (oldest to newest) to match week/month format
+        chart_data.sort(key=lambda x: x.get('datetime', now))
+        
+        chart_data_dict = {
+            'timestamps': [item.get('datetime', '').strftime('%H:%M') for item in chart_data],
+            'dates': [item.get('datetime', '').strftime('%d/%m') for item in chart_data],
+            'temperature': [item.get('temperature', 0) for item in chart_data],
+            'humidity': [item.get('humidity', 0) for item in chart_data],
+            'pressure': [item.get('pressure', 0) for item in chart_data],
+            'rain': [round(item.get('rain', 0) * 0.4, 0) for item in chart_data],
+            'gust_windSpd': [item.get('gust_windSpd', 0) for item in chart_data],
+            'gust_windDir': [item.get('gust_windDir', 0) for item in chart_data],
+            'sustain_windSpd': [item.get('sustain_windSpd', 0) for item in chart_data],
+            'sustain_windDir': [item.get('sustain_windDir', 0) for item in chart_data],
+            'bucket_end_ms': [datetime_to_ms(item['datetime']) for item in chart_data]
+        }
+        # Day sketches cover calendar days: the last 24 hours span yesterday and today
+        percentile_days = (start_time.date(), now.date())
+        
+    elif period == 'week':
+        # Last 7 days - calculate daily averages
+        now = datetime.now(VN_TZ)
+        daily_data = {}
+        
+        for item in firebase_data:
+            item_date = item.get('datetime', now).date()
+            if item_date not in daily_data:
+                daily_data[item_date] = {key: [] for key, _ in BUCKET_FIELDS}
+            
+            for key, field in BUCKET_FIELDS:
+                value = item.get(field)
+                if value is not None and not math.isnan(value):
+                    daily_data[item_date][key].append(value)
+        
+        # Get last 7 days and calculate averages
+        dates = sorted(daily_data.keys(), reverse=True)[:7]
+        dates.reverse()  # Show oldest to newest
+        
+        chart_data_dict = {
+            'timestamps': [date.strftime('%H:%M') for date in dates],  # Use time format for consistency
+            'dates': [date.strftime('%d/%m') for date in dates],
+            'temperature': [mean_or_none(daily_data[date]['temperatures']) for date in dates],
+            'humidity': [mean_or_none(daily_data[date]['humidities']) for date in dates],
+            'pressure': [mean_or_none(daily_data[date]['pressures']) for date in dates],
+            'rain': [rain_total(daily_data[date]['rains']) for date in dates],  # Total rain per day
+            'gust_windSpd': [mean_or_none(daily_data[date]['gust_windSpds']) for date in dates],
+            'gust_windDir': [bucket_wind_direction(daily_data[date], 'gust') for date in dates],
+            'sustain_windSpd': [mean_or_none(daily_data[date]['sustain_windSpds']) for date in dates],
+            'sustain_windDir': [bucket_wind_direction(daily_data[date], 'sustain') for date in dates],
+            'bucket_end_ms': [day_end_ms(date) for date in dates]
+        }
+        
+        # Daily percentiles straight from the day sketches
+        chart_data_dict.update(get_bucket_percentiles([(day, day) for day in dates]))
+        percentile_days = (dates[0], dates[-1]) if dates else None
+        
+    elif period == 'month':
+        # Last 7 months - calculate monthly averages
+        now = datetime.now(VN_TZ)
+        monthly_data = {}
+        
+        for item in firebase_data:
+            item_month = item.get('datetime', now).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            if item_month not in monthly_data:
+                monthly_data[item_month] = {key: [] for key, _ in BUCKET_FIELDS}
+            
+            for key, field in BUCKET_FIELDS:
+                value = item.get(field)
+                if value is not None and not math.isnan(value):
+                    monthly_data[item_month][key].append(value)
+        
+        # Get last 7 months and calculate averages
+        months = sorted(monthly_data.keys(), reverse=True)[:7]
+        months.reverse()  # Show oldest to newest
+        month_ranges = [
+            (month.date(), (month + timedelta(days=32)).replace(day=1).date() - timedelta(days=1))
+            for month in months
+        ]
+        
+        chart_data_dict = {
+            'timestamps': [month.strftime('%H:%M') for month in months],  # Use time format for consistency
+            'dates': [month.strftime('%m/%Y') for month in months],
+            'temperature': [mean_or_none(monthly_data[month]['temperatures']) for month in months],
+            'humidity': [mean_or_none(monthly_data[month]['humidities']) for month in months],
+            'pressure': [mean_or_none(monthly_data[month]['pressures']) for month in months],
+            'rain': [rain_total(monthly_data[month]['rains']) for month in months],  # Total rain per month
+            'gust_windSpd': [mean_or_none(monthly_data[month]['gust_windSpds']) for month in months],
+            'gust_windDir': [bucket_wind_direction(monthly_data[month], 'gust') for month in months],
+            'sustain_windSpd': [mean_or_none(monthly_data[month]['sustain_windSpds']) for month in months],
+            'sustain_windDir': [bucket_wind_direction(monthly_data[month], 'sustain') for month in months],
+            'bucket_end_ms': [day_end_ms(month_end) for _, month_end in month_ranges]
+        }
+        
+        # Monthly percentiles by merging the day sketches of each month
+        chart_data_dict.update(get_bucket_percentiles(month_ranges))
+        percentile_days = (month_ranges[0][0], month_ranges[-1][1]) if month_ranges else None
+        
+    else:
+        # Default to last 10 records
+        chart_data = firebase_data[:10] if len(firebase_data) > 10 else firebase_data
+        
+        chart_data_dict = {
+            'timestamps': [item.get('datetime', '').strftime('%H:%M') for item in chart_data],
+            'dates': [item.get('datetime', '').strftime('%d/%m') for item in chart_data],
+            'temperature': [item.get('temperature', 0) for item in chart_data],
+            'humidity': [item.get('humidity', 0) for item in chart_data],
+            'pressure': [item.get('pressure', 0) for item in chart_data],
+            'rain': [round(item.get('rain', 0) * 0.4, 0) for item in chart_data],
+            'gust_windSpd': [item.get('gust_windSpd', 0) for item in chart_data],
+            'gust_windDir': [item.get('gust_windDir', 0) for item in chart_data],
+            'sustain_windSpd': [item.get('sustain_windSpd', 0) for item in chart_data],
+            'sustain_windDir': [item.get('sustain_windDir', 0) for item in chart_data],
+            'bucket_end_ms': [datetime_to_ms(item['datetime']) for item in chart_data]
+        }
+        percentile_days = None
+    
+    return chart_data_dict, percentile_days
+
+def build_chart_view(station, period):
+    """Materialized view builder: chart payload from the ingested records"""
+    firebase_data = load_weather_records()
+    if not firebase_data:
+        return None
+    with span('chart_build'):
+        chart_data_dict, percentile_days = build_period_chart(firebase_data, period)
+        period_percentiles = get_percentiles(*percentile_days) if percentile_days else {}
+    return {
+        'data': chart_data_dict,
+        'percentiles': period_percentiles,
+        # Calendar days the period percentiles were merged from
+        'percentile_days': [day.isoformat() for day in percentile_days] if percentile_days else None,
+        'cursor': datetime_to_ms(firebase_data[0]['datetime']),
+        'window': CHART_WINDOWS.get(period, 10)
+    }
+
+# (station, period) chart payloads, rebuilt once per data version and shared by all requests
+chart_views = MaterializedViews(build_chart_view)
+
 @app.route('/api/weather-chart-data/<period>')
 def get_weather_chart_data_by_period(period):
-    """API endpoint để lấy dữ liệu biểu đồ theo thời gian (day/week/month)"""
+    """API endpoint để lấy dữ liệu biểu đồ theo thời gian (day/week/month), ?since= chỉ trả phần thay đổi"""
     try:
-        print(f"🔥 Sử dụng Firebase data cho chart với period: {period}")
-        firebase_data = get_firebase_weather_data()
+        try:
+            since_ms = parse_since_arg()
+        except ValueError as e:
+            return bad_cursor_response(e)
         
-        if not firebase_data:
-            print("⚠️ Firebase data empty for chart, falling back to default")
-            firebase_data = get_default_weather_data()
-        
-        if period == 'day':
-            # Last 24 hours - show 10 points
-            now = datetime.now(VN_TZ)
-            start_time = now - timedelta(days=1)
-            print(f"🔍 Day period: now={now}, start_time={start_time}")
-            print(f"🔍 Total firebase data: {len(firebase_data)} records")
-            
-            filtered_data = [item for item in firebase_data if item.get('datetime', now) >= start_time]
-            print(f"🔍 Filtered data (last 24h): {len(filtered_data)} records")
-            
-            # If no data in last 24 hours, use last 10 records
-            if not filtered_data:
-                print("⚠️ No data in last 24h, using last 10 records")
-                filtered_data = firebase_data[:10] if len(firebase_data) > 10 else firebase_data
-            
-            chart_data = filtered_data[:10] if len(filtered_data) > 10 else filtered_data
-            print(f"🔍 Final chart data: {len(chart_data)} records")
-            
-            # Sort by datetime (oldest to newest) to match week/month format
-            chart_data.sort(key=lambda x: x.get('datetime', now))
-            
-            chart_data_dict = {
-                'timestamps': [item.get('datetime', '').strftime('%H:%M') for item in chart_data],
-                'dates': [item.get('datetime', '').strftime('%d/%m') for item in chart_data],
-                'temperature': [item.get('temperature', 0) for item in chart_data],
-                'humidity': [item.get('humidity', 0) for item in chart_data],
-                'pressure': [item.get('pressure', 0) for item in chart_data],
-                'rain': [round(item.get('rain', 0) * 0.4, 0) for item in chart_data],
-                'gust_windSpd': [item.get('gust_windSpd', 0) for item in chart_data],
-                'gust_windDir': [item.get('gust_windDir', 0) for item in chart_data],
-                'sustain_windSpd': [item.get('sustain_windSpd', 0) for item in chart_data],
-                'sustain_windDir': [item.get('sustain_windDir', 0) for item in chart_data]
-            }
-            
-        elif period == 'week':
-            # Last 7 days - calculate daily averages
-            now = datetime.now(VN_TZ)
-            daily_data = {}
-            
-            for item in firebase_data:
-                item_date = item.get('datetime', now).date()
-                if item_date not in daily_data:
-                    daily_data[item_date] = {
-                        'temperatures': [], 'humidities': [], 'pressures': [], 'rains': [],
-                        'gust_windSpds': [], 'gust_windDirs': [], 'sustain_windSpds': [], 'sustain_windDirs': []
-                    }
-                
-                daily_data[item_date]['temperatures'].append(item.get('temperature', 0))
-                daily_data[item_date]['humidities'].append(item.get('humidity', 0))
-                daily_data[item_date]['pressures'].append(item.get('pressure', 0))
-                daily_data[item_date]['rains'].append(item.get('rain', 0))
-                daily_data[item_date]['gust_windSpds'].append(item.get('gust_windSpd', 0))
-                daily_data[item_date]['gust_windDirs'].append(item.get('gust_windDir', 0))
-                daily_data[item_date]['sustain_windSpds'].append(item.get('sustain_windSpd', 0))
-                daily_data[item_date]['sustain_windDirs'].append(item.get('sustain_windDir', 0))
-            
-            # Get last 7 days and calculate averages
-            dates = sorted(daily_data.keys(), reverse=True)[:7]
-            dates.reverse()  # Show oldest to newest
-            
-            chart_data_dict = {
-                'timestamps': [date.strftime('%H:%M') for date in dates],  # Use time format for consistency
-                'dates': [date.strftime('%d/%m') for date in dates],
-                'temperature': [sum(daily_data[date]['temperatures']) / len(daily_data[date]['temperatures']) if daily_data[date]['temperatures'] else 0 for date in dates],
-                'humidity': [sum(daily_data[date]['humidities']) / len(daily_data[date]['humidities']) if daily_data[date]['humidities'] else 0 for date in dates],
-                'pressure': [sum(daily_data[date]['pressures']) / len(daily_data[date]['pressures']) if daily_data[date]['pressures'] else 0 for date in dates],
-                'rain': [round(sum(daily_data[date]['rains']) * 0.4, 0) for date in dates],  # Total rain per day
-                'gust_windSpd': [sum(daily_data[date]['gust_windSpds']) / len(daily_data[date]['gust_windSpds']) if daily_data[date]['gust_windSpds'] else 0 for date in dates],
-                'gust_windDir': [sum(daily_data[date]['gust_windDirs']) / len(daily_data[date]['gust_windDirs']) if daily_data[date]['gust_windDirs'] else 0 for date in dates],
-                'sustain_windSpd': [sum(daily_data[date]['sustain_windSpds']) / len(daily_data[date]['sustain_windSpds']) if daily_data[date]['sustain_windSpds'] else 0 for date in dates],
-                'sustain_windDir': [sum(daily_data[date]['sustain_windDirs']) / len(daily_data[date]['sustain_windDirs']) if daily_data[date]['sustain_windDirs'] else 0 for date in dates]
-            }
-            
-        elif period == 'month':
-            # Last 7 months - calculate monthly averages
-            now = datetime.now(VN_TZ)
-            monthly_data = {}
-            
-            for item in firebase_data:
-                item_month = item.get('datetime', now).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-                if item_month not in monthly_data:
-                    monthly_data[item_month] = {
-                        'temperatures': [], 'humidities': [], 'pressures': [], 'rains': [],
-                        'gust_windSpds': [], 'gust_windDirs': [], 'sustain_windSpds': [], 'sustain_windDirs': []
-                    }
-                
-                monthly_data[item_month]['temperatures'].append(item.get('temperature', 0))
-                monthly_data[item_month]['humidities'].append(item.get('humidity', 0))
-                monthly_data[item_month]['pressures'].append(item.get('pressure', 0))
-                monthly_data[item_month]['rains'].append(item.get('rain', 0))
-                monthly_data[item_month]['gust_windSpds'].append(item.get('gust_windSpd', 0))
-                monthly_data[item_month]['gust_windDirs'].append(item.get('gust_windDir', 0))
-                monthly_data[item_month]['sustain_windSpds'].append(item.get('sustain_windSpd', 0))
-                monthly_data[item_month]['sustain_windDirs'].append(item.get('sustain_windDir', 0))
-            
-            # Get last 7 months and calculate averages
-            months = sorted(monthly_data.keys(), reverse=True)[:7]
-            months.reverse()  # Show oldest to newest
-            
-            chart_data_dict = {
-                'timestamps': [month.strftime('%H:%M') for month in months],  # Use time format for consistency
-                'dates': [month.strftime('%m/%Y') for month in months],
-                'temperature': [sum(monthly_data[month]['temperatures']) / len(monthly_data[month]['temperatures']) if monthly_data[month]['temperatures'] else 0 for month in months],
-                'humidity': [sum(monthly_data[month]['humidities']) / len(monthly_data[month]['humidities']) if monthly_data[month]['humidities'] else 0 for month in months],
-                'pressure': [sum(monthly_data[month]['pressures']) / len(monthly_data[month]['pressures']) if monthly_data[month]['pressures'] else 0 for month in months],
-                'rain': [round(sum(monthly_data[month]['rains']) * 0.4, 0) for month in months],  # Total rain per month
-                'gust_windSpd': [sum(monthly_data[month]['gust_windSpds']) / len(monthly_data[month]['gust_windSpds']) if monthly_data[month]['gust_windSpds'] else 0 for month in months],
-                'gust_windDir': [sum(monthly_data[month]['gust_windDirs']) / len(monthly_data[month]['gust_windDirs']) if monthly_data[month]['gust_windDirs'] else 0 for month in months],
-                'sustain_windSpd': [sum(monthly_data[month]['sustain_windSpds']) / len(monthly_data[month]['sustain_windSpds']) if monthly_data[month]['sustain_windSpds'] else 0 for month in months],
-                'sustain_windDir': [sum(monthly_data[month]['sustain_windDirs']) / len(monthly_data[month]['sustain_windDirs']) if monthly_data[month]['sustain_windDirs'] else 0 for month in months]
-            }
-            
+        print(f"🔥 Sử dụng Firebase data cho chart với period: {period}")
+        refresh_weather_data()
+        if period in chart_views.periods:
+            payload = chart_views.get(STATION_ID, period, data_version(STATION_ID))
         else:
-            # Default to last 10 records
-            chart_data = firebase_data[:10] if len(firebase_data) > 10 else firebase_data
-            
-            chart_data_dict = {
-                'timestamps': [item.get('datetime', '').strftime('%H:%M') for item in chart_data],
-                'dates': [item.get('datetime', '').strftime('%d/%m') for item in chart_data],
-                'temperature': [item.get('temperature', 0) for item in chart_data],
-                'humidity': [item.get('humidity', 0) for item in chart_data],
-                'pressure': [item.get('pressure', 0) for item in chart_data],
-                'rain': [round(item.get('rain', 0) * 0.4, 0) for item in chart_data],
-                'gust_windSpd': [item.get('gust_windSpd', 0) for item in chart_data],
-                'gust_windDir': [item.get('gust_windDir', 0) for item in chart_data],
-                'sustain_windSpd': [item.get('sustain_windSpd', 0) for item in chart_data],
-                'sustain_windDir': [item.get('sustain_windDir', 0) for item in chart_data]
-            }
+            payload = build_chart_view(STATION_ID, period)
+        
+        if payload is None:
+            return no_data_response()
         
+        chart_data_dict = payload['data']
+        if since_ms is not None:
+            chart_data_dict = chart_delta(chart_data_dict, since_ms)
         print(f"✅ Firebase chart data prepared: {len(chart_data_dict['timestamps'])} points for {period}")
         return jsonify({
             'success': True,
             'data': chart_data_dict,
             'source': 'firebase',
-            'period': period
+            'period': period,
+            'percentiles': payload['percentiles'],
+            'percentile_days': payload['percentile_days'],
+            'delta': since_ms is not None,
+            'cursor': payload['cursor'],
+            'history': retention_engine.generation,
+            'window': payload['window'],
+            'freshness': data_freshness()
         })
     except Exception as e:
         print(f"❌ Error in get_weather_chart_data_by_period: {e}")
@@ -561,6 +995,271 @@ def get_weather_chart_data_by_period(period):
             'error': str(e)
         }), 500
 
+# Retention generation whose compacted history has been loaded into series_store
+aggregate_seeded_generation = None
+
+def seed_aggregate_history():
+    """Load the retention rollups (history older than the raw readings) into series_store once per generation"""
+    global aggregate_seeded_generation
+    if not db_ref or aggregate_seeded_generation == retention_engine.generation:
+        return
+    generation = retention_engine.generation
+    rollups = retention_engine.rollup_buckets()
+    if rollups is None:
+        return
+    # Finest tier first: each tier is only used for time not already covered
+    for name in ('5m', '1h'):
+        added = series_store.seed_rollup(STATION_ID, name, rollups.get(name, {}))
+        if added:
+            print(f"📚 Loaded {added} {name} retention buckets into the aggregate store")
+    aggregate_seeded_generation = generation
+
+def parse_list_arg(name, allowed, default):
+    """Comma separated query parameter restricted to `allowed`; ValueError on unknown items"""
+    raw = request.args.get(name)
+    if not raw:
+        return list(default)
+    items = [item.strip() for item in raw.split(',') if item.strip()]
+    unknown = [item for item in items if item not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown {name}: {', '.join(unknown)} (allowed: {', '.join(allowed)})")
+    return list(dict.fromkeys(items))
+
+@app.route('/api/aggregate')
+def get_aggregate():
+    """API endpoint để lấy dữ liệu gom nhóm theo bucket bất kỳ (?fields=&aggs=&bucket=&from=&to=&station=)"""
+    try:
+        fields = parse_list_arg('fields', AGGREGATE_FIELDS, READING_FIELDS)
+        aggs = parse_list_arg('aggs', AGGREGATIONS, ('mean',))
+        bucket = request.args.get('bucket', '1h')
+        bucket_ms = parse_bucket(bucket)
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        to_ms = parse_cursor(request.args['to'], VN_TZ) if request.args.get('to') else now_ms
+        from_ms = parse_cursor(request.args['from'], VN_TZ) if request.args.get('from') else to_ms - 7 * 24 * 60 * 60 * 1000
+        if from_ms >= to_ms:
+            raise ValueError("'from' must be before 'to'")
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    station = request.args.get('station', STATION_ID)
+    try:
+        if station == STATION_ID:
+            refresh_weather_data()
+            seed_aggregate_history()
+        with span('aggregate'):
+            result = series_store.query(station, fields, aggs, bucket_ms, from_ms, to_ms)
+        if result is None:
+            return jsonify({
+                'success': False,
+                'error': f'Không có dữ liệu cho trạm {station}'
+            }), 404
+        
+        print(f"📐 Aggregate {station} {bucket} x{len(result['buckets'])} from {result['source']} in {result['duration_ms']} ms")
+        with span('aggregate_lists'):
+            payload = to_json_lists(result)
+        return jsonify(CleanJSON({
+            'success': True,
+            **payload,
+            'bucket': bucket,
+            'fields': fields,
+            'aggs': aggs,
+            'count': len(payload['buckets']),
+            'freshness': data_freshness()
+        }))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        print(f"❌ Error in get_aggregate: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/wind-rose')
+def get_wind_rose():
+    """API endpoint để lấy wind rose (hướng x tốc độ) từ histogram theo ngày (?kind=sustain|gust&from=&to=&station=)"""
+    try:
+        kind = request.args.get('kind', 'sustain')
+        if kind not in WIND_VECTORS:
+            raise ValueError(f"Unknown kind: {kind} (allowed: {', '.join(WIND_VECTORS)})")
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        to_ms = parse_cursor(request.args['to'], VN_TZ) if request.args.get('to') else now_ms
+        from_ms = parse_cursor(request.args['from'], VN_TZ) if request.args.get('from') else to_ms - 6 * 24 * 60 * 60 * 1000
+        if from_ms > to_ms:
+            raise ValueError("'from' must not be after 'to'")
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    station = request.args.get('station', STATION_ID)
+    try:
+        if station == STATION_ID:
+            refresh_weather_data()
+        start_day = datetime.fromtimestamp(from_ms / 1000, tz=timezone.utc).astimezone(VN_TZ).date()
+        end_day = datetime.fromtimestamp(to_ms / 1000, tz=timezone.utc).astimezone(VN_TZ).date()
+        with span('wind_rose'):
+            rose = wind_rose_store.rose(station, kind, start_day, end_day)
+        if rose is None:
+            return jsonify({
+                'success': False,
+                'error': f'Không có dữ liệu gió cho trạm {station} từ {start_day} đến {end_day}'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'station': station,
+            'kind': kind,
+            'from': start_day.isoformat(),
+            'to': end_day.isoformat(),
+            **rose,
+            'freshness': data_freshness()
+        })
+    except Exception as e:
+        print(f"❌ Error in get_wind_rose: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/chart-views/metrics')
+def get_chart_view_metrics():
+    """API endpoint để xem metrics của materialized chart views (build time, staleness)"""
+    return jsonify({
+        'success': True,
+        'views': chart_views.metrics(data_version)
+    })
+
+@app.route('/api/retention/status')
+def get_retention_status():
+    """API endpoint để xem trạng thái retention (tiers, checkpoint, lần chạy gần nhất)"""
+    return jsonify({
+        'success': True,
+        'retention': retention_engine.status()
+    })
+
+@app.route('/api/retention/dry-run')
+def get_retention_dry_run():
+    """Admin endpoint: chạy thử retention (không ghi/xóa) và báo cáo số bytes có thể thu hồi"""
+    if not is_admin(Config.ADMIN_TOKEN):
+        return jsonify({
+            'success': False,
+            'error': 'Admin token required'
+        }), 403
+    
+    try:
+        if not db_ref:
+            return jsonify({
+                'success': False,
+                'error': 'Firebase not configured'
+            }), 500
+        
+        # Reads go through firebase_access, so an outage fails fast instead of blocking the request
+        report = retention_engine.run_once(dry_run=True)
+        return jsonify({
+            'success': True,
+            'report': report
+        })
+    except FirebaseUnavailable as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'circuit': firebase_access.breaker.status()['state']
+        }), 503
+    except Exception as e:
+        print(f"❌ Error in get_retention_dry_run: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/validation/stats')
+def get_validation_stats():
+    """API endpoint để xem bộ đếm validation (theo batch và tổng cộng)"""
+    return jsonify({
+        'success': True,
+        'validation': batch_validator.stats()
+    })
+
+@app.route('/api/validation/quarantine')
+def get_validation_quarantine():
+    """API endpoint để xem các bản ghi bị loại/che (quarantine) kèm mã lý do"""
+    limit = request.args.get('limit', 100, type=int)
+    items = quarantine_store.list(STATION_ID, limit=limit)
+    return jsonify({
+        'success': True,
+        'items': items,
+        'count': len(items)
+    })
+
+@app.route('/api/alerts')
+def get_alerts():
+    """API endpoint để xem trạng thái các alert rule"""
+    return jsonify({
+        'success': True,
+        'rules': alert_engine.status(STATION_ID),
+        'configured_rules': [rule.to_dict() for rule in alert_engine.rules]
+    })
+
+@app.route('/api/alerts/events')
+def get_alert_events():
+    """API endpoint để xem các sự kiện firing/resolved gần đây"""
+    limit = request.args.get('limit', 50, type=int)
+    events = alert_engine.events(limit)
+    return jsonify({
+        'success': True,
+        'events': events,
+        'count': len(events)
+    })
+
+@app.route('/api/admin/profiles')
+def get_admin_profiles():
+    """Admin endpoint: danh sách profile đã lưu (request chậm hoặc được yêu cầu)"""
+    if not is_admin(Config.ADMIN_TOKEN):
+        return jsonify({
+            'success': False,
+            'error': 'Admin token required'
+        }), 403
+    
+    profiles = request_profiler.list()
+    return jsonify({
+        'success': True,
+        'profiles': profiles,
+        'count': len(profiles),
+        'slow_ms': request_profiler.slow_ms,
+        'sample_rate': request_profiler.sample_rate
+    })
+
+@app.route('/api/admin/profiles/<int:profile_id>')
+def get_admin_profile(profile_id):
+    """Admin endpoint: chi tiết một profile (span timing + cProfile)"""
+    if not is_admin(Config.ADMIN_TOKEN):
+        return jsonify({
+            'success': False,
+            'error': 'Admin token required'
+        }), 403
+    
+    entry = request_profiler.get(profile_id)
+    if entry is None:
+        return jsonify({
+            'success': False,
+            'error': f'Profile {profile_id} not found'
+        }), 404
+    
+    if request.args.get('format') == 'text' and entry['profile']:
+        return entry['profile'], 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return jsonify({
+        'success': True,
+        'profile': entry
+    })
+
 @app.route('/api/data')
 def get_data():
     """API endpoint để lấy dữ liệu từ Firebase (giữ lại cho tương thích)"""
@@ -573,13 +1272,19 @@ def get_data():
             
         # Lấy dữ liệu từ Realtime Database
         ref = db.reference()
-        data = ref.get()
+        data = firebase_access.call(ref.get, 'root_get')
         
         return jsonify({
             'success': True,
             'data': data,
             'count': len(data) if isinstance(data, list) else 1
         })
+    except FirebaseUnavailable as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'freshness': data_freshness()
+        }), 503
     except Exception as e:
         return jsonify({
             'success': False,
@@ -598,12 +1303,18 @@ def real_time_data():
             
         # Lấy dữ liệu mới nhất từ Realtime Database
         ref = db.reference()
-        data = ref.get()
+        data = firebase_access.call(ref.get, 'root_get')
         
         return jsonify({
             'success': True,
             'data': data
         })
+    except FirebaseUnavailable as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'freshness': data_freshness()
+        }), 503
     except Exception as e:
         return jsonify({
             'success': False,
@@ -0,0 +1,81 @@
+"""
+Materialized views cho payload biểu đồ theo (station, period)
+Mỗi view chỉ được build lại một lần cho mỗi data version, rồi dùng chung cho mọi request
+"""
+
+import threading
+import time
+
+
+class MaterializedViews:
+    """
+    Caches builder(station, period) results per data version (single-flight rebuilds).
+    Every change to the data (ingest, drop_before, retention compaction) changes the version,
+    so there is no separate invalidation.
+    """
+
+    def __init__(self, builder, periods=('day', 'week', 'month')):
+        self.builder = builder
+        self.periods = tuple(periods)
+        self._views = {}        # (station, period) -> view dict
+        self._locks = {}        # (station, period) -> rebuild lock
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def get(self, station, period, version):
+        """Payload for (station, period) at `version`; None if the builder has nothing to show"""
+        key = (station, period)
+        view = self._views.get(key)
+        if view and view['version'] == version:
+            view['hits'] += 1
+            return view['payload']
+
+        # Only one thread rebuilds a view; the others wait and reuse its result
+        with self._key_lock(key):
+            view = self._views.get(key)
+            if view and view['version'] == version:
+                view['hits'] += 1
+                return view['payload']
+
+            started = time.time()
+            payload = self.builder(station, period)
+            build_ms = round((time.time() - started) * 1000, 2)
+            if payload is None:
+                return None
+
+            builds = view['builds'] + 1 if view else 1
+            hits = view['hits'] if view else 0
+            self._views[key] = {
+                'version': version,
+                'payload': payload,
+                'built_at': time.time(),
+                'build_ms': build_ms,
+                'builds': builds,
+                'hits': hits,
+            }
+            print(f"🧱 Rebuilt chart view {station}/{period} (version {version}) in {build_ms} ms")
+            return payload
+
+    def metrics(self, current_version=None):
+        """Build time, hit counts and staleness of each view (current_version: station -> live data version)"""
+        now = time.time()
+        result = []
+        for (station, period), view in sorted(self._views.items()):
+            latest = current_version(station) if current_version else None
+            result.append({
+                'station': station,
+                'period': period,
+                'version': view['version'],
+                'current_version': latest,
+                'stale': latest is not None and latest != view['version'],
+                'age_seconds': round(now - view['built_at'], 1),
+                'build_ms': view['build_ms'],
+                'builds': view['builds'],
+                'hits': view['hits'],
+            })
+        return result
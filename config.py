@@ -22,6 +22,63 @@ class Config:
     DEFAULT_COLLECTION = os.environ.get('DEFAULT_COLLECTION', 'data')
     REALTIME_COLLECTION = os.environ.get('REALTIME_COLLECTION', 'realtime')
     MAX_RECORDS = int(os.environ.get('MAX_RECORDS', 100))
+    STATION_ID = os.environ.get('STATION_ID', '0001')
+    
+    # Firebase Access Configuration (timeouts, retries, circuit breaker, refresh)
+    FIREBASE_TIMEOUT_SECONDS = float(os.environ.get('FIREBASE_TIMEOUT_SECONDS', 10))
+    FIREBASE_INITIAL_TIMEOUT_SECONDS = float(os.environ.get('FIREBASE_INITIAL_TIMEOUT_SECONDS', 60))
+    FIREBASE_RETRIES = int(os.environ.get('FIREBASE_RETRIES', 2))
+    FIREBASE_BACKOFF_SECONDS = float(os.environ.get('FIREBASE_BACKOFF_SECONDS', 0.5))
+    FIREBASE_BREAKER_FAILURES = int(os.environ.get('FIREBASE_BREAKER_FAILURES', 3))
+    FIREBASE_BREAKER_RESET_SECONDS = float(os.environ.get('FIREBASE_BREAKER_RESET_SECONDS', 30))
+    SYNC_FRESH_SECONDS = float(os.environ.get('SYNC_FRESH_SECONDS', 10))
+    STALE_AFTER_SECONDS = float(os.environ.get('STALE_AFTER_SECONDS', 120))
+    
+    # Data Source Configuration (firebase | replay)
+    DATA_SOURCE = os.environ.get('DATA_SOURCE', 'firebase').lower()
+    REPLAY_FILE = os.environ.get('REPLAY_FILE', 'replay_export.json')
+    REPLAY_SPEED = float(os.environ.get('REPLAY_SPEED', 1.0))
+    REPLAY_LOOP = os.environ.get('REPLAY_LOOP', 'False').lower() == 'true'
+    REPLAY_PRELOAD_MINUTES = float(os.environ.get('REPLAY_PRELOAD_MINUTES', 0))
+    
+    # Statistics Configuration
+    QUANTILE_SKETCH_K = int(os.environ.get('QUANTILE_SKETCH_K', 200))
+    
+    # Aggregate API Configuration
+    AGGREGATE_MAX_BUCKETS = int(os.environ.get('AGGREGATE_MAX_BUCKETS', 20000))
+    
+    # Retention Configuration (raw -> 5m aggregates -> 1h aggregates)
+    RETENTION_ENABLED = os.environ.get('RETENTION_ENABLED', 'False').lower() == 'true'
+    RETENTION_DRY_RUN = os.environ.get('RETENTION_DRY_RUN', 'True').lower() == 'true'
+    RETENTION_PRUNE = os.environ.get('RETENTION_PRUNE', 'False').lower() == 'true'
+    RETENTION_RAW_DAYS = int(os.environ.get('RETENTION_RAW_DAYS', 30))
+    RETENTION_ROLLUP_DAYS = int(os.environ.get('RETENTION_ROLLUP_DAYS', 365))
+    RETENTION_INTERVAL_SECONDS = int(os.environ.get('RETENTION_INTERVAL_SECONDS', 3600))
+    RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+    RETENTION_STATE_FILE = os.environ.get('RETENTION_STATE_FILE', 'retention_state.json')
+    RETENTION_ARCHIVE_DIR = os.environ.get('RETENTION_ARCHIVE_DIR', 'archive')
+    
+    # Validation Configuration
+    VALIDATION_SPIKE_WINDOW = int(os.environ.get('VALIDATION_SPIKE_WINDOW', 7))
+    VALIDATION_STUCK_RUN = int(os.environ.get('VALIDATION_STUCK_RUN', 30))
+    QUARANTINE_MAX_ITEMS = int(os.environ.get('QUARANTINE_MAX_ITEMS', 1000))
+    
+    # Alert Configuration
+    ALERT_RULES_FILE = os.environ.get('ALERT_RULES_FILE')
+    ALERT_WEBHOOK_URL = os.environ.get('ALERT_WEBHOOK_URL')
+    ALERT_MAX_EVENT_AGE_MINUTES = int(os.environ.get('ALERT_MAX_EVENT_AGE_MINUTES', 60))
+    ALERT_TICK_SECONDS = int(os.environ.get('ALERT_TICK_SECONDS', 60))
+    ALERTS_BACKGROUND_SYNC = os.environ.get('ALERTS_BACKGROUND_SYNC', 'True').lower() == 'true'
+    
+    # Admin & Profiling Configuration
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+    PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 1000))
+    PROFILE_MAX_ENTRIES = int(os.environ.get('PROFILE_MAX_ENTRIES', 50))
+    # Stack sampling interval for requests without cProfile, so slow ones keep a profile (0 = off)
+    PROFILE_STACK_SAMPLE_MS = float(os.environ.get('PROFILE_STACK_SAMPLE_MS', 10))
+    # Send Server-Timing to every client (default: admin requests only)
+    PROFILE_PUBLIC_TIMING = os.environ.get('PROFILE_PUBLIC_TIMING', 'False').lower() == 'true'
     
     @staticmethod
     def init_app(app):
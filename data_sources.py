@@ -0,0 +1,165 @@
+"""
+Nguồn dữ liệu cho đường sync/ingest
+- FirebaseSource: đọc <station>/push từ Firebase Realtime Database (mặc định)
+- ReplaySource: phát lại một bản export thật của push records với tốc độ N× thời gian thực
+  (dùng cho load test / soak test, không cần Firebase)
+Mọi nguồn đều trả về dict {push_id: record} mới hơn watermark, giống một lần đọc Firebase.
+"""
+
+import bisect
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from push_ids import decode_firebase_timestamp, encode_firebase_timestamp
+
+
+class DataSource(ABC):
+    """Interface: fetch_since(station, watermark) -> {push_id: raw record} newer than watermark"""
+    name = 'source'
+
+    @property
+    def available(self):
+        return True
+
+    @abstractmethod
+    def fetch_since(self, station, watermark=None):
+        """{push_id: raw record} pushed after watermark (everything when watermark is None)"""
+
+    def status(self):
+        return {'name': self.name, 'available': self.available}
+
+
+class FirebaseSource(DataSource):
+    """Reads <station>/push through FirebaseAccess (timeouts, retries, circuit breaker)"""
+    name = 'firebase'
+
+    def __init__(self, reference, access, db_ref=None, initial_timeout=None):
+        self.reference = reference          # db.reference
+        self.access = access
+        self.db_ref = db_ref
+        self.initial_timeout = initial_timeout
+
+    @property
+    def available(self):
+        return self.db_ref is not None
+
+    def fetch_since(self, station, watermark=None):
+        ref = self.reference(f'{station}/push')
+        if watermark:
+            # Only fetch records pushed after the last ingested one
+            data = self.access.call(lambda: ref.order_by_key().start_at(watermark).get(), 'push_get') or {}
+            data.pop(watermark, None)
+            return data
+        # First (full) read can be large, allow it more time
+        return self.access.call(ref.get, 'push_get_all', timeout=self.initial_timeout) or {}
+
+
+def load_push_export(path, station=None):
+    """Push records from a Firebase JSON export: {station: {push: {...}}}, {push: {...}} or {push_id: record}"""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if station and isinstance(data.get(station), dict):
+        data = data[station]
+    if isinstance(data.get('push'), dict):
+        data = data['push']
+    return {key: record for key, record in data.items() if isinstance(record, dict)}
+
+
+class ReplaySource(DataSource):
+    """
+    Replays a captured push export at `speed`× real time.
+    Records become visible when the replay clock passes their original timestamp.
+    rebase=True re-stamps push IDs so the first record lands at the replay start (live-looking data);
+    loop=True restarts the export (shifted forward) when it runs out, for long soak runs.
+    preload_minutes of the export are visible immediately (history the dashboard starts with).
+    """
+    name = 'replay'
+
+    def __init__(self, records, speed=1.0, rebase=True, loop=False, preload_minutes=0, clock=time.time):
+        if not records:
+            raise ValueError("Replay export has no push records")
+        self.speed = float(speed)
+        self.rebase = rebase or loop
+        self.loop = loop
+        self.clock = clock
+        self.preload_ms = int(preload_minutes * 60 * 1000)
+        items = sorted(records.items())
+        self._keys = [key for key, _ in items]
+        self._records = [record for _, record in items]
+        self._offsets = [decode_firebase_timestamp(key) for key in self._keys]
+        self._first_ms = self._offsets[0]
+        self._offsets = [ts - self._first_ms for ts in self._offsets]
+        self._sort_keys = [(offset, key[8:]) for offset, key in zip(self._offsets, self._keys)]
+        # One cycle spans the export plus the mean gap between readings
+        gap = self._offsets[-1] // max(1, len(self._offsets) - 1) or 1000
+        self._cycle_ms = self._offsets[-1] + gap
+        self._started_ms = None
+        self._base_ms = None        # wall-clock ms of replay offset 0 (for rebased keys)
+        self._served = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, station=None, **kwargs):
+        return cls(load_push_export(path, station), **kwargs)
+
+    def start(self):
+        with self._lock:
+            if self._started_ms is None:
+                self._started_ms = int(self.clock() * 1000)
+                self._base_ms = self._started_ms - self.preload_ms
+
+    def replay_offset_ms(self):
+        """Milliseconds of recorded time that have been replayed so far"""
+        if self._started_ms is None:
+            return 0
+        return self.preload_ms + int((self.clock() * 1000 - self._started_ms) * self.speed)
+
+    def _key(self, index, cycle):
+        if not self.rebase:
+            return self._keys[index]
+        ms = self._base_ms + cycle * self._cycle_ms + self._offsets[index]
+        # Keep the original random suffix so keys stay unique and ordered
+        return encode_firebase_timestamp(ms) + self._keys[index][8:]
+
+    def _position(self, key):
+        """(cycle, index) just after `key`, i.e. where to continue reading"""
+        if key is None:
+            return 0, 0
+        base = self._base_ms if self.rebase else self._first_ms
+        offset = decode_firebase_timestamp(key) - base
+        cycle = max(0, offset // self._cycle_ms) if self.loop else 0
+        # (offset, suffix) sorts exactly like the push ID strings
+        index = bisect.bisect_right(self._sort_keys, (offset - cycle * self._cycle_ms, key[8:]))
+        return cycle, index
+
+    def fetch_since(self, station, watermark=None):
+        self.start()
+        offset = self.replay_offset_ms()
+        cycle, index = self._position(watermark)
+        data = {}
+        while True:
+            if index >= len(self._keys):
+                if not self.loop:
+                    break
+                cycle, index = cycle + 1, 0
+            if cycle * self._cycle_ms + self._offsets[index] > offset:
+                break
+            data[self._key(index, cycle)] = dict(self._records[index])
+            index += 1
+        self._served += len(data)
+        return data
+
+    def status(self):
+        offset = self.replay_offset_ms()
+        return {
+            **super().status(),
+            'speed': self.speed,
+            'records': len(self._keys),
+            'served': self._served,
+            'loop': self.loop,
+            'rebase': self.rebase,
+            'replayed_minutes': round(offset / 60000, 1),
+            'progress': round(min(1.0, offset / self._cycle_ms), 3) if not self.loop else None,
+        }
@@ -0,0 +1,146 @@
+"""
+Các chỉ số khí tượng dẫn xuất, tính một lần (vectorized) khi ingest và lưu cùng các cột raw
+- dew_point, heat_index (°C) từ nhiệt độ + độ ẩm
+- rain_mm (số lần lật gầu × 0.4 mm) và rain_rate (mm/h) theo khoảng cách giữa các reading
+- pressure_tendency_3h: áp suất hiện tại - áp suất 3 giờ trước (hPa)
+- Thành phần vector gió u/v để trung bình hướng gió đúng (350° và 10° -> 0°, không phải 180°)
+"""
+
+import threading
+
+import numpy as np
+
+RAIN_MM_PER_TIP = 0.4
+
+# Wind (speed, direction) field pairs and the u/v fields derived from them
+WIND_VECTORS = {
+    'sustain': ('sustain_windSpd', 'sustain_windDir', 'sustain_u', 'sustain_v'),
+    'gust': ('gust_windSpd', 'gust_windDir', 'gust_u', 'gust_v'),
+}
+
+DERIVED_FIELDS = (
+    'dew_point', 'heat_index', 'rain_mm', 'rain_rate', 'pressure_tendency_3h',
+    'sustain_u', 'sustain_v', 'gust_u', 'gust_v'
+)
+
+# Direction field -> (u, v) fields used to average it
+VECTOR_DIRECTIONS = {direction: (u, v) for _, direction, u, v in WIND_VECTORS.values()}
+
+TENDENCY_MS = 3 * 60 * 60 * 1000
+TENDENCY_TOLERANCE_MS = 15 * 60 * 1000      # reference reading must be within 3h ± 15 min
+MAX_RAIN_INTERVAL_MS = 60 * 60 * 1000       # no rate across longer gaps
+
+
+def dew_point(temperature, humidity):
+    """Magnus formula (°C); NaN where humidity is missing or not positive"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma = np.log(humidity / 100.0) + 17.625 * temperature / (243.04 + temperature)
+        result = 243.04 * gamma / (17.625 - gamma)
+    return np.where(humidity > 0, result, np.nan)
+
+
+def heat_index(temperature, humidity):
+    """NOAA heat index (Rothfusz regression with adjustments), in °C"""
+    t = temperature * 9 / 5 + 32
+    rh = humidity
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    full = (-42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh
+            - 0.00683783 * t * t - 0.05481717 * rh * rh + 0.00122874 * t * t * rh
+            + 0.00085282 * t * rh * rh - 0.00000199 * t * t * rh * rh)
+    with np.errstate(invalid='ignore'):
+        dry = (rh < 13) & (t >= 80) & (t <= 112)
+        full = np.where(dry, full - (13 - rh) / 4 * np.sqrt(np.clip(17 - np.abs(t - 95), 0, None) / 17), full)
+        humid = (rh > 85) & (t >= 80) & (t <= 87)
+        full = np.where(humid, full + (rh - 85) / 10 * (87 - t) / 5, full)
+        result = np.where((simple + t) / 2 >= 80, full, simple)
+    return (result - 32) * 5 / 9
+
+
+def wind_components(speed, direction):
+    """Meteorological direction (where the wind comes from, degrees) -> u (east), v (north) components"""
+    radians = np.deg2rad(direction)
+    return -speed * np.sin(radians), -speed * np.cos(radians)
+
+
+def vector_direction(u, v):
+    """Direction (degrees) of summed/averaged u/v components; NaN when there is no net wind"""
+    u = np.asarray(u, dtype=float)
+    v = np.asarray(v, dtype=float)
+    direction = np.rad2deg(np.arctan2(-u, -v)) % 360
+    direction = np.where(direction >= 360, 0.0, direction)     # -1e-15 % 360 rounds up to 360
+    return np.where(np.hypot(u, v) > 1e-9, direction, np.nan)
+
+
+def mean_wind_direction(us, vs):
+    """Vector-mean direction of lists of u/v components (None when there is none)"""
+    if not us or not vs:
+        return None
+    direction = float(vector_direction(sum(us), sum(vs)))
+    return None if np.isnan(direction) else direction
+
+
+def wind_vector_values(values):
+    """u/v components for a dict reading (used where readings are not columnar, e.g. retention)"""
+    result = {}
+    for speed_field, direction_field, u_field, v_field in WIND_VECTORS.values():
+        if speed_field in values and direction_field in values:
+            u, v = wind_components(values[speed_field], values[direction_field])
+            result[u_field], result[v_field] = float(u), float(v)
+    return result
+
+
+class DerivedMetrics:
+    """Adds derived columns to ingest chunks; keeps a short per-station tail for rain rate and 3h tendency"""
+
+    def __init__(self):
+        self._tails = {}    # station -> (timestamps, pressures) of the last 3h+ of readings
+        self._lock = threading.Lock()
+
+    def compute(self, station, timestamps, columns):
+        """{field: array} of derived values for a sorted chunk (timestamps in ms, raw columns)"""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        temperature = columns['temperature']
+        humidity = columns['humidity']
+        derived = {
+            'dew_point': dew_point(temperature, humidity),
+            'heat_index': heat_index(temperature, humidity),
+            'rain_mm': columns['rain'] * RAIN_MM_PER_TIP,
+        }
+        for speed_field, direction_field, u_field, v_field in WIND_VECTORS.values():
+            derived[u_field], derived[v_field] = wind_components(columns[speed_field], columns[direction_field])
+
+        if not len(timestamps):
+            derived['rain_rate'] = derived['pressure_tendency_3h'] = np.empty(0)
+            return derived
+
+        with self._lock:
+            tail_ts, tail_pressure = self._tails.get(station, (np.empty(0, dtype=np.int64), np.empty(0)))
+            # A re-ingested chunk replaces whatever the tail holds from its start on
+            older = tail_ts < timestamps[0]
+            tail_ts, tail_pressure = tail_ts[older], tail_pressure[older]
+            all_ts = np.concatenate([tail_ts, timestamps])
+            all_pressure = np.concatenate([tail_pressure, columns['pressure']])
+            offset = len(tail_ts)
+            positions = offset + np.arange(len(timestamps))
+
+            # Rain rate over the interval since the previous reading
+            previous = np.where(positions > 0, all_ts[np.maximum(positions - 1, 0)], -1)
+            interval_ms = timestamps - previous
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rate = derived['rain_mm'] / (interval_ms / 3600000.0)
+            derived['rain_rate'] = np.where((previous >= 0) & (interval_ms > 0) & (interval_ms <= MAX_RAIN_INTERVAL_MS),
+                                            rate, np.nan)
+
+            # Pressure change against the reading closest to 3 hours earlier
+            target = timestamps - TENDENCY_MS
+            right = np.clip(np.searchsorted(all_ts, target), 0, len(all_ts) - 1)
+            left = np.clip(right - 1, 0, len(all_ts) - 1)
+            nearest = np.where(np.abs(all_ts[left] - target) < np.abs(all_ts[right] - target), left, right)
+            close = (np.abs(all_ts[nearest] - target) <= TENDENCY_TOLERANCE_MS) & (nearest < positions)
+            derived['pressure_tendency_3h'] = np.where(close, columns['pressure'] - all_pressure[nearest], np.nan)
+
+            # Keep what the next chunk needs
+            keep = all_ts >= all_ts[-1] - TENDENCY_MS - TENDENCY_TOLERANCE_MS
+            self._tails[station] = (all_ts[keep], all_pressure[keep])
+
+        return derived
@@ -0,0 +1,197 @@
+"""
+Lớp truy cập Firebase: timeout cho mỗi lần gọi, retry với backoff, circuit breaker
+và stale-while-revalidate (luôn phục vụ dữ liệu tốt gần nhất, làm mới ở nền)
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+
+
+class FirebaseUnavailable(Exception):
+    """Base error for Firebase access failures"""
+
+
+class FirebaseTimeout(FirebaseUnavailable):
+    """A call did not finish within its timeout"""
+
+
+class CircuitOpenError(FirebaseUnavailable):
+    """The circuit breaker is open; the backend was not called"""
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures -> half_open after `reset_seconds`"""
+
+    def __init__(self, failure_threshold=3, reset_seconds=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go through now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'half_open' and not self._trial_in_flight:
+                # Let exactly one trial call through
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"⛔ Firebase circuit opened after {self.failures} failures")
+                self.state = 'open'
+                self.opened_at = self.clock()
+
+    def status(self):
+        with self._lock:
+            retry_in = None
+            if self.state == 'open':
+                retry_in = round(max(0.0, self.reset_seconds - (self.clock() - self.opened_at)), 1)
+            return {'state': self.state, 'failures': self.failures, 'retry_in_seconds': retry_in}
+
+
+class FirebaseAccess:
+    """Runs Firebase calls with a timeout, retries with exponential backoff and a circuit breaker"""
+
+    def __init__(self, timeout=10, retries=2, backoff_seconds=0.5, max_backoff_seconds=5,
+                 breaker=None, max_workers=4, sleep=time.sleep):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='firebase-call')
+
+    def _call_once(self, fn, timeout):
+        future = self._executor.submit(fn)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise FirebaseTimeout(f"Firebase call timed out after {timeout}s")
+
+    def call(self, fn, name='firebase', timeout=None):
+        """Call fn() (a Firebase operation); raises FirebaseUnavailable when it cannot succeed"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Firebase circuit open, skipped {name}")
+
+        timeout = timeout or self.timeout
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * (2 ** (attempt - 1)))
+                self.sleep(delay * random.uniform(0.5, 1.0))
+            try:
+                result = self._call_once(fn, timeout)
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                last_error = e
+                print(f"⚠️ {name} failed (attempt {attempt + 1}/{self.retries + 1}): {e}")
+
+        self.breaker.record_failure()
+        if isinstance(last_error, FirebaseUnavailable):
+            raise last_error
+        raise FirebaseUnavailable(f"{name} failed: {last_error}") from last_error
+
+    def status(self):
+        return {
+            'timeout_seconds': self.timeout,
+            'retries': self.retries,
+            'circuit': self.breaker.status(),
+        }
+
+
+class StaleWhileRevalidate:
+    """
+    Keeps track of the last successful refresh and runs refreshes in the background.
+    Only blocks when nothing has ever been loaded.
+    """
+
+    def __init__(self, refresh, fresh_seconds=10, stale_after_seconds=120):
+        self.refresh = refresh
+        self.fresh_seconds = fresh_seconds
+        self.stale_after_seconds = stale_after_seconds
+        self.last_success = None
+        self.last_attempt = None
+        self.last_error = None
+        self._in_flight = False
+        self._lock = threading.Lock()
+
+    def _run(self):
+        self.last_attempt = time.time()
+        try:
+            self.refresh()
+            self.last_success = time.time()
+            self.last_error = None
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"❌ Refresh failed, serving last good data: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._in_flight = False
+
+    def ensure_fresh(self, has_data=True):
+        """Refresh if due; synchronous only when there is no data yet. Returns False if that refresh failed"""
+        with self._lock:
+            if self._in_flight:
+                return True
+            if self.last_attempt is not None and time.time() - self.last_attempt < self.fresh_seconds:
+                return self.last_success is not None or has_data
+            self._in_flight = True
+
+        if not has_data:
+            return self._run()
+        threading.Thread(target=self._run, name='firebase-refresh', daemon=True).start()
+        return True
+
+    def refresh_now(self):
+        """Synchronous refresh (e.g. from a background ticker); skipped if one is running"""
+        with self._lock:
+            if self._in_flight:
+                return True
+            self._in_flight = True
+        return self._run()
+
+    def age_seconds(self):
+        if self.last_success is None:
+            return None
+        return round(time.time() - self.last_success, 1)
+
+    def freshness(self):
+        """Staleness marker attached to API responses"""
+        age = self.age_seconds()
+        return {
+            'stale': self.last_error is not None or age is None or age > self.stale_after_seconds,
+            'age_seconds': age,
+            'last_success': (datetime.fromtimestamp(self.last_success, tz=timezone.utc).isoformat()
+                             if self.last_success else None),
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Load test / soak test: phát lại dữ liệu push thật (ReplaySource) vào đường ingest
+và mô phỏng M tab dashboard tự làm mới theo chu kỳ của trang (10s)
+Báo cáo throughput, latency percentile (p50/p95/p99) và bộ nhớ theo từng khoảng thời gian.
+
+Ví dụ:
+    # Lưu lại một bản export thật từ Firebase
+    python loadtest.py --capture replay_export.json
+    # 50 tab, dữ liệu phát lại 60× thời gian thực, chạy 1 giờ
+    python loadtest.py --export replay_export.json --tabs 50 --speed 60 --duration 3600 --loop
+    # Nhắm vào một server đang chạy (vd. gunicorn với DATA_SOURCE=replay)
+    python loadtest.py --url http://localhost:5000 --tabs 20 --duration 600
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+
+from quantile_sketch import KLLSketch
+
+# Dashboard refresh cycle (templates/index.html: auto refresh every 10s)
+DASHBOARD_REFRESH_SECONDS = 10
+# What a tab requests on load and on every refresh
+DASHBOARD_ENDPOINTS = ('/api/weather-data', '/api/weather-summary', '/api/weather-chart-data/{period}')
+# Endpoints the dashboard polls with ?since=<cursor>&history=<version> after the first full load
+DELTA_ENDPOINTS = ('/api/weather-data', '/api/weather-chart-data/{period}')
+# Which chart period tabs look at
+PERIOD_MIX = {'day': 0.7, 'week': 0.2, 'month': 0.1}
+
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def rss_mb():
+    """Current resident memory of this process (MB)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # Peak instead of current outside Linux (ru_maxrss is KB on Linux, bytes on macOS)
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class LocalClient:
+    """Calls the app in-process through Flask's test client"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def get(self, path):
+        """(status code, body bytes)"""
+        response = self.client.get(path)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    """Calls a running server over HTTP"""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def get(self, path):
+        """(status code, body bytes)"""
+        try:
+            with urllib.request.urlopen(self.base_url + path, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, b''
+
+
+class LatencyStats:
+    """Per-endpoint latency sketches: one for the current report interval, one for the whole run"""
+
+    def __init__(self):
+        self._interval = {}
+        self._total = {}
+        self._counts = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, latency_ms, ok):
+        with self._lock:
+            for sketches in (self._interval, self._total):
+                sketches.setdefault(endpoint, KLLSketch()).update(latency_ms)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+            if not ok:
+                self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def take_interval(self):
+        with self._lock:
+            interval, self._interval = self._interval, {}
+        merged = KLLSketch()
+        for sketch in interval.values():
+            merged.merge(sketch)
+        return merged
+
+    def summary(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    'requests': self._counts[endpoint],
+                    'errors': self._errors.get(endpoint, 0),
+                    **latency_percentiles(sketch),
+                }
+                for endpoint, sketch in sorted(self._total.items())
+            }
+
+
+def latency_percentiles(sketch):
+    values = sketch.quantiles(LATENCY_QUANTILES)
+    return {
+        f'p{int(q * 100)}_ms': round(value, 1) if value is not None else None
+        for q, value in zip(LATENCY_QUANTILES, values)
+    }
+
+
+class DashboardTab(threading.Thread):
+    """
+    One open dashboard tab: initial load, then a refresh every cycle (jittered like real browsers).
+    Like templates/index.html, data and chart refreshes send the cursor/history of the previous response.
+    """
+
+    def __init__(self, client, stats, refresh_seconds, stop, rng):
+        super().__init__(daemon=True)
+        self.client = client
+        self.stats = stats
+        self.refresh_seconds = refresh_seconds
+        self.stop = stop
+        self.rng = rng
+        self.period = rng.choices(list(PERIOD_MIX), weights=list(PERIOD_MIX.values()))[0]
+        self.cursors = {}       # endpoint -> (cursor, history) of the last successful response
+
+    def path(self, endpoint):
+        path = endpoint.format(period=self.period)
+        if endpoint in self.cursors:
+            cursor, history = self.cursors[endpoint]
+            path += f'?since={cursor}' + (f'&history={history}' if history is not None else '')
+        return path
+
+    def remember_cursor(self, endpoint, body):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return
+        if data.get('success') and data.get('cursor') is not None:
+            self.cursors[endpoint] = (data['cursor'], data.get('history'))
+
+    def refresh(self):
+        for endpoint in DASHBOARD_ENDPOINTS:
+            path = self.path(endpoint)
+            started = time.perf_counter()
+            try:
+                status, body = self.client.get(path)
+            except Exception:
+                status, body = None, b''
+            latency_ms = (time.perf_counter() - started) * 1000
+            self.stats.record(endpoint.format(period=self.period), latency_ms, status == 200)
+            if status == 200 and endpoint in DELTA_ENDPOINTS:
+                self.remember_cursor(endpoint, body)
+
+    def run(self):
+        # Tabs are not opened in lockstep
+        if self.stop.wait(self.rng.uniform(0, self.refresh_seconds)):
+            return
+        while not self.stop.is_set():
+            started = time.monotonic()
+            self.refresh()
+            elapsed = time.monotonic() - started
+            if self.stop.wait(max(0.0, self.refresh_seconds - elapsed)):
+                return
+
+
+def capture_export(path, station):
+    """Save the current <station>/push records from Firebase as a replay export"""
+    os.environ['DATA_SOURCE'] = 'firebase'
+    os.environ['ALERTS_BACKGROUND_SYNC'] = 'False'
+    import app as weather_app
+    if not weather_app.data_source.available:
+        print("❌ Firebase not available, cannot capture")
+        return False
+    records = weather_app.data_source.fetch_since(station)
+    with open(path, 'w') as f:
+        json.dump({station: {'push': records}}, f)
+    print(f"💾 Captured {len(records)} push records of station {station} to {path}")
+    return True
+
+
+def load_local_app(args):
+    """Import the app with the replay source configured from the command line"""
+    os.environ['DATA_SOURCE'] = 'replay'
+    os.environ['REPLAY_FILE'] = args.export
+    os.environ['REPLAY_SPEED'] = str(args.speed)
+    os.environ['REPLAY_LOOP'] = 'True' if args.loop else 'False'
+    os.environ['REPLAY_PRELOAD_MINUTES'] = str(args.preload_minutes)
+    os.environ.setdefault('PROFILE_SLOW_MS', '1e9')
+    import app as weather_app
+    return weather_app
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    weather_app = None
+    if args.url:
+        client_factory = lambda: HttpClient(args.url)
+    else:
+        weather_app = load_local_app(args)
+        client_factory = lambda: LocalClient(weather_app.app)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    stats = LatencyStats()
+    stop = threading.Event()
+    refresh_seconds = DASHBOARD_REFRESH_SECONDS / args.client_speed
+    tabs = [DashboardTab(client_factory(), stats, refresh_seconds, stop, random.Random(rng.random()))
+            for _ in range(args.tabs)]
+
+    print(f"🚀 {args.tabs} tabs, refresh every {refresh_seconds:g}s, "
+          f"{'server ' + args.url if args.url else 'replay ' + args.export + f' at {args.speed:g}×'}, "
+          f"{args.duration}s")
+    started = time.monotonic()
+    for tab in tabs:
+        tab.start()
+
+    intervals = []
+    try:
+        while True:
+            remaining = args.duration - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            time.sleep(min(args.report_every, remaining))
+            intervals.append(report_interval(stats, started, intervals, weather_app, args))
+    except KeyboardInterrupt:
+        print("⏹️ Interrupted")
+    finally:
+        stop.set()
+        for tab in tabs:
+            tab.join(timeout=5)
+
+    elapsed = time.monotonic() - started
+    summary = {
+        'tabs': args.tabs,
+        'duration_seconds': round(elapsed, 1),
+        'requests': sum(interval['requests'] for interval in intervals),
+        'errors': sum(interval['errors'] for interval in intervals),
+        'endpoints': stats.summary(),
+        'intervals': intervals,
+    }
+    summary['throughput_rps'] = round(summary['requests'] / elapsed, 1) if elapsed else None
+    if intervals:
+        summary['rss_mb_start'] = intervals[0]['rss_mb']
+        summary['rss_mb_end'] = intervals[-1]['rss_mb']
+
+    print("\n📊 Kết quả")
+    print(f"   Requests: {summary['requests']} ({summary['throughput_rps']} req/s), errors: {summary['errors']}")
+    for endpoint, endpoint_stats in summary['endpoints'].items():
+        print(f"   {endpoint:40s} n={endpoint_stats['requests']:<7d} err={endpoint_stats['errors']:<5d} "
+              f"p50={endpoint_stats['p50_ms']}ms p95={endpoint_stats['p95_ms']}ms p99={endpoint_stats['p99_ms']}ms")
+    if intervals:
+        print(f"   RSS: {summary['rss_mb_start']} MB -> {summary['rss_mb_end']} MB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"💾 Report saved to {args.json}")
+    return summary
+
+
+def report_interval(stats, started, intervals, weather_app, args):
+    """Print and return one report line (throughput, latency, memory, ingest progress)"""
+    sketch = stats.take_interval()
+    elapsed = time.monotonic() - started
+    window = elapsed - (intervals[-1]['elapsed_seconds'] if intervals else 0)
+    summary = stats.summary()
+    total_errors = sum(endpoint['errors'] for endpoint in summary.values())
+    interval = {
+        'elapsed_seconds': round(elapsed, 1),
+        'requests': sketch.count,
+        'errors': total_errors - sum(previous['errors'] for previous in intervals),
+        'rps': round(sketch.count / window, 1) if window else None,
+        **latency_percentiles(sketch),
+        'rss_mb': rss_mb(),
+    }
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        interval['traced_mb'] = round(current / 1024 / 1024, 1)
+        interval['traced_peak_mb'] = round(peak / 1024 / 1024, 1)
+    if weather_app is not None:
+        interval['stored_records'] = len(weather_app.weather_store)
+        interval['replayed_minutes'] = weather_app.data_source.status().get('replayed_minutes')
+
+    line = (f"⏱️ {interval['elapsed_seconds']:>7.1f}s  {interval['rps']:>7} req/s  "
+            f"p50={interval['p50_ms']}ms p95={interval['p95_ms']}ms p99={interval['p99_ms']}ms  "
+            f"err={interval['errors']}  rss={interval['rss_mb']}MB")
+    if 'stored_records' in interval:
+        line += f"  records={interval['stored_records']} replayed={interval['replayed_minutes']}min"
+    print(line, flush=True)
+    return interval
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Replay load test for the weather dashboard')
+    parser.add_argument('--export', default='replay_export.json', help='captured push export (JSON) to replay')
+    parser.add_argument('--capture', metavar='PATH', help='save the current Firebase push records to PATH and exit')
+    parser.add_argument('--station', default=os.environ.get('STATION_ID', '0001'))
+    parser.add_argument('--url', help='target a running server instead of the in-process app')
+    parser.add_argument('--tabs', type=int, default=10, help='number of simulated dashboard tabs')
+    parser.add_argument('--speed', type=float, default=60.0, help='replay speed (N× real time)')
+    parser.add_argument('--loop', action='store_true', help='restart the export when it runs out (soak runs)')
+    parser.add_argument('--preload-minutes', type=float, default=24 * 60,
+                        help='minutes of the export visible at start')
+    parser.add_argument('--client-speed', type=float, default=1.0,
+                        help='speed up the tabs refresh cycle (1 = real dashboard cycle)')
+    parser.add_argument('--duration', type=float, default=60, help='run time in seconds')
+    parser.add_argument('--report-every', type=float, default=10, help='report interval in seconds')
+    parser.add_argument('--tracemalloc', action='store_true', help='also trace Python allocations (slower)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH', help='write the full report as JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.capture:
+        capture_export(args.capture, args.station)
+        return
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
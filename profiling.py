@@ -0,0 +1,221 @@
+"""
+Profiling theo request (opt-in) và lưu lại các request chậm
+- Admin bật bằng header "X-Profile: 1" hoặc query "?profile=1" (kèm admin token)
+- Lấy mẫu ngẫu nhiên theo PROFILE_SAMPLE_RATE
+- Mọi request đều có span timing rẻ (firebase_get, validate, jsonify, ...) và được lấy mẫu stack
+  định kỳ (rẻ hơn cProfile), nên request chậm cũng có profile;
+  request được yêu cầu/lấy mẫu/chậm hơn ngưỡng được giữ lại trong ring buffer
+- Header Server-Timing chỉ gửi cho admin (hoặc mọi client khi bật public_timing)
+"""
+
+import cProfile
+import hmac
+import io
+import itertools
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+
+def is_admin(admin_token):
+    """True if the request carries the configured admin token (header or ?token=)"""
+    if not admin_token:
+        return False
+    supplied = request.headers.get('X-Admin-Token') or request.args.get('token') or ''
+    try:
+        # Bytes: compare_digest rejects non-ASCII str; anything that cannot be compared is not admin
+        return hmac.compare_digest(supplied.encode('utf-8'), admin_token.encode('utf-8'))
+    except (TypeError, UnicodeError):
+        return False
+
+
+@contextmanager
+def span(name):
+    """Time a stage of the current request (no-op outside a request)"""
+    if not has_request_context():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans = g.setdefault('profile_spans', {})
+        spans[name] = spans.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler:
+    """
+    Background thread sampling the stacks of in-flight requests every `interval_ms`.
+    Far cheaper than cProfile, so it runs for every request and slow ones keep a profile.
+    """
+
+    def __init__(self, interval_ms=10, max_depth=40):
+        self.interval = interval_ms / 1000.0
+        self.max_depth = max_depth
+        self._requests = {}     # thread id -> {'cumulative': Counter, 'self': Counter, 'samples': int}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self):
+        """Start sampling the current thread (one request)"""
+        with self._lock:
+            self._requests[threading.get_ident()] = {'cumulative': Counter(), 'self': Counter(), 'samples': 0}
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+
+    def end(self):
+        """Stop sampling the current thread; returns what was collected (None if not sampled)"""
+        with self._lock:
+            return self._requests.pop(threading.get_ident(), None)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._requests:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, collected in self._requests.items():
+                    frame = frames.get(thread_id)
+                    if frame is None or thread_id == me:
+                        continue
+                    names = []
+                    while frame is not None and len(names) < self.max_depth:
+                        names.append(frame_name(frame))
+                        frame = frame.f_back
+                    collected['samples'] += 1
+                    collected['self'][names[0]] += 1
+                    collected['cumulative'].update(set(names))
+
+    def format(self, collected, top_n=40):
+        """Text table of sampled functions (cumulative/self sample counts)"""
+        samples = collected['samples']
+        lines = [f"Stack samples every {self.interval * 1000:g} ms: {samples} samples",
+                 f"{'cumulative':>10} {'self':>6}  function"]
+        for name, count in collected['cumulative'].most_common(top_n):
+            lines.append(f"{count:>10} {collected['self'].get(name, 0):>6}  {name}")
+        return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    """Flask hooks capturing call profiles for opted-in/sampled requests and keeping slow ones"""
+
+    def __init__(self, admin_token=None, sample_rate=0.0, slow_ms=1000, max_entries=50, top_n=40,
+                 public_timing=False, stack_sample_ms=10):
+        self.admin_token = admin_token
+        # Rolling stack samples of every request, kept as the profile of slow ones (0 disables)
+        self.sampler = StackSampler(stack_sample_ms) if stack_sample_ms else None
+        self.sample_rate = sample_rate
+        self.public_timing = public_timing
+        self.slow_ms = slow_ms
+        self.top_n = top_n
+        self._entries = deque(maxlen=max_entries)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _wants_profile(self):
+        flag = request.headers.get('X-Profile') or request.args.get('profile')
+        if flag in ('1', 'true', 'yes') and is_admin(self.admin_token):
+            return 'requested'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def _before_request(self):
+        g.profile_started = time.perf_counter()
+        g.profile_spans = {}
+        g.profile_reason = self._wants_profile()
+        g.profiler = None
+        if g.profile_reason:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+        elif self.sampler:
+            self.sampler.begin()
+
+    def _after_request(self, response):
+        started = g.get('profile_started')
+        if started is None:
+            return response
+        profiler = g.get('profiler')
+        if profiler:
+            profiler.disable()
+        samples = self.sampler.end() if self.sampler and not profiler else None
+        duration_ms = (time.perf_counter() - started) * 1000
+        spans = {name: round(ms, 2) for name, ms in g.get('profile_spans', {}).items()}
+
+        # Stage timings reveal internals: only for admins unless explicitly made public
+        show_timing = self.public_timing or is_admin(self.admin_token)
+        if show_timing:
+            response.headers['Server-Timing'] = ', '.join(
+                [f'{name};dur={ms}' for name, ms in spans.items()] + [f'total;dur={duration_ms:.2f}']
+            )
+
+        reason = g.get('profile_reason')
+        slow = duration_ms >= self.slow_ms
+        if reason or slow:
+            entry_id = self._store(reason or 'slow', duration_ms, spans, profiler, response.status_code, samples)
+            if show_timing:
+                response.headers['X-Profile-Id'] = str(entry_id)
+        return response
+
+    def _store(self, reason, duration_ms, spans, profiler, status_code, samples=None):
+        stats_text = None
+        if profiler:
+            out = io.StringIO()
+            stats = pstats.Stats(profiler, stream=out)
+            stats.sort_stats('cumulative').print_stats(self.top_n)
+            stats_text = out.getvalue()
+        elif samples and samples['samples']:
+            stats_text = self.sampler.format(samples, self.top_n)
+        entry = {
+            'id': next(self._ids),
+            'method': request.method,
+            'path': request.path,
+            'args': {key: value for key, value in request.args.items() if key != 'token'},
+            'status': status_code,
+            'reason': reason,
+            'slow': duration_ms >= self.slow_ms,
+            'duration_ms': round(duration_ms, 2),
+            'spans': spans,
+            'profile': stats_text,
+            'profile_kind': 'cprofile' if profiler else ('stack_samples' if stats_text else None),
+            'captured_at': datetime.now(timezone.utc).isoformat(),
+        }
+        with self._lock:
+            self._entries.append(entry)
+        if entry['slow']:
+            print(f"🐢 Slow request {entry['path']}: {entry['duration_ms']} ms (profile #{entry['id']})")
+        return entry['id']
+
+    def list(self):
+        """Summaries of kept profiles, newest first"""
+        with self._lock:
+            entries = list(self._entries)
+        return [
+            {**{key: value for key, value in entry.items() if key != 'profile'},
+             'has_profile': entry['profile'] is not None}
+            for entry in reversed(entries)
+        ]
+
+    def get(self, entry_id):
+        with self._lock:
+            return next((entry for entry in self._entries if entry['id'] == entry_id), None)
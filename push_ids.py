@@ -0,0 +1,67 @@
+"""
+Firebase Push ID helpers
+8 ký tự đầu của push ID mã hóa timestamp (ms), nên thứ tự key cũng là thứ tự thời gian
+"""
+
+import math
+from datetime import datetime, timezone
+
+# Firebase Push ID decoding constants
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+# Cursors must convert back to a datetime: 1970-01-01 .. 9999-12-31 (UTC)
+MAX_CURSOR_MS = int(datetime(9999, 12, 31, 23, 59, 59, tzinfo=timezone.utc).timestamp() * 1000)
+
+def decode_firebase_timestamp(push_id):
+    """Decode Firebase Push ID to get actual timestamp"""
+    try:
+        timestamp_b64 = push_id[0:8]
+        timestamp = 0
+        for i in range(0, 8):
+            timestamp += PUSH_CHARS.index(timestamp_b64[i]) * (64**(7-i))
+        return timestamp
+    except Exception as e:
+        print(f"Error decoding timestamp from {push_id}: {e}")
+        return None
+
+def encode_firebase_timestamp(timestamp):
+    """Encode a timestamp (ms) as the 8-char Push ID prefix"""
+    chars = []
+    timestamp = int(timestamp)
+    for _ in range(8):
+        chars.append(PUSH_CHARS[timestamp % 64])
+        timestamp //= 64
+    return ''.join(reversed(chars))
+
+def push_id_upper_bound(timestamp):
+    """Largest possible Push ID generated before the given timestamp (ms)"""
+    return encode_firebase_timestamp(int(timestamp) - 1) + PUSH_CHARS[-1] * 12
+
+def parse_cursor(value, tz=None):
+    """
+    `since` cursor -> timestamp (ms).
+    Accepts a Push ID, epoch milliseconds/seconds or an ISO datetime (naive ones are read in `tz`).
+    Raises ValueError for anything else, including non-finite or out-of-range values (inf, 1e400, 1e25).
+    """
+    value = (value or '').strip()
+    if not value:
+        raise ValueError("empty cursor")
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is not None:
+        if not math.isfinite(number):
+            raise ValueError(f"cursor is not a finite number: {value}")
+        # Epoch seconds are < 1e11 until the year 5138
+        cursor_ms = int(number if number >= 1e11 else number * 1000)
+    elif len(value) == 20 and all(char in PUSH_CHARS for char in value):
+        cursor_ms = decode_firebase_timestamp(value)
+    else:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = tz.localize(parsed) if hasattr(tz, 'localize') else parsed.replace(tzinfo=tz or timezone.utc)
+        cursor_ms = int(parsed.timestamp() * 1000)
+    if not 0 <= cursor_ms <= MAX_CURSOR_MS:
+        raise ValueError(f"cursor out of range: {value}")
+    return cursor_ms
@@ -0,0 +1,305 @@
+"""
+Mergeable streaming quantile sketches (KLL) cho dữ liệu thời tiết
+Mỗi trạm giữ một sketch cho mỗi trường theo từng ngày, cập nhật khi ingest
+"""
+
+import math
+import random
+import threading
+from datetime import date
+
+# Fields tracked by the daily sketches
+SKETCH_FIELDS = ('temperature', 'humidity', 'gust_windSpd')
+
+# Percentiles exposed through the APIs
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+# Rank error bound of a sketch with parameter k: RANK_ERROR_FACTOR / k
+RANK_ERROR_FACTOR = 3.0
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch - bounded memory, mergeable across buckets.
+    Normalized rank error stays within RANK_ERROR_FACTOR / k (1.5% at k=200), also after merges.
+    """
+
+    def __init__(self, k=200, c=2.0 / 3.0, seed=None):
+        self.k = k
+        self.c = c
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.compactors = [[]]
+        self._rng = random.Random(seed)
+        # Items held and total capacity, kept up to date instead of recomputed on every insert
+        self._size = 0
+        self._capacities = [self._capacity(0)]
+        self._max_size = self._capacities[0]
+
+    def _capacity(self, level):
+        """Capacity of a compactor level (lower levels are smaller)"""
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * (self.c ** depth))))
+
+    def _levels_changed(self):
+        """Capacities depend on the number of levels: recompute them when a level is added"""
+        self._capacities = [self._capacity(level) for level in range(len(self.compactors))]
+        self._max_size = sum(self._capacities)
+
+    def _compress(self):
+        """Compact the lowest full level, promoting every other item"""
+        for level in range(len(self.compactors)):
+            items = self.compactors[level]
+            if len(items) < self._capacities[level]:
+                continue
+            if level + 1 >= len(self.compactors):
+                self.compactors.append([])
+                self._levels_changed()
+            items.sort()
+            # Keep one item back when the level has an odd length
+            leftover = [items.pop()] if len(items) % 2 else []
+            offset = self._rng.randint(0, 1)
+            promoted = items[offset::2]
+            self.compactors[level + 1].extend(promoted)
+            self.compactors[level] = leftover
+            self._size -= len(items) - len(promoted)
+            return
+
+    def update(self, value):
+        """Add one value to the sketch (None/NaN are ignored)"""
+        if value is None:
+            return
+        value = float(value)
+        if math.isnan(value):
+            return
+        self.compactors[0].append(value)
+        self.count += 1
+        self._size += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if self._size >= self._max_size:
+            self._compress()
+
+    def update_many(self, values):
+        """Add a batch of values, same result as update() for each (None/NaN are ignored)"""
+        values = [value for value in (float(value) for value in values if value is not None) if not math.isnan(value)]
+        if not values:
+            return
+        self.count += len(values)
+        low, high = min(values), max(values)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        start = 0
+        while start < len(values):
+            # Fill level 0 up to the next compaction, in one slice
+            chunk = values[start:start + max(1, self._max_size - self._size)]
+            self.compactors[0].extend(chunk)
+            self._size += len(chunk)
+            start += len(chunk)
+            if self._size >= self._max_size:
+                self._compress()
+
+    def merge(self, other):
+        """Merge another sketch into this one"""
+        if other.count == 0:
+            return self
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        self._levels_changed()
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+            self._size += len(items)
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+    def quantiles(self, qs):
+        """Return approximate values for each quantile q in [0, 1]"""
+        if self.count == 0:
+            return [None for _ in qs]
+
+        weighted = sorted(
+            (value, 2 ** level)
+            for level, items in enumerate(self.compactors)
+            for value in items
+        )
+        total = sum(weight for _, weight in weighted)
+
+        results = []
+        for q in qs:
+            if q <= 0:
+                results.append(self.min)
+                continue
+            if q >= 1:
+                results.append(self.max)
+                continue
+            target = q * total
+            cumulative = 0
+            value = weighted[-1][0]
+            for item, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    value = item
+                    break
+            results.append(value)
+        return results
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def to_dict(self):
+        """Serialize the sketch (persisted per day next to the retention rollups)"""
+        return {
+            'k': self.k,
+            'c': self.c,
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'compactors': [list(items) for items in self.compactors],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(k=data.get('k', 200), c=data.get('c', 2.0 / 3.0))
+        sketch.count = data.get('count', 0)
+        sketch.min = data.get('min')
+        sketch.max = data.get('max')
+        compactors = data.get('compactors') or [[]]
+        if isinstance(compactors, dict):
+            # Firebase drops empty lists, so sparse levels come back as {index: items}
+            compactors = [compactors.get(str(level)) for level in range(max(int(key) for key in compactors) + 1)]
+        sketch.compactors = [list(items or []) for items in compactors]
+        sketch._size = sum(len(items) for items in sketch.compactors)
+        sketch._levels_changed()
+        return sketch
+
+
+class DailySketchStore:
+    """Per-station, per-day KLL sketches maintained incrementally on ingest"""
+
+    def __init__(self, fields=SKETCH_FIELDS, k=200):
+        self.fields = tuple(fields)
+        self.k = k
+        self._buckets = {}      # (station, date) -> {field: KLLSketch}
+        self._watermarks = {}   # station -> last ingested push ID
+        self._persisted = {}    # (station, date) -> readings covered by the persisted copy
+        self.generation = 0     # bumped when persisted days are restored
+        self._lock = threading.Lock()
+
+    def ingest(self, station, records):
+        """
+        Add (push_id, record) pairs to the day buckets.
+        Push IDs are time-ordered, so anything at or below the station's
+        watermark has already been ingested and is skipped.
+        """
+        added = 0
+        with self._lock:
+            watermark = self._watermarks.get(station)
+            # Collect the chunk's values per day and field, then update each day's sketches in one batch
+            days = {}
+            for push_id, record in sorted(records, key=lambda pair: pair[0]):
+                if watermark is not None and push_id <= watermark:
+                    continue
+                values = days.get(record['datetime'].date())
+                if values is None:
+                    values = days[record['datetime'].date()] = {field: [] for field in self.fields}
+                for field in self.fields:
+                    values[field].append(record.get(field))
+                watermark = push_id
+                added += 1
+            for day, values in days.items():
+                bucket = self._buckets.get((station, day))
+                if bucket is None:
+                    bucket = {field: KLLSketch(k=self.k) for field in self.fields}
+                    self._buckets[(station, day)] = bucket
+                for field in self.fields:
+                    bucket[field].update_many(values[field])
+            if watermark is not None:
+                self._watermarks[station] = watermark
+        return added
+
+    def watermark(self, station):
+        return self._watermarks.get(station)
+
+    def unpersisted_days(self, station, before_day):
+        """
+        {day ISO: {field: sketch dict}} of the days before `before_day` that hold more readings
+        than their persisted copy (the current day is still being filled and is left out)
+        """
+        with self._lock:
+            return {
+                day.isoformat(): {field: sketch.to_dict() for field, sketch in bucket.items()}
+                for (st, day), bucket in self._buckets.items()
+                if st == station and day < before_day and bucket_count(bucket) > self._persisted.get((st, day), 0)
+            }
+
+    def mark_persisted(self, station, days):
+        """Remember what unpersisted_days() returned has been written"""
+        with self._lock:
+            for day, fields in days.items():
+                count = max((data.get('count', 0) for data in fields.values()), default=0)
+                self._persisted[(station, date.fromisoformat(day))] = count
+
+    def restore(self, station, days):
+        """
+        Install persisted day sketches ({day ISO: {field: sketch dict}}), e.g. for days retention
+        has pruned from raw; a day held with at least as many readings is kept. Returns the days installed.
+        """
+        installed = 0
+        with self._lock:
+            for day, fields in (days or {}).items():
+                key = (station, date.fromisoformat(day))
+                bucket = {field: KLLSketch.from_dict(fields[field]) if field in fields else KLLSketch(k=self.k)
+                          for field in self.fields}
+                self._persisted[key] = bucket_count(bucket)
+                if key in self._buckets and bucket_count(self._buckets[key]) >= bucket_count(bucket):
+                    continue
+                self._buckets[key] = bucket
+                installed += 1
+            if installed:
+                self.generation += 1
+        return installed
+
+    def days(self, station):
+        """Sorted list of day buckets held for a station"""
+        with self._lock:
+            return sorted(day for (st, day) in self._buckets if st == station)
+
+    def merged(self, station, start_day, end_day):
+        """Merge the day sketches of [start_day, end_day] into fresh sketches"""
+        merged = {field: KLLSketch(k=self.k) for field in self.fields}
+        with self._lock:
+            for (st, day), bucket in self._buckets.items():
+                if st != station or day < start_day or day > end_day:
+                    continue
+                for field in self.fields:
+                    merged[field].merge(bucket[field])
+        return merged
+
+    def percentiles(self, station, start_day, end_day=None, percentiles=DEFAULT_PERCENTILES):
+        """Return {field: {'p5': .., 'p50': .., 'p95': ..}} for a day range"""
+        if end_day is None:
+            end_day = start_day
+        sketches = self.merged(station, start_day, end_day)
+        return sketch_percentiles(sketches, percentiles)
+
+
+def bucket_count(bucket):
+    """Readings covered by a day's {field: sketch} (fields may miss readings, so the largest count)"""
+    return max((sketch.count for sketch in bucket.values()), default=0)
+
+
+def sketch_percentiles(sketches, percentiles=DEFAULT_PERCENTILES):
+    """Format the requested percentiles of a {field: sketch} mapping"""
+    result = {}
+    for field, sketch in sketches.items():
+        values = sketch.quantiles([p / 100.0 for p in percentiles])
+        result[field] = {
+            f'p{p}': round(value, 2) if value is not None else None
+            for p, value in zip(percentiles, values)
+        }
+    return result
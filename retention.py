@@ -0,0 +1,439 @@
+"""
+Retention engine cho node "<station>/push"
+- Dữ liệu raw giữ trong RAW_DAYS ngày, sau đó gom thành aggregate 5 phút
+- Aggregate 5 phút giữ trong ROLLUP_DAYS ngày, sau đó gom thành aggregate 1 giờ
+- Tùy chọn archive raw ra file local và xóa key trên Firebase (multi-path delete theo batch)
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from derived_metrics import WIND_VECTORS, mean_wind_direction, wind_vector_values
+from push_ids import decode_firebase_timestamp, push_id_upper_bound
+from validation import READING_FIELDS, BatchValidator
+
+# Numeric fields kept in the aggregates (the validated reading columns)
+ROLLUP_FIELDS = READING_FIELDS
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def default_tiers(raw_days=30, rollup_days=365):
+    """Tier list: raw -> 5m aggregates -> 1h aggregates"""
+    return [
+        {'name': 'raw', 'bucket_seconds': None, 'max_age_days': raw_days},
+        {'name': '5m', 'bucket_seconds': 300, 'max_age_days': rollup_days},
+        {'name': '1h', 'bucket_seconds': 3600, 'max_age_days': None},
+    ]
+
+
+def record_size(key, value):
+    """Approximate stored size (bytes) of one key/value pair as JSON"""
+    return len(key) + len(json.dumps(value, separators=(',', ':')))
+
+
+def new_bucket():
+    return {'count': 0, 'last_key': '', 'counts': {}, 'sum': {}, 'min': {}, 'max': {}}
+
+
+def field_count(bucket, field):
+    """Number of readings that had `field` (buckets written before per-field counts: the row count)"""
+    return (bucket.get('counts') or {}).get(field, bucket.get('count', 0))
+
+
+def add_to_bucket(bucket, key, values, count=1, mins=None, maxs=None, counts=None):
+    """Merge a reading (or another bucket's totals and per-field counts) into an aggregate bucket"""
+    previous = {field: field_count(bucket, field) for field in bucket['sum']}
+    bucket['count'] += count
+    bucket['last_key'] = key
+    bucket['counts'] = previous
+    for field, value in values.items():
+        n = counts.get(field, count) if counts else count
+        if not n:
+            continue
+        low = mins.get(field, value / n) if mins else value / n
+        high = maxs.get(field, value / n) if maxs else value / n
+        bucket['counts'][field] = bucket['counts'].get(field, 0) + n
+        bucket['sum'][field] = bucket['sum'].get(field, 0.0) + value
+        bucket['min'][field] = min(bucket['min'].get(field, low), low)
+        bucket['max'][field] = max(bucket['max'].get(field, high), high)
+
+
+def bucket_to_record(bucket_ms, bucket, tz=timezone.utc):
+    """Turn an aggregate bucket back into one reading-shaped record (means, rain as total, vector-mean wind direction)"""
+    record = {'datetime': datetime.fromtimestamp(bucket_ms / 1000, tz=timezone.utc).astimezone(tz)}
+    for field, total in bucket.get('sum', {}).items():
+        record[field] = total if field == 'rain' else total / (field_count(bucket, field) or 1)
+    # Buckets written before u/v were aggregated: best effort from the mean speed/direction
+    record.update({field: value for field, value in wind_vector_values(record).items() if field not in record})
+    for _, direction_field, u_field, v_field in WIND_VECTORS.values():
+        if u_field in record and v_field in record:
+            direction = mean_wind_direction([record[u_field]], [record[v_field]])
+            if direction is not None:
+                record[direction_field] = direction
+    return record
+
+
+class RetentionEngine:
+    """Compacts, archives and prunes old readings for one station; resumable via a local state file"""
+
+    def __init__(self, reference, station, tiers=None, state_file='retention_state.json',
+                 archive_dir=None, prune=False, batch_size=500, max_batches=20, validator=None, access=None,
+                 load_timeout=None):
+        self.reference = reference      # e.g. firebase_admin.db.reference
+        self.station = station
+        self.tiers = tiers or default_tiers()
+        self.state_file = state_file
+        self.archive_dir = archive_dir
+        self.prune = prune
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        # Own validator: its spike/stuck history follows the old readings, not the live ingest
+        self.validator = validator or BatchValidator()
+        # Wrapper for every Firebase read, e.g. FirebaseAccess.call (timeout, retries, breaker)
+        self.access = access
+        self.load_timeout = load_timeout    # for the large read of all rollups
+        self._lock = threading.Lock()
+        self._history = None    # (rollups, records) built from them
+        self._rollups = None
+        self._rollups_stale = False     # a run changed the stored rollups: reload, keep serving the old copy
+        self.generation = 0     # bumped whenever the compacted history served changes
+        self.last_dry_run = None
+        self.state = self._load_state()
+
+    # ---- state ----
+
+    def _load_state(self):
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"⚠️ Cannot read retention state {self.state_file}: {e}")
+        return {}
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        tmp_path = self.state_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_file)
+
+    def _station_state(self):
+        return self.state.setdefault(self.station, {})
+
+    # ---- tiers ----
+
+    def _cutoff_ms(self, tier_name, now_ms):
+        for tier in self.tiers:
+            if tier['name'] == tier_name and tier['max_age_days'] is not None:
+                return now_ms - tier['max_age_days'] * DAY_MS
+        return None
+
+    def _bucket_tier(self, timestamp, now_ms):
+        """Aggregate tier a reading of this age belongs to"""
+        for tier in self.tiers[1:]:
+            cutoff = self._cutoff_ms(tier['name'], now_ms)
+            if cutoff is None or timestamp >= cutoff:
+                return tier
+        return self.tiers[-1]
+
+    def _rollup_path(self, tier_name):
+        return f'{self.station}/rollup/{tier_name}'
+
+    # ---- Firebase helpers ----
+
+    def _get(self, query, name, timeout=None):
+        """query.get() through `access` when set"""
+        if self.access is None:
+            return query.get()
+        return self.access(query.get, name, timeout=timeout)
+
+    def _read_range(self, path, start_key, end_key):
+        """Read up to batch_size children with start_key < key <= end_key"""
+        query = self.reference(path).order_by_key().end_at(end_key)
+        if start_key:
+            query = query.start_at(start_key)
+        data = self._get(query.limit_to_first(self.batch_size + 1), 'retention_read') or {}
+        items = [(key, value) for key, value in data.items() if key != start_key]
+        return items[:self.batch_size]
+
+    def _merge_buckets(self, tier_name, buckets, dry_run):
+        """Merge freshly built buckets into the stored ones; returns bytes written"""
+        path = self._rollup_path(tier_name)
+        updates = {}
+        for bucket_key, fresh in buckets.items():
+            stored = self._get(self.reference(f'{path}/{bucket_key}'), 'rollup_get') if not dry_run else None
+            if stored:
+                merged = stored
+                merged.setdefault('sum', {})
+                merged.setdefault('min', {})
+                merged.setdefault('max', {})
+                add_to_bucket(merged, fresh['last_key'], fresh['sum'], count=fresh['count'],
+                              mins=fresh['min'], maxs=fresh['max'], counts=fresh['counts'])
+            else:
+                merged = fresh
+            updates[bucket_key] = merged
+        if updates and not dry_run:
+            self.reference(path).update(updates)
+        return sum(record_size(key, value) for key, value in updates.items())
+
+    def _delete_keys(self, path, keys):
+        """Batched multi-path delete (one update() with null values per batch)"""
+        for i in range(0, len(keys), self.batch_size):
+            self.reference(path).update({key: None for key in keys[i:i + self.batch_size]})
+
+    def _archive(self, items):
+        """Append raw records to gzip JSONL files, one per month"""
+        by_month = {}
+        for key, value in items:
+            timestamp = decode_firebase_timestamp(key) or 0
+            month = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).strftime('%Y-%m')
+            by_month.setdefault(month, []).append({'key': key, 'value': value})
+        station_dir = os.path.join(self.archive_dir, self.station)
+        os.makedirs(station_dir, exist_ok=True)
+        for month, rows in by_month.items():
+            with gzip.open(os.path.join(station_dir, f'{month}.jsonl.gz'), 'at') as f:
+                for row in rows:
+                    f.write(json.dumps(row, separators=(',', ':')) + '\n')
+
+    # ---- compaction steps ----
+
+    def _skip_already_merged(self, bucket_key, key, tier_name, seen, dry_run):
+        """True if this key was merged into the stored bucket by an interrupted run"""
+        if dry_run:
+            return False
+        if (tier_name, bucket_key) not in seen:
+            stored = self._get(self.reference(f'{self._rollup_path(tier_name)}/{bucket_key}/last_key'), 'rollup_get')
+            seen[(tier_name, bucket_key)] = stored or ''
+        return key <= seen[(tier_name, bucket_key)]
+
+    def _compact_raw(self, now_ms, dry_run, report, validator):
+        """Raw readings older than the raw tier -> 5m/1h aggregates"""
+        cutoff = self._cutoff_ms('raw', now_ms)
+        if cutoff is None:
+            return
+        end_key = push_id_upper_bound(cutoff)
+        push_path = f'{self.station}/push'
+        cursor = self._station_state().get('raw_checkpoint', '')
+
+        for _ in range(self.max_batches):
+            items = self._read_range(push_path, cursor, end_key)
+            if not items:
+                break
+
+            report['raw_scanned'] += len(items)
+            report['bytes_reclaimable'] += sum(record_size(key, value) for key, value in items)
+            # Same checks as the ingest path: out-of-range/stuck/spike values are masked, bad rows dropped
+            result = validator.validate(self.station, items)
+            report['raw_rejected'] += result.stats['rejected']
+            report['raw_masked'] += result.stats['masked']
+            rows = zip(*(result.columns[field].tolist() for field in ROLLUP_FIELDS))
+
+            buckets = {}
+            seen = {}
+            for key, timestamp, row in zip(result.keys, result.timestamps.tolist(), rows):
+                tier = self._bucket_tier(timestamp, now_ms)
+                bucket_ms = timestamp - timestamp % (tier['bucket_seconds'] * 1000)
+                bucket_key = str(bucket_ms)
+                if self._skip_already_merged(bucket_key, key, tier['name'], seen, dry_run):
+                    continue
+                values = {field: value for field, value in zip(ROLLUP_FIELDS, row) if value == value}
+                # Wind as u/v components so bucket directions can be vector averaged
+                values.update(wind_vector_values(values))
+                bucket = buckets.setdefault(tier['name'], {}).setdefault(bucket_key, new_bucket())
+                add_to_bucket(bucket, key, values)
+                report['raw_compacted'] += 1
+
+            for tier_name, tier_buckets in buckets.items():
+                report['buckets_written'][tier_name] = report['buckets_written'].get(tier_name, 0) + len(tier_buckets)
+                report['bytes_added'] += self._merge_buckets(tier_name, tier_buckets, dry_run)
+
+            keys = [key for key, _ in items]
+            if not dry_run:
+                if self.archive_dir:
+                    self._archive(items)
+                    report['raw_archived'] += len(items)
+                if self.prune:
+                    self._delete_keys(push_path, keys)
+                    report['raw_pruned'] += len(keys)
+                    report['bytes_reclaimed'] += sum(record_size(key, value) for key, value in items)
+                self._station_state()['raw_checkpoint'] = keys[-1]
+                self._save_state()
+            cursor = keys[-1]
+            report['checkpoint'] = cursor
+
+    def _downsample_rollups(self, now_ms, dry_run, report):
+        """5m aggregates older than the 5m tier -> 1h aggregates"""
+        if len(self.tiers) < 3:
+            return
+        source, target = self.tiers[1], self.tiers[2]
+        cutoff = self._cutoff_ms(source['name'], now_ms)
+        if cutoff is None:
+            return
+        source_path = self._rollup_path(source['name'])
+        end_key = str(cutoff - 1)
+        cursor = ''
+
+        for _ in range(self.max_batches):
+            items = self._read_range(source_path, cursor, end_key)
+            if not items:
+                break
+
+            buckets = {}
+            seen = {}
+            for key, value in items:
+                bucket_ms = int(key) - int(key) % (target['bucket_seconds'] * 1000)
+                bucket_key = str(bucket_ms)
+                if self._skip_already_merged(bucket_key, key, target['name'], seen, dry_run):
+                    continue
+                bucket = buckets.setdefault(bucket_key, new_bucket())
+                add_to_bucket(bucket, key, value.get('sum', {}), count=value.get('count', 0),
+                              mins=value.get('min', {}), maxs=value.get('max', {}),
+                              counts={field: field_count(value, field) for field in value.get('sum', {})})
+                report['rollups_downsampled'] += 1
+                report['bytes_reclaimable'] += record_size(key, value)
+
+            report['buckets_written'][target['name']] = report['buckets_written'].get(target['name'], 0) + len(buckets)
+            report['bytes_added'] += self._merge_buckets(target['name'], buckets, dry_run)
+
+            keys = [key for key, _ in items]
+            if not dry_run:
+                self._delete_keys(source_path, keys)
+                report['bytes_reclaimed'] += sum(record_size(key, value) for key, value in items)
+            cursor = keys[-1]
+
+    # ---- public API ----
+
+    def run_once(self, dry_run=False, now_ms=None):
+        """One retention pass; returns a report (dry_run only reads and estimates)"""
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        report = {
+            'station': self.station,
+            'dry_run': dry_run,
+            'prune': self.prune,
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'raw_scanned': 0,
+            'raw_compacted': 0,
+            'raw_rejected': 0,
+            'raw_masked': 0,
+            'raw_archived': 0,
+            'raw_pruned': 0,
+            'rollups_downsampled': 0,
+            'buckets_written': {},
+            'bytes_reclaimable': 0,
+            'bytes_reclaimed': 0,
+            'bytes_added': 0,
+            'checkpoint': self._station_state().get('raw_checkpoint'),
+        }
+        # Dry runs must not advance the live validator's history or quarantine the same rows again
+        validator = self.validator.scratch() if dry_run else self.validator
+        with self._lock:
+            started = time.time()
+            self._compact_raw(now_ms, dry_run, report, validator)
+            self._downsample_rollups(now_ms, dry_run, report)
+            report['duration_ms'] = round((time.time() - started) * 1000, 1)
+            report['net_bytes_reclaimable'] = report['bytes_reclaimable'] - report['bytes_added']
+            if dry_run:
+                self.last_dry_run = report
+            else:
+                self._station_state()['last_run'] = report
+                self._save_state()
+                # Only a pass that wrote buckets or deleted keys changes the stored history
+                if any(report['buckets_written'].values()) or report['raw_pruned']:
+                    self._rollups_stale = True
+        return report
+
+    def status(self):
+        station_state = self._station_state()
+        return {
+            'station': self.station,
+            'tiers': self.tiers,
+            'prune': self.prune,
+            'archive_dir': self.archive_dir,
+            'raw_checkpoint': station_state.get('raw_checkpoint'),
+            'last_run': station_state.get('last_run'),
+        }
+
+    @property
+    def rollups_loaded(self):
+        """True when the cached rollups match the stored ones (none loaded yet, or changed by a run: False)"""
+        return self._rollups is not None and not self._rollups_stale
+
+    def load_rollups(self):
+        """
+        Read the stored aggregates into the cache (through `access` when set); raises on failure.
+        Meant for the background sync, so requests never wait on these reads; until it succeeds
+        the previous copy keeps being served.
+        """
+        rollups = {}
+        for tier in self.tiers[1:]:
+            data = self._get(self.reference(self._rollup_path(tier['name'])), f"rollup_get:{tier['name']}",
+                             timeout=self.load_timeout) or {}
+            rollups[tier['name']] = {int(key): bucket for key, bucket in data.items()}
+        self._rollups = rollups
+        self._rollups_stale = False
+        self.generation += 1
+        return rollups
+
+    def rollup_buckets(self):
+        """{tier name: {bucket_ms: bucket}} of the stored aggregates; None until load_rollups() succeeded"""
+        return self._rollups
+
+    def history_records(self, tz=timezone.utc, before=None):
+        """
+        Aggregated history as reading-shaped records (one per bucket), cached per loaded rollups.
+        Only buckets older than `before` are returned so they never overlap raw data still in push.
+        Empty until load_rollups() succeeded; never reads Firebase itself.
+        """
+        rollups = self._rollups
+        if rollups is None:
+            return []
+        cached = self._history
+        if cached is None or cached[0] is not rollups:
+            records = []
+            for buckets in rollups.values():
+                for bucket_ms, bucket in buckets.items():
+                    records.append(bucket_to_record(bucket_ms, bucket, tz))
+            records.sort(key=lambda x: x['datetime'], reverse=True)
+            cached = self._history = (rollups, records)
+        if before is None:
+            return list(cached[1])
+        return [item for item in cached[1] if item['datetime'] < before]
+
+
+class RetentionWorker:
+    """Background thread running the retention engine every interval"""
+
+    def __init__(self, engine, interval_seconds=3600, dry_run=False):
+        self.engine = engine
+        self.interval_seconds = interval_seconds
+        self.dry_run = dry_run
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='retention-worker', daemon=True)
+        self._thread.start()
+        print(f"🧹 Retention worker started (every {self.interval_seconds}s, dry_run={self.dry_run})")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                report = self.engine.run_once(dry_run=self.dry_run)
+                print(f"🧹 Retention pass: {report['raw_compacted']} raw compacted, "
+                      f"{report['raw_pruned']} pruned, {report['bytes_reclaimed']} bytes reclaimed")
+            except Exception as e:
+                print(f"❌ Retention pass failed: {e}")
+            self._stop.wait(self.interval_seconds)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Test aggregation (segment reduction, rollup 5m/1h) so với cách tính trực tiếp bằng numpy;
+bỏ trùng theo push ID (các bản ghi cùng millisecond vẫn được giữ); payload của to_json_lists không bị duyệt NaN lại
+Chạy: python -m pytest test_aggregation.py  hoặc  python test_aggregation.py
+"""
+
+import json
+import threading
+
+import numpy as np
+
+from aggregation import AGGREGATIONS, TimeSeriesStore, parse_bucket, to_json_lists
+from push_ids import encode_firebase_timestamp
+
+START_MS = 1699999200000            # an hour boundary
+OFFSET_MS = 7 * 60 * 60 * 1000      # Vietnam time
+FIELDS = ('temperature', 'pressure')
+
+
+def make_series(count=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = START_MS + np.arange(count, dtype=np.int64) * 60000
+    columns = {'temperature': rng.normal(27, 3, count), 'pressure': rng.normal(1010, 2, count)}
+    columns['temperature'][rng.random(count) < 0.05] = np.nan
+    columns['temperature'][1000:1300] = np.nan    # a gap longer than an hour
+    return timestamps, columns
+
+
+def build_store(timestamps, columns, chunk=997):
+    store = TimeSeriesStore(FIELDS, offset_ms=OFFSET_MS, max_buckets=10 ** 6)
+    for i in range(0, len(timestamps), chunk):
+        store.append('0001', timestamps[i:i + chunk], {field: columns[field][i:i + chunk] for field in FIELDS})
+    return store
+
+
+def expected(values):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {'count': 0, **{agg: np.nan for agg in AGGREGATIONS if agg != 'count'}}
+    return {'mean': values.mean(), 'min': values.min(), 'max': values.max(),
+            'sum': values.sum(), 'last': values[-1], 'count': len(values)}
+
+
+def check(result, timestamps, columns, field):
+    edges = list(result['buckets']) + [result['to']]
+    for i in range(len(edges) - 1):
+        mask = (timestamps >= edges[i]) & (timestamps < edges[i + 1])
+        want = expected(columns[field][mask])
+        for agg in AGGREGATIONS:
+            got = result['data'][field][agg][i]
+            if agg != 'count' and np.isnan(want[agg]):
+                assert np.isnan(got), (i, agg)
+            else:
+                assert abs(got - want[agg]) < 1e-6, (i, agg, got, want[agg])
+
+
+def test_matches_direct_computation():
+    timestamps, columns = make_series()
+    store = build_store(timestamps, columns)
+    for bucket, source in (('1h', 'rollup:1h'), ('15m', 'rollup:5m'), ('7m', 'raw'), ('1d', 'rollup:1h')):
+        result = store.query('0001', FIELDS, AGGREGATIONS, parse_bucket(bucket),
+                             int(timestamps[0]) + 12345, int(timestamps[-1]) + 1)
+        assert result['source'] == source
+        for field in FIELDS:
+            check(result, timestamps, columns, field)
+
+
+def test_day_buckets_start_at_local_midnight():
+    timestamps, columns = make_series()
+    store = build_store(timestamps, columns)
+    result = store.query('0001', FIELDS, ('mean',), parse_bucket('1d'), int(timestamps[0]), int(timestamps[-1]))
+    assert all((start + OFFSET_MS) % 86400000 == 0 for start in result['buckets'])
+
+
+def test_seeded_history_and_dropped_raw():
+    timestamps, columns = make_series()
+    full = build_store(timestamps, columns)
+
+    # Older half only available as 5-minute retention buckets
+    split = 10000
+    store = build_store(timestamps[split:], {field: columns[field][split:] for field in FIELDS})
+    buckets = {}
+    for i in range(0, split, 5):
+        values = columns['pressure'][i:i + 5]
+        buckets[int(timestamps[i])] = {'count': 5, 'sum': {'pressure': values.sum()},
+                                       'min': {'pressure': values.min()}, 'max': {'pressure': values.max()}}
+    assert store.seed_rollup('0001', '5m', buckets) == split // 5
+    assert store.seed_rollup('0001', '5m', buckets) == 0     # idempotent
+
+    store.drop_raw_before('0001', int(timestamps[split + 5000]))
+    args = (('pressure',), ('mean', 'count'), parse_bucket('1h'), int(timestamps[0]), int(timestamps[-1]) + 1)
+    want, got = full.query('0001', *args), store.query('0001', *args)
+    assert np.array_equal(want['data']['pressure']['count'], got['data']['pressure']['count'])
+    assert np.allclose(want['data']['pressure']['mean'], got['data']['pressure']['mean'])
+
+
+def test_seeded_rollups_overlapping_raw_not_double_counted():
+    timestamps, columns = make_series()
+    full = build_store(timestamps, columns)
+
+    # Retention buckets run 2000 minutes into the readings still held raw
+    split = 10000
+    store = build_store(timestamps[split:], {field: columns[field][split:] for field in FIELDS})
+    buckets = {}
+    for i in range(0, split + 2000, 5):
+        values = columns['pressure'][i:i + 5]
+        buckets[int(timestamps[i])] = {'count': 5, 'sum': {'pressure': values.sum()},
+                                       'min': {'pressure': values.min()}, 'max': {'pressure': values.max()}}
+
+    # Concurrent first requests: only one seed may add the history
+    barrier = threading.Barrier(8)
+    added = []
+
+    def seed():
+        barrier.wait()
+        added.append(store.seed_rollup('0001', '5m', buckets))
+
+    threads = [threading.Thread(target=seed) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(added) == [0] * 7 + [split // 5]
+
+    for bucket in ('5m', '1h'):
+        args = (('pressure',), ('count', 'sum'), parse_bucket(bucket), int(timestamps[0]), int(timestamps[-1]) + 1)
+        want, got = full.query('0001', *args), store.query('0001', *args)
+        assert np.array_equal(want['data']['pressure']['count'], got['data']['pressure']['count'])
+        assert np.allclose(want['data']['pressure']['sum'], got['data']['pressure']['sum'])
+
+
+def test_dedupe_by_push_key_keeps_same_millisecond_readings():
+    store = TimeSeriesStore(FIELDS, offset_ms=OFFSET_MS)
+    prefix = encode_firebase_timestamp(START_MS)
+    chunks = [[prefix + 'aaaaaaaaaaaa', prefix + 'bbbbbbbbbbbb'], [prefix + 'cccccccccccc']]
+    for keys in chunks + chunks:                    # every chunk delivered twice
+        timestamps = np.full(len(keys), START_MS, dtype=np.int64)
+        columns = {'temperature': np.full(len(keys), 27.0), 'pressure': np.full(len(keys), 1010.0)}
+        store.append('0001', timestamps, columns, keys=keys)
+    result = store.query('0001', FIELDS, ('count',), parse_bucket('1h'), START_MS, START_MS + 1)
+    assert result['data']['temperature']['count'].tolist() == [3]
+
+
+def test_json_lists_are_clean_and_not_walked_again():
+    import app as weather_app
+    timestamps, columns = make_series(count=3000)
+    result = build_store(timestamps, columns).query('0001', FIELDS, AGGREGATIONS, parse_bucket('1h'),
+                                                    int(timestamps[0]), int(timestamps[-1]) + 1)
+    payload = weather_app.CleanJSON(to_json_lists(result))
+    assert weather_app.nan_to_none(payload) is payload
+    body = json.loads(weather_app.app.json.dumps(payload))
+    assert None in body['data']['temperature']['mean']          # the gap, as null (valid JSON)
+    assert weather_app.nan_to_none({'value': [float('nan')]}) == {'value': [None]}
+
+
+def test_bad_bucket():
+    for text in ('0m', '15', '1w', ''):
+        try:
+            parse_bucket(text)
+            assert False, text
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Test alert rules (threshold có hysteresis, rate of change, no data) với sink giả lập
+Chạy: python -m pytest test_alerts.py  hoặc  python test_alerts.py
+"""
+
+import time
+from datetime import datetime, timezone
+
+from alerts import AlertEngine, AlertTicker, NoDataRule, RateOfChangeRule, ThresholdRule
+
+MINUTE_MS = 60 * 1000
+
+
+class ListSink:
+    def __init__(self):
+        self.events = []
+
+    def send(self, event):
+        self.events.append(event)
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def pairs(readings, start_ms, step_minutes=10):
+    """(push_id, record) pairs from field dicts, `step_minutes` apart"""
+    result = []
+    for i, values in enumerate(readings):
+        timestamp = start_ms + i * step_minutes * MINUTE_MS
+        record = {'datetime': datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc), **values}
+        result.append(('%020d' % timestamp, record))
+    return result
+
+
+def states(sink):
+    return [(event['rule'], event['state']) for event in sink.events]
+
+
+def test_threshold_hysteresis():
+    sink = ListSink()
+    engine = AlertEngine([ThresholdRule('hot', 'temperature', '>', 38.0, clear=37.0)], sinks=[sink])
+    temperatures = [36.0, 38.5, 37.5, 38.2, 37.2, 36.9, 37.5, 39.0]
+    engine.observe('0001', pairs([{'temperature': t} for t in temperatures], now_ms() - 30 * MINUTE_MS, 1))
+    # Stays firing inside the 37-38 band, resolves below 37, fires again above 38
+    assert states(sink) == [('hot', 'firing'), ('hot', 'resolved'), ('hot', 'firing')]
+    assert [event['value'] for event in sink.events] == [38.5, 36.9, 39.0]
+    assert engine.status('0001')[0]['state'] == 'firing'
+    assert [event['value'] for event in engine.events(limit=2)] == [39.0, 36.9]       # newest first
+    assert engine.events(limit=0) == [] and engine.events(limit=-1) == []
+
+
+def test_rate_of_change_and_data_gap():
+    sink = ListSink()
+    rule = RateOfChangeRule('pressure_drop_3h', 'pressure', 180, -3.0, tolerance_minutes=15)
+    engine = AlertEngine([rule], sinks=[sink])
+    start = now_ms() - 240 * MINUTE_MS
+    # 3h of slow decline, then -1 hPa every 10 minutes
+    pressures = [1010.0 - 0.1 * i for i in range(19)] + [1008.2 - i for i in range(1, 6)]
+    engine.observe('0001', pairs([{'pressure': p} for p in pressures], start))
+    assert states(sink) == [('pressure_drop_3h', 'firing')]
+    assert sink.events[0]['value'] <= -3.0
+
+    # Readings only every 5 hours: the drop happened over a gap, not within 3 hours
+    sink.events.clear()
+    gap_engine = AlertEngine([rule], sinks=[sink])
+    gap_engine.observe('0001', pairs([{'pressure': 1010.0}, {'pressure': 1000.0}, {'pressure': 990.0}], start, 300))
+    assert sink.events == []
+    assert gap_engine.status('0001')[0]['value'] is None
+
+
+def test_no_data_fires_from_tick():
+    sink = ListSink()
+    engine = AlertEngine([NoDataRule('no_data', 15)], sinks=[sink])
+    start = now_ms() - 30 * MINUTE_MS
+    engine.observe('0001', pairs([{'temperature': 25.0}], start))
+    engine.tick(start + 10 * MINUTE_MS)
+    assert sink.events == []
+    engine.tick(start + 16 * MINUTE_MS)
+    assert states(sink) == [('no_data', 'firing')] and sink.events[0]['value'] == 16.0
+    engine.observe('0001', pairs([{'temperature': 25.0}], now_ms()))
+    assert states(sink)[-1] == ('no_data', 'resolved')
+
+
+def test_no_data_for_station_that_never_reported():
+    sink = ListSink()
+    engine = AlertEngine([NoDataRule('no_data', 15)], sinks=[sink])
+    engine.tick()
+    assert sink.events == []                    # unknown station: nothing to check
+    engine.watch('0001', now_ms() - 20 * MINUTE_MS)
+    ticker = AlertTicker(engine, sync=lambda: None, interval_seconds=0.01)
+    ticker.start()
+    deadline = time.time() + 2
+    while not sink.events and time.time() < deadline:
+        time.sleep(0.01)
+    ticker.stop()
+    assert states(sink) == [('no_data', 'firing')] and sink.events[0]['station'] == '0001'
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test materialized chart views: build một lần cho mỗi data version, single-flight khi nhiều request cùng lúc
+Chạy: python -m pytest test_chart_views.py  hoặc  python test_chart_views.py
+"""
+
+import threading
+import time
+
+from chart_views import MaterializedViews
+
+
+class SlowBuilder:
+    """Counts builds; each build takes a while so concurrent requests overlap"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, station, period):
+        with self._lock:
+            self.calls.append((station, period))
+            build = len(self.calls)
+        time.sleep(self.delay)
+        return {'period': period, 'build': build}
+
+
+def test_concurrent_gets_build_once():
+    builder = SlowBuilder()
+    views = MaterializedViews(builder)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def request():
+        barrier.wait()
+        results.append(views.get('0001', 'week', '1.0'))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert builder.calls == [('0001', 'week')]
+    assert results == [{'period': 'week', 'build': 1}] * 8
+    (metrics,) = views.metrics()
+    assert metrics['builds'] == 1 and metrics['hits'] == 7
+
+
+def test_rebuild_when_version_changes():
+    builder = SlowBuilder(delay=0)
+    views = MaterializedViews(builder)
+    version = {'0001': '1.0'}
+    assert views.get('0001', 'day', version['0001'])['build'] == 1
+    assert views.get('0001', 'day', version['0001'])['build'] == 1
+    assert views.get('0001', 'week', version['0001'])['build'] == 2     # views are per period
+
+    version['0001'] = '1.1'                                              # e.g. retention compacted history
+    assert views.metrics(version.get)[0]['stale']
+    assert views.get('0001', 'day', version['0001'])['build'] == 3
+    day = next(view for view in views.metrics(version.get) if view['period'] == 'day')
+    assert day['builds'] == 2 and day['hits'] == 1 and not day['stale']
+
+
+def test_empty_payload_not_cached():
+    calls = []
+    views = MaterializedViews(lambda station, period: calls.append(period))
+    assert views.get('0001', 'day', '0.0') is None
+    assert views.get('0001', 'day', '0.0') is None
+    assert len(calls) == 2 and views.metrics() == []
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
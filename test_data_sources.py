@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test ReplaySource (phát lại push export với tốc độ N× thời gian thực) bằng đồng hồ giả lập
+Chạy: python -m pytest test_data_sources.py  hoặc  python test_data_sources.py
+"""
+
+from data_sources import ReplaySource
+from push_ids import decode_firebase_timestamp, encode_firebase_timestamp
+
+START_MS = 1700000000000
+
+
+class FakeClock:
+    def __init__(self, now=1800000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_export(count=10, step_ms=60000):
+    """`count` readings one minute apart"""
+    return {
+        encode_firebase_timestamp(START_MS + i * step_ms) + 'abcdefghijk%d' % (i % 10): {'temperature': 20.0 + i}
+        for i in range(count)
+    }
+
+
+def replay_all(source, clock, seconds, step=1.0):
+    """Poll like the sync path: fetch newer than the watermark every `step` seconds"""
+    watermark = None
+    seen = []
+    for _ in range(int(seconds / step)):
+        clock.now += step
+        data = source.fetch_since('0001', watermark)
+        keys = sorted(data)
+        if keys:
+            assert watermark is None or keys[0] > watermark
+            watermark = keys[-1]
+        seen.extend(keys)
+    return seen
+
+
+def test_replay_speed():
+    clock = FakeClock()
+    source = ReplaySource(make_export(), speed=60, rebase=False, clock=clock)
+    assert len(source.fetch_since('0001')) == 1      # only the first reading at t=0
+    clock.now += 3                                    # 3s at 60x = 3 recorded minutes
+    assert len(source.fetch_since('0001')) == 4
+
+
+def test_replay_incremental_without_duplicates():
+    clock = FakeClock()
+    export = make_export()
+    source = ReplaySource(export, speed=60, rebase=False, clock=clock)
+    watermark = None
+    seen = []
+    for _ in range(15):
+        data = source.fetch_since('0001', watermark)
+        if data:
+            watermark = max(data)
+        seen.extend(data)
+        clock.now += 1
+    assert sorted(seen) == sorted(export)
+
+
+def test_replay_rebase_and_preload():
+    clock = FakeClock()
+    source = ReplaySource(make_export(), speed=1, preload_minutes=4, clock=clock)
+    data = source.fetch_since('0001')
+    assert len(data) == 5
+    newest = decode_firebase_timestamp(max(data))
+    assert newest == int(clock.now * 1000)          # newest preloaded reading is "now"
+
+
+def test_replay_loop_keeps_keys_ordered():
+    clock = FakeClock()
+    source = ReplaySource(make_export(), speed=600, loop=True, clock=clock)
+    seen = replay_all(source, clock, 3, step=0.25)   # polls up to 27.5 recorded minutes, ~3 loops of 10 readings
+    assert len(seen) == 28
+    assert seen == sorted(seen)
+    assert len(set(seen)) == len(seen)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Test delta polling (?since=): parse cursor (kể cả inf/ngoài phạm vi -> 400), chỉ trả bản ghi mới,
+bucket cuối được thay thế, history version; bucket/stats không còn giá trị hợp lệ trả null;
+"hôm nay" theo giờ Việt Nam, summary chỉ đọc bản ghi hôm nay
+Chạy: python -m pytest test_delta.py  hoặc  python test_delta.py
+"""
+
+import contextlib
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytz
+
+import app as weather_app
+from chart_views import MaterializedViews
+from data_sources import DataSource
+from push_ids import encode_firebase_timestamp, parse_cursor
+from weather_store import WeatherStore
+
+MINUTE_MS = 60 * 1000
+VN_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
+
+
+class DictSource(DataSource):
+    """In-memory <station>/push"""
+    name = 'dict'
+
+    def __init__(self):
+        self.push = {}
+
+    def add(self, timestamp_ms, **values):
+        """Slightly varying readings, so validation does not flag them as stuck"""
+        i = len(self.push)
+        key = encode_firebase_timestamp(timestamp_ms) + '%012d' % i
+        self.push[key] = {'temperature': 25.0 + 0.1 * (i % 5), 'humidity': 70.0 + 0.1 * (i % 3),
+                          'pressure': 1010.0 + 0.1 * (i % 4), **values}
+        return key
+
+    def fetch_since(self, station, watermark=None):
+        return {key: dict(value) for key, value in self.push.items() if watermark is None or key > watermark}
+
+
+@contextlib.contextmanager
+def patched_app():
+    """app.py with an in-memory data source and empty stores; yields (test client, source)"""
+    source = DictSource()
+    saved = {name: getattr(weather_app, name) for name in
+             ('data_source', 'weather_store', 'chart_views', 'today_stats_cache', 'today_summary_cache',
+              'refresh_weather_data')}
+    weather_app.data_source = source
+    weather_app.weather_store = WeatherStore()
+    weather_app.chart_views = MaterializedViews(weather_app.build_chart_view)
+    weather_app.today_stats_cache = {}
+    weather_app.today_summary_cache = {}
+    weather_app.refresh_weather_data = lambda: True       # tests sync explicitly
+    try:
+        yield weather_app.app.test_client(), source
+    finally:
+        for name, value in saved.items():
+            setattr(weather_app, name, value)
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def test_parse_cursor_formats():
+    push_id = encode_firebase_timestamp(1700000000123) + 'abcdefghijkl'
+    assert parse_cursor(push_id) == 1700000000123
+    assert parse_cursor('1700000000123') == 1700000000123
+    assert parse_cursor('1700000000') == 1700000000000          # epoch seconds
+    assert parse_cursor('2023-11-14T22:13:20Z') == 1700000000000
+    # Naive ISO datetimes are read in the given time zone
+    assert parse_cursor('2023-11-15T05:13:20', VN_TZ) == 1700000000000
+
+
+GARBAGE_CURSORS = ['', '   ', 'yesterday', '2023-13-45', '!bad-push-id-00000000',
+                   'inf', '-inf', 'nan', '1e400', '1e25', '-5', 'zzzzzzzzzzzzzzzzzzzz']
+
+
+@pytest.mark.parametrize('value', GARBAGE_CURSORS)
+def test_parse_cursor_rejects_garbage(value):
+    with pytest.raises(ValueError):
+        parse_cursor(value)
+
+
+def test_bad_cursor_is_400():
+    with patched_app() as (client, source):
+        source.add(now_ms())
+        weather_app.sync_firebase_weather_data()
+        for url in ('/api/weather-data?since=yesterday', '/api/weather-chart-data/day?since=2023-13-45',
+                    '/api/weather-data?since=1e400', '/api/weather-chart-data/week?since=inf',
+                    '/api/aggregate?from=inf', '/api/aggregate?from=1e25', '/api/aggregate?to=1e25',
+                    '/api/wind-rose?from=1e25', '/api/wind-rose?to=nan'):
+            response = client.get(url)
+            assert response.status_code == 400 and not response.get_json()['success'], url
+
+
+def test_future_cursor_falls_back_to_newest_record():
+    start = now_ms() - 60 * MINUTE_MS
+    with patched_app() as (client, source):
+        for i in range(5):
+            source.add(start + i * 10 * MINUTE_MS)
+        weather_app.sync_firebase_weather_data()
+        newest = start + 40 * MINUTE_MS
+        body = client.get(f'/api/weather-data?since={now_ms() + 24 * 60 * MINUTE_MS}').get_json()
+        assert body['delta'] and body['data'] == [] and body['cursor'] == newest
+        body = client.get(f'/api/weather-chart-data/day?since={now_ms() + 24 * 60 * MINUTE_MS}').get_json()
+        assert body['cursor'] == newest
+
+
+def test_weather_data_delta_returns_only_new_records():
+    start = now_ms() - 60 * MINUTE_MS
+    with patched_app() as (client, source):
+        for i in range(5):
+            source.add(start + i * 10 * MINUTE_MS, temperature=25.0 + i)
+        weather_app.sync_firebase_weather_data()
+        full = client.get('/api/weather-data').get_json()
+        assert not full['delta'] and full['count'] == 5
+
+        assert client.get(f"/api/weather-data?since={full['cursor']}").get_json()['data'] == []
+        source.add(start + 45 * MINUTE_MS, temperature=31.0)
+        source.add(start + 50 * MINUTE_MS, temperature=32.0)
+        weather_app.sync_firebase_weather_data()
+        delta = client.get(f"/api/weather-data?since={full['cursor']}").get_json()
+        assert delta['delta'] and [item['temperature'] for item in delta['data']] == [32.0, 31.0]
+        assert delta['cursor'] == start + 50 * MINUTE_MS
+        assert delta['stats']['total_records'] == 7
+
+
+def test_today_stats_built_once_per_data_version(monkeypatch):
+    calls = []
+    build = weather_app.build_weather_stats
+    monkeypatch.setattr(weather_app, 'build_weather_stats', lambda *args: calls.append(args) or build(*args))
+    with patched_app() as (client, source):
+        cursor = source.add(now_ms() - MINUTE_MS)
+        weather_app.sync_firebase_weather_data()
+        for _ in range(3):
+            client.get(f'/api/weather-data?since={cursor}')
+        assert len(calls) == 1
+        source.add(now_ms())
+        weather_app.sync_firebase_weather_data()
+        client.get(f'/api/weather-data?since={cursor}')
+        assert len(calls) == 2
+
+
+def test_week_delta_replaces_last_bucket():
+    with patched_app() as (client, source):
+        start = now_ms() - 3 * 24 * 60 * MINUTE_MS
+        for i in range(3 * 24):
+            source.add(start + i * 60 * MINUTE_MS, temperature=20.0 + 0.1 * (i % 5))
+        weather_app.sync_firebase_weather_data()
+        full = client.get('/api/weather-chart-data/week').get_json()
+        assert not full['delta']
+
+        source.add(now_ms(), temperature=27.0)
+        weather_app.sync_firebase_weather_data()
+        delta = client.get(f"/api/weather-chart-data/week?since={full['cursor']}").get_json()
+        refreshed = client.get('/api/weather-chart-data/week').get_json()
+        # Only today's bucket, same bucket end as the one the client holds, with the new average
+        assert delta['delta'] and delta['data']['bucket_end_ms'] == full['data']['bucket_end_ms'][-1:]
+        assert delta['data']['temperature'] == refreshed['data']['temperature'][-1:]
+        assert delta['data']['temperature'][0] > full['data']['temperature'][-1]
+        assert delta['cursor'] > full['cursor']
+
+
+def test_day_delta_only_new_points():
+    with patched_app() as (client, source):
+        start = now_ms() - 120 * MINUTE_MS
+        for i in range(10):
+            source.add(start + i * 10 * MINUTE_MS)
+        weather_app.sync_firebase_weather_data()
+        full = client.get('/api/weather-chart-data/day').get_json()
+        new_keys = [source.add(start + (100 + i) * MINUTE_MS) for i in range(2)]
+        weather_app.sync_firebase_weather_data()
+        delta = client.get(f"/api/weather-chart-data/day?since={full['cursor']}").get_json()
+        assert len(delta['data']['bucket_end_ms']) == len(new_keys)
+        assert all(end > full['cursor'] for end in delta['data']['bucket_end_ms'])
+
+
+def test_history_change_forces_full_response():
+    with patched_app() as (client, source):
+        source.add(now_ms() - MINUTE_MS)
+        weather_app.sync_firebase_weather_data()
+        full = client.get('/api/weather-chart-data/week').get_json()
+        query = f"since={full['cursor']}&history={full['history']}"
+        assert client.get(f'/api/weather-chart-data/week?{query}').get_json()['delta']
+
+        weather_app.retention_engine.generation += 1            # e.g. retention compacted history
+        try:
+            body = client.get(f'/api/weather-chart-data/week?{query}').get_json()
+            assert not body['delta'] and body['history'] == full['history'] + 1
+            assert not client.get(f'/api/weather-data?{query}').get_json()['delta']
+            assert client.get(f"/api/weather-data?since={full['cursor']}").get_json()['delta']
+        finally:
+            weather_app.retention_engine.generation -= 1
+
+
+def test_masked_readings_are_null_not_zero():
+    with patched_app() as (client, source):
+        start = now_ms() - 30 * MINUTE_MS
+        for i in range(5):
+            source.add(start + i * 5 * MINUTE_MS, pressure=2000.0, rain='n/a')     # every pressure out of range
+        weather_app.sync_firebase_weather_data()
+        week = client.get('/api/weather-chart-data/week').get_json()['data']
+        assert set(week['pressure']) == {None} and set(week['rain']) == {None}
+        assert all(value > 0 for value in week['temperature'])
+        month = client.get('/api/weather-chart-data/month').get_json()['data']
+        assert set(month['pressure']) == {None}
+        summary = client.get('/api/weather-summary').get_json()['summary']
+        assert summary['current_pressure'] is None and summary['rain_today'] is None
+        assert summary['current_temp'] is not None
+
+
+def test_today_is_the_vietnam_day():
+    vn_midnight = datetime.now(VN_TZ).replace(hour=0, minute=0, second=1, microsecond=0)
+    items = [
+        {'datetime': vn_midnight.astimezone(timezone.utc).isoformat()},     # 17:00 UTC the day before
+        {'datetime': vn_midnight},
+        {'datetime': (vn_midnight - timedelta(seconds=2)).isoformat()},     # yesterday in Vietnam
+    ]
+    assert weather_app.filter_today_data(items) == items[:2]
+
+
+def test_summary_reads_only_today(monkeypatch):
+    with patched_app() as (client, source):
+        start = now_ms() - 5 * MINUTE_MS
+        for i in range(3):
+            source.add(start + i * MINUTE_MS, temperature=20.0 + i)
+        weather_app.sync_firebase_weather_data()
+        monkeypatch.setattr(weather_app, 'load_weather_records', lambda: pytest.fail('full history loaded'))
+        first = client.get('/api/weather-summary').get_json()['summary']
+        assert first['current_temp'] == 22.0
+        assert client.get('/api/weather-summary').get_json()['summary'] == first
+        source.add(now_ms(), temperature=23.0)
+        weather_app.sync_firebase_weather_data()
+        assert client.get('/api/weather-summary').get_json()['summary']['current_temp'] == 23.0
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            if name == 'test_parse_cursor_rejects_garbage':
+                for value in GARBAGE_CURSORS:
+                    test(value)
+            elif name in ('test_today_stats_built_once_per_data_version', 'test_summary_reads_only_today'):
+                with pytest.MonkeyPatch.context() as monkeypatch:
+                    test(monkeypatch)
+            else:
+                test()
+            print(f"✅ {name}")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test chỉ số dẫn xuất (dew point, heat index, rain rate, pressure tendency, vector gió) và wind rose
+Chạy: python -m pytest test_derived_metrics.py  hoặc  python test_derived_metrics.py
+"""
+
+from datetime import date
+
+import numpy as np
+
+from aggregation import TimeSeriesStore, parse_bucket, to_json_lists
+from derived_metrics import (DERIVED_FIELDS, VECTOR_DIRECTIONS, DerivedMetrics, dew_point, heat_index, mean_wind_direction,
+                             vector_direction)
+from validation import READING_FIELDS
+from wind_rose import WindRoseStore
+
+START_MS = 1699999200000            # 2023-11-15 05:00 Vietnam time
+OFFSET_MS = 7 * 60 * 60 * 1000
+
+
+def make_columns(count, step_ms=60000, **values):
+    timestamps = START_MS + np.arange(count, dtype=np.int64) * step_ms
+    columns = {field: np.full(count, float(values.get(field, 0.0))) for field in READING_FIELDS}
+    return timestamps, columns
+
+
+def test_dew_point_and_heat_index():
+    assert abs(dew_point(np.array([30.0]), np.array([70.0]))[0] - 23.9) < 0.1
+    assert np.isnan(dew_point(np.array([30.0]), np.array([0.0]))[0])
+    assert abs(heat_index(np.array([32.0]), np.array([70.0]))[0] - 40.4) < 0.3    # NOAA table: 90°F/70% -> 105°F
+    assert abs(heat_index(np.array([20.0]), np.array([50.0]))[0] - 19.6) < 0.3    # below 80°F: simple formula
+
+
+def test_wind_direction_vector_mean():
+    _, columns = make_columns(2, sustain_windSpd=10)
+    columns['sustain_windDir'] = np.array([350.0, 10.0])
+    derived = DerivedMetrics().compute('0001', START_MS + np.arange(2) * 60000, columns)
+    direction = vector_direction(derived['sustain_u'].sum(), derived['sustain_v'].sum())
+    assert min(direction, 360 - direction) < 1e-6        # north, not 180°
+    assert np.isnan(vector_direction(0.0, 0.0))
+
+
+def test_no_direction_when_wind_cancels_out():
+    _, columns = make_columns(2, sustain_windSpd=10)
+    columns['sustain_windDir'] = np.array([90.0, 270.0])
+    derived = DerivedMetrics().compute('0001', START_MS + np.arange(2) * 60000, columns)
+    assert mean_wind_direction(derived['sustain_u'].tolist(), derived['sustain_v'].tolist()) is None
+    assert mean_wind_direction([0.0], [0.0]) is None and mean_wind_direction([], []) is None
+
+    import app as weather_app
+    bucket = {'sustain_us': derived['sustain_u'].tolist(), 'sustain_vs': derived['sustain_v'].tolist(),
+              'gust_us': [], 'gust_vs': []}
+    assert weather_app.bucket_wind_direction(bucket, 'sustain') is None      # JSON null, not 0° (north)
+    assert weather_app.bucket_wind_direction(bucket, 'gust') is None
+
+def test_rain_rate_and_pressure_tendency_across_chunks():
+    timestamps, columns = make_columns(300, rain=1)
+    columns['pressure'] = 1010.0 - np.arange(300) * 0.01
+    metrics = DerivedMetrics()
+    chunks = [metrics.compute('0001', timestamps[i:i + 37], {f: v[i:i + 37] for f, v in columns.items()})
+              for i in range(0, 300, 37)]
+    rain_rate = np.concatenate([chunk['rain_rate'] for chunk in chunks])
+    tendency = np.concatenate([chunk['pressure_tendency_3h'] for chunk in chunks])
+    assert np.isnan(rain_rate[0]) and np.allclose(rain_rate[1:], 0.4 * 60)     # one tip per minute = 24 mm/h
+    assert np.isnan(tendency[:180 - 15]).all()
+    assert np.allclose(tendency[180:], -1.8)                                    # 180 readings x -0.01 hPa
+
+
+def test_aggregate_wind_direction_from_vectors():
+    timestamps, columns = make_columns(120, sustain_windSpd=10, gust_windSpd=20)
+    columns['sustain_windDir'] = np.where(np.arange(120) % 2, 350.0, 10.0)
+    columns.update(DerivedMetrics().compute('0001', timestamps, columns))
+    store = TimeSeriesStore(READING_FIELDS + DERIVED_FIELDS, offset_ms=OFFSET_MS, vector_fields=VECTOR_DIRECTIONS)
+    store.append('0001', timestamps, columns)
+    result = store.query('0001', ('sustain_windDir',), ('mean', 'min'), parse_bucket('1h'),
+                         int(timestamps[0]), int(timestamps[-1]) + 1)
+    means = result['data']['sustain_windDir']['mean']
+    assert np.all(np.minimum(means, 360 - means) < 1e-6)
+    assert np.all(result['data']['sustain_windDir']['min'] == 10.0)
+
+
+def test_aggregate_mean_direction_null_when_calm():
+    timestamps, columns = make_columns(120, sustain_windSpd=10)
+    columns['sustain_windDir'] = np.where(np.arange(120) % 2, 90.0, 270.0)   # east/west cancel out
+    columns.update(DerivedMetrics().compute('0001', timestamps, columns))
+    store = TimeSeriesStore(READING_FIELDS + DERIVED_FIELDS, offset_ms=OFFSET_MS, vector_fields=VECTOR_DIRECTIONS)
+    store.append('0001', timestamps, columns)
+    result = store.query('0001', ('sustain_windDir', 'gust_windDir'), ('mean',), parse_bucket('1h'),
+                         int(timestamps[0]), int(timestamps[-1]) + 1)
+    data = to_json_lists(result)['data']
+    assert data['sustain_windDir']['mean'] == [None, None]
+    assert data['gust_windDir']['mean'] == [None, None]                   # no wind at all
+
+
+def test_wind_rose_day_histograms():
+    timestamps, columns = make_columns(24 * 60, sustain_windSpd=8, gust_windSpd=0.5)
+    columns['sustain_windDir'] = np.where(np.arange(24 * 60) < 600, 0.0, 95.0)
+    store = WindRoseStore(offset_ms=OFFSET_MS)
+    for i in range(0, len(timestamps), 500):
+        store.ingest('0001', timestamps[i:i + 500], {f: v[i:i + 500] for f, v in columns.items()})
+    assert store.ingest('0001', timestamps[:10], {f: v[:10] for f, v in columns.items()}) == 0   # already ingested
+    assert store.days('0001') == [date(2023, 11, 15), date(2023, 11, 16)]
+
+    rose = store.rose('0001', 'sustain', date(2023, 11, 15), date(2023, 11, 16))
+    counts = np.array(rose['counts'])
+    assert rose['total'] == 24 * 60 and rose['calm'] == 0
+    assert counts[0, 1] == 600 and counts[4, 1] == 24 * 60 - 600      # N and E sectors, 6-12 km/h
+    gust = store.rose('0001', 'gust', date(2023, 11, 15), date(2023, 11, 15))
+    assert gust['calm'] == gust['total'] and gust['calm_frequency'] == 100.0
+    assert store.rose('0001', 'sustain', date(2023, 11, 17), date(2023, 11, 20)) is None
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
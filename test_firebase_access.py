@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Test lớp truy cập Firebase (timeout, retry, circuit breaker, stale-while-revalidate)
+với một backend giả lập cục bộ có thể chèn độ trễ và lỗi - không cần Firebase thật.
+Chạy: python -m pytest test_firebase_access.py  hoặc  python test_firebase_access.py
+"""
+
+import time
+
+from firebase_access import (
+    CircuitBreaker, CircuitOpenError, FirebaseAccess, FirebaseTimeout,
+    FirebaseUnavailable, StaleWhileRevalidate
+)
+
+
+class FlakyBackend:
+    """Stand-in for a Firebase reference: get() with injected latency and failures"""
+
+    def __init__(self, data=None, latency=0.0, failures=0):
+        self.data = data if data is not None else {'-Nabc': {'temperature': 30.0}}
+        self.latency = latency
+        self.failures = failures    # number of next calls that raise
+        self.calls = 0
+
+    def get(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("injected failure")
+        return self.data
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_access(retries=0, failure_threshold=3, reset_seconds=30, clock=None, timeout=0.2):
+    breaker = CircuitBreaker(failure_threshold, reset_seconds, clock=clock or FakeClock())
+    return FirebaseAccess(timeout=timeout, retries=retries, backoff_seconds=0.01,
+                          breaker=breaker, sleep=lambda seconds: None)
+
+
+def test_timeout():
+    backend = FlakyBackend(latency=0.5)
+    access = make_access(timeout=0.05)
+    started = time.time()
+    try:
+        access.call(backend.get, 'slow_get')
+        assert False, "expected FirebaseTimeout"
+    except FirebaseTimeout:
+        pass
+    assert time.time() - started < 0.4
+
+
+def test_retry_then_success():
+    backend = FlakyBackend(failures=2)
+    access = make_access(retries=2)
+    assert access.call(backend.get) == backend.data
+    assert backend.calls == 3
+    assert access.breaker.status()['state'] == 'closed'
+
+
+def test_breaker_opens_and_fails_fast():
+    backend = FlakyBackend(failures=100)
+    access = make_access(failure_threshold=3)
+    for _ in range(3):
+        try:
+            access.call(backend.get)
+        except FirebaseUnavailable:
+            pass
+    assert access.breaker.status()['state'] == 'open'
+
+    calls = backend.calls
+    try:
+        access.call(backend.get)
+        assert False, "expected CircuitOpenError"
+    except CircuitOpenError:
+        pass
+    assert backend.calls == calls  # backend not touched while open
+
+
+def test_half_open_recovery():
+    clock = FakeClock()
+    backend = FlakyBackend(failures=1)
+    access = make_access(failure_threshold=1, reset_seconds=30, clock=clock)
+    try:
+        access.call(backend.get)
+    except FirebaseUnavailable:
+        pass
+    assert access.breaker.status()['state'] == 'open'
+
+    clock.now = 31
+    assert access.call(backend.get) == backend.data
+    assert access.breaker.status()['state'] == 'closed'
+
+
+def test_half_open_failure_reopens():
+    clock = FakeClock()
+    backend = FlakyBackend(failures=2)
+    access = make_access(failure_threshold=1, reset_seconds=30, clock=clock)
+    try:
+        access.call(backend.get)
+    except FirebaseUnavailable:
+        pass
+    clock.now = 31
+    try:
+        access.call(backend.get)
+    except FirebaseUnavailable:
+        pass
+    assert access.breaker.status()['state'] == 'open'
+
+
+def test_stale_while_revalidate_serves_last_good_data():
+    backend = FlakyBackend()
+    access = make_access(failure_threshold=1)
+    cache = {}
+
+    def sync():
+        cache['data'] = access.call(backend.get)
+
+    refresher = StaleWhileRevalidate(sync, fresh_seconds=0, stale_after_seconds=60)
+
+    # Nothing cached yet: the first refresh is synchronous
+    assert refresher.ensure_fresh(has_data=False)
+    assert cache['data'] == backend.data
+    assert refresher.freshness()['stale'] is False
+
+    # Backend goes down: refresh fails, cached data stays, marker says stale
+    backend.failures = 100
+    assert refresher.refresh_now() is False
+    assert cache['data'] == backend.data
+    freshness = refresher.freshness()
+    assert freshness['stale'] is True
+    assert freshness['last_error']
+    assert freshness['last_success'] is not None
+
+
+def test_stale_while_revalidate_refreshes_in_background():
+    backend = FlakyBackend(latency=0.3)
+    access = make_access(timeout=1)
+    refresher = StaleWhileRevalidate(lambda: access.call(backend.get), fresh_seconds=0)
+
+    started = time.time()
+    assert refresher.ensure_fresh(has_data=True)
+    assert time.time() - started < 0.1   # request did not wait for Firebase
+
+    deadline = time.time() + 2
+    while refresher.last_success is None and time.time() < deadline:
+        time.sleep(0.02)
+    assert refresher.last_success is not None
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Test request profiling: lấy mẫu, ring buffer request chậm (có stack samples), Server-Timing chỉ cho admin,
+endpoint admin cần token, token không phải ASCII không gây lỗi 500
+Chạy: python -m pytest test_profiling.py  hoặc  python test_profiling.py
+"""
+
+import time
+
+from flask import Flask
+
+from profiling import RequestProfiler, span
+
+TOKEN = 'test-admin-token'
+
+
+def make_app(**kwargs):
+    app = Flask(__name__)
+    profiler = RequestProfiler(admin_token=TOKEN, **kwargs)
+    profiler.init_app(app)
+
+    @app.route('/work')
+    def work():
+        with span('compute'):
+            total = sum(range(1000))
+        return {'total': total}
+
+    @app.route('/slow')
+    def slow():
+        time.sleep(0.2)
+        return {'slept': True}
+
+    return app.test_client(), profiler
+
+
+def test_sampled_requests_are_kept():
+    client, profiler = make_app(sample_rate=1.0, slow_ms=1e9)
+    client.get('/work')
+    (entry,) = profiler.list()
+    assert entry['reason'] == 'sampled' and entry['has_profile'] and not entry['slow']
+    assert 'compute' in entry['spans']
+    assert 'sum' in profiler.get(entry['id'])['profile']
+
+
+def test_requested_profile_needs_admin():
+    client, profiler = make_app(slow_ms=1e9)
+    client.get('/work?profile=1')                                   # no token: ignored
+    assert profiler.list() == []
+    response = client.get('/work?profile=1', headers={'X-Admin-Token': TOKEN})
+    (entry,) = profiler.list()
+    assert entry['reason'] == 'requested' and response.headers['X-Profile-Id'] == str(entry['id'])
+
+
+def test_slow_ring_buffer_evicts_oldest():
+    client, profiler = make_app(slow_ms=0, max_entries=3, stack_sample_ms=0)
+    for _ in range(5):
+        client.get('/work')
+    entries = profiler.list()
+    assert [entry['id'] for entry in entries] == [5, 4, 3]
+    assert all(entry['reason'] == 'slow' and not entry['has_profile'] for entry in entries)
+    assert profiler.get(1) is None
+
+
+def test_slow_requests_keep_stack_samples():
+    client, profiler = make_app(slow_ms=100, stack_sample_ms=5)
+    client.get('/slow')
+    (entry,) = profiler.list()
+    assert entry['reason'] == 'slow' and entry['has_profile'] and entry['profile_kind'] == 'stack_samples'
+    assert 'test_profiling.py:slow' in profiler.get(entry['id'])['profile']
+
+
+def test_non_ascii_token_is_not_admin():
+    client, profiler = make_app(slow_ms=1e9)
+    response = client.get('/work?profile=1&token=%C3%A9')
+    assert response.status_code == 200 and 'Server-Timing' not in response.headers
+    response = client.get('/work?profile=1', headers={'X-Admin-Token': 'é'.encode('utf-8').decode('latin-1')})
+    assert response.status_code == 200 and profiler.list() == []
+
+
+def test_server_timing_only_for_admin():
+    client, _ = make_app(slow_ms=0)
+    response = client.get('/work')
+    assert 'Server-Timing' not in response.headers and 'X-Profile-Id' not in response.headers
+    response = client.get('/work', headers={'X-Admin-Token': TOKEN})
+    assert 'compute;dur=' in response.headers['Server-Timing']
+
+    public_client, _ = make_app(public_timing=True)
+    assert 'total;dur=' in public_client.get('/work').headers['Server-Timing']
+
+
+def test_admin_endpoints_require_token():
+    import app as weather_app
+    client = weather_app.app.test_client()
+    saved = weather_app.Config.ADMIN_TOKEN
+    try:
+        for token in ('', TOKEN):
+            weather_app.Config.ADMIN_TOKEN = token
+            assert client.get('/api/admin/profiles').status_code == 403
+            assert client.get('/api/admin/profiles', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+            assert client.get('/api/admin/profiles?token=%C3%A9').status_code == 403
+            assert client.get('/api/admin/profiles/1').status_code == 403
+            assert client.get('/api/retention/dry-run').status_code == 403
+        assert client.get('/api/admin/profiles', headers={'X-Admin-Token': TOKEN}).status_code == 200
+    finally:
+        weather_app.Config.ADMIN_TOKEN = saved
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
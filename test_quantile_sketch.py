@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test KLL sketch (sai số rank so với percentile chính xác, merge) và DailySketchStore (watermark, ngày local)
+Chạy: python -m pytest test_quantile_sketch.py  hoặc  python test_quantile_sketch.py
+"""
+
+import bisect
+import random
+from datetime import datetime, timedelta, timezone
+
+from quantile_sketch import RANK_ERROR_FACTOR, DailySketchStore, KLLSketch
+
+VN = timezone(timedelta(hours=7))
+QUANTILES = [i / 100 for i in range(1, 100)]
+
+
+def make_values(count=50000, seed=0):
+    rng = random.Random(seed)
+    return [rng.gauss(27, 3) for _ in range(count)]
+
+
+def max_rank_error(sketch, values):
+    """Largest |rank(estimate) - q| over the percentiles, against the exact sorted data"""
+    ordered = sorted(values)
+    return max(abs(bisect.bisect_right(ordered, value) / len(ordered) - q)
+               for q, value in zip(QUANTILES, sketch.quantiles(QUANTILES)))
+
+
+def test_rank_error_within_bound():
+    for seed in range(3):
+        values = make_values(seed=seed)
+        sketch = KLLSketch(k=200, seed=seed)
+        for value in values:
+            sketch.update(value)
+        assert sketch.count == len(values)
+        assert sketch.quantile(0) == min(values) and sketch.quantile(1) == max(values)
+        assert max_rank_error(sketch, values) <= RANK_ERROR_FACTOR / sketch.k
+
+
+def test_merge_keeps_accuracy():
+    values = make_values(seed=7)
+    # Uneven day-sized pieces, as when merging daily sketches into a month
+    parts = [KLLSketch(k=200, seed=i) for i in range(30)]
+    rng = random.Random(1)
+    for value in values:
+        parts[min(int(rng.expovariate(0.15)), 29)].update(value)
+    merged = KLLSketch(k=200, seed=99)
+    for part in parts:
+        merged.merge(part)
+    assert merged.count == len(values)
+    assert max_rank_error(merged, values) <= RANK_ERROR_FACTOR / merged.k
+
+
+def test_missing_values_ignored():
+    sketch = KLLSketch()
+    for value in (None, float('nan'), 1.0):
+        sketch.update(value)
+    assert sketch.count == 1
+    assert KLLSketch().quantiles([0.5]) == [None]
+
+
+def test_store_watermark_and_local_day():
+    store = DailySketchStore(fields=('temperature',))
+    start = datetime(2023, 11, 15, 16, 30, tzinfo=timezone.utc)     # 23:30 in Vietnam
+    records = [('key%03d' % i, {'datetime': (start + timedelta(minutes=30 * i)).astimezone(VN), 'temperature': 20.0 + i})
+               for i in range(4)]
+    assert store.ingest('0001', records[:3]) == 3
+    assert store.watermark('0001') == 'key002'
+    # Re-delivered push IDs (at or below the watermark) are skipped
+    assert store.ingest('0001', records) == 1
+    assert store.ingest('0001', records) == 0
+
+    # 23:30 Vietnam time belongs to the 15th, the rest to the 16th (not the UTC date)
+    assert store.days('0001') == [start.date(), start.date() + timedelta(days=1)]
+    assert store.percentiles('0001', start.date())['temperature']['p50'] == 20.0
+    day2 = store.merged('0001', start.date() + timedelta(days=1), start.date() + timedelta(days=1))
+    assert day2['temperature'].count == 3
+    assert store.days('0002') == []
+
+
+def test_batch_update_matches_single_updates():
+    values = make_values(count=20000, seed=3) + [None, float('nan')]
+    single, batch = KLLSketch(seed=5), KLLSketch(seed=5)
+    for value in values:
+        single.update(value)
+    for i in range(0, len(values), 997):
+        batch.update_many(values[i:i + 997])
+    assert batch.compactors == single.compactors and batch.count == single.count == 20000
+    assert (batch.min, batch.max) == (single.min, single.max)
+
+
+def test_day_sketches_persist_and_restore():
+    start = datetime(2023, 11, 15, tzinfo=VN)
+    records = [('key%05d' % i, {'datetime': start + timedelta(minutes=i), 'temperature': 20.0 + i % 50})
+               for i in range(3 * 24 * 60)]
+    store = DailySketchStore(fields=('temperature',))
+    store.ingest('0001', records)
+    today = start.date() + timedelta(days=2)
+    days = store.unpersisted_days('0001', today)
+    assert sorted(days) == ['2023-11-15', '2023-11-16']         # the current day is still filling
+    store.mark_persisted('0001', days)
+    assert store.unpersisted_days('0001', today) == {}
+
+    # Firebase drops empty lists: sparse compactor levels come back as {index: items}
+    stored = {day: {field: {**data, 'compactors': {str(level): items for level, items in enumerate(data['compactors'])
+                                                   if items}}
+                    for field, data in fields.items()}
+              for day, fields in days.items()}
+
+    # After a restart only the last part of the 16th is still raw: the persisted days win
+    restarted = DailySketchStore(fields=('temperature',))
+    restarted.ingest('0001', records[2 * 24 * 60 - 100:])
+    assert restarted.restore('0001', stored) == 2 and restarted.generation == 1
+    for day in (start.date(), start.date() + timedelta(days=1)):
+        assert restarted.percentiles('0001', day) == store.percentiles('0001', day)
+    assert restarted.unpersisted_days('0001', today) == {}
+    # A day held with at least as many readings is kept
+    assert restarted.restore('0001', stored) == 0
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Test retention: nén raw thành aggregate với số đếm theo từng trường, validate trước khi cộng dồn
+Chạy: python -m pytest test_retention.py  hoặc  python test_retention.py
+"""
+
+import copy
+
+import pytest
+
+from firebase_access import FirebaseUnavailable
+from push_ids import encode_firebase_timestamp
+from retention import RetentionEngine, add_to_bucket, bucket_to_record, new_bucket
+from validation import BatchValidator, QuarantineStore
+
+DAY_MS = 24 * 60 * 60 * 1000
+NOW_MS = 1800000000000
+OLD_MS = NOW_MS - 60 * DAY_MS       # raw older than 30 days -> 5m buckets (1h after 365 days)
+
+
+class FakeReference:
+    """Just enough of firebase_admin.db.reference for the retention engine"""
+
+    def __init__(self, root, path='', query=None):
+        self.root = root
+        self.path = [part for part in path.split('/') if part]
+        self.query = query or {}
+
+    def __call__(self, path=''):
+        return FakeReference(self.root, path)
+
+    def _with(self, **query):
+        return FakeReference(self.root, '/'.join(self.path), {**self.query, **query})
+
+    def order_by_key(self):
+        return self._with()
+
+    def start_at(self, key):
+        return self._with(start=key)
+
+    def end_at(self, key):
+        return self._with(end=key)
+
+    def limit_to_first(self, limit):
+        return self._with(limit=limit)
+
+    def get(self):
+        node = self.root
+        for part in self.path:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        if not isinstance(node, dict):
+            return copy.deepcopy(node)          # leaf value, e.g. <bucket>/last_key
+        keys = sorted(key for key in node
+                      if self.query.get('start', '') <= key and ('end' not in self.query or key <= self.query['end']))
+        return copy.deepcopy({key: node[key] for key in keys[:self.query.get('limit')]})
+
+    def update(self, values):
+        node = self.root
+        for part in self.path:
+            node = node.setdefault(part, {})
+        for key, value in values.items():
+            if value is None:
+                node.pop(key, None)
+            else:
+                node[key] = value
+
+
+def make_engine(root, tmp_path, **kwargs):
+    return RetentionEngine(FakeReference(root), '0001', state_file=str(tmp_path / 'state.json'), **kwargs)
+
+
+def push_key(timestamp_ms, i):
+    return encode_firebase_timestamp(timestamp_ms) + '%012d' % i
+
+
+def test_missing_field_does_not_pull_mean_to_zero():
+    bucket = new_bucket()
+    add_to_bucket(bucket, 'a', {'pressure': 1000.0, 'temperature': 20.0})
+    add_to_bucket(bucket, 'b', {'temperature': 22.0})
+    assert bucket['count'] == 2 and bucket['counts'] == {'pressure': 1, 'temperature': 2}
+    record = bucket_to_record(0, bucket)
+    assert record['pressure'] == 1000.0 and record['temperature'] == 21.0
+
+    # Merging into a bucket written before per-field counts uses its row count
+    legacy = {'count': 2, 'last_key': 'b', 'sum': {'temperature': 42.0}, 'min': {}, 'max': {}}
+    add_to_bucket(legacy, 'c', bucket['sum'], count=2, mins=bucket['min'], maxs=bucket['max'], counts=bucket['counts'])
+    assert legacy['counts'] == {'temperature': 4, 'pressure': 1}
+    assert bucket_to_record(0, legacy)['temperature'] == 21.0
+
+
+def test_compaction_validates_and_counts_per_field(tmp_path):
+    push = {
+        push_key(OLD_MS, 0): {'temperature': 25.0, 'humidity': 80.0, 'pressure': 1000.0},
+        push_key(OLD_MS + 60000, 1): {'temperature': 27.0, 'humidity': 80.0},
+        push_key(OLD_MS + 120000, 2): {'temperature': 500.0, 'humidity': 81.0, 'pressure': 1001.0},   # RANGE
+        push_key(OLD_MS + 180000, 3): {'note': 'no readings'},                                        # EMPTY
+    }
+    root = {'0001': {'push': dict(push)}}
+    engine = make_engine(root, tmp_path, prune=True)
+    report = engine.run_once(now_ms=NOW_MS)
+    assert report['raw_scanned'] == 4 and report['raw_compacted'] == 3
+    assert report['raw_rejected'] == 1 and report['raw_masked'] == 1
+    assert root['0001']['push'] == {}
+
+    (bucket,) = root['0001']['rollup']['5m'].values()
+    assert bucket['count'] == 3
+    assert bucket['counts']['pressure'] == 2 and bucket['counts']['temperature'] == 2
+    assert bucket['max']['temperature'] == 27.0
+    engine.load_rollups()
+    record = engine.history_records()[0]
+    assert record['pressure'] == 1000.5 and record['temperature'] == 26.0
+
+
+def test_downsampling_keeps_field_counts(tmp_path):
+    push = {push_key(OLD_MS + i * 60000, i): {'humidity': 80.0 + i % 3, **({'pressure': 1000.0} if i % 2 else {})}
+            for i in range(24)}
+    root = {'0001': {'push': push}}
+    engine = make_engine(root, tmp_path, prune=True)
+    engine.run_once(now_ms=NOW_MS)
+    engine.run_once(now_ms=NOW_MS + 400 * DAY_MS)       # 5m buckets age into 1h
+    assert root['0001']['rollup'].get('5m', {}) == {}
+    (bucket,) = root['0001']['rollup']['1h'].values()
+    assert bucket['count'] == 24 and bucket['counts']['pressure'] == 12
+    engine.load_rollups()
+    assert engine.history_records()[0]['pressure'] == 1000.0
+
+
+def test_history_reads_only_through_access(tmp_path):
+    push = {push_key(OLD_MS + i * 60000, i): {'temperature': 25.0} for i in range(3)}
+    root = {'0001': {'push': push}}
+    calls = []
+    down = {'value': False}
+
+    def access(fn, name, timeout=None):
+        calls.append(name)
+        if down['value']:
+            raise FirebaseUnavailable(f"{name} failed")
+        return fn()
+
+    engine = make_engine(root, tmp_path, prune=True, access=access)
+    engine.run_once(now_ms=NOW_MS)
+    assert 'retention_read' in calls                # the worker's reads go through access too
+    calls.clear()
+    # Requests never read Firebase: nothing loaded yet means no history, not a blocking read
+    assert engine.history_records() == [] and engine.rollup_buckets() is None and calls == []
+
+    down['value'] = True
+    with pytest.raises(FirebaseUnavailable):
+        engine.load_rollups()                       # background sync: fails, retried next sync
+    assert not engine.rollups_loaded and engine.history_records() == []
+
+    down['value'] = False
+    generation = engine.generation
+    engine.load_rollups()
+    assert calls == ['rollup_get:5m', 'rollup_get:5m', 'rollup_get:1h']
+    assert engine.generation > generation                  # chart views rebuild with the history
+    assert len(engine.history_records()) == 1 and len(calls) == 3
+
+
+def test_idle_run_keeps_history(tmp_path):
+    push = {push_key(OLD_MS + i * 60000, i): {'temperature': 25.0} for i in range(3)}
+    root = {'0001': {'push': push}}
+    engine = make_engine(root, tmp_path, prune=True)
+    engine.run_once(now_ms=NOW_MS)
+    assert not engine.rollups_loaded
+    engine.load_rollups()
+    generation = engine.generation
+
+    report = engine.run_once(now_ms=NOW_MS + 60000)             # nothing left to compact
+    assert report['raw_compacted'] == 0
+    assert engine.rollups_loaded and engine.generation == generation
+
+    # A pass that writes buckets marks the copy stale but keeps serving it until the reload
+    root['0001']['push'][push_key(OLD_MS + DAY_MS, 9)] = {'temperature': 30.0}
+    engine.run_once(now_ms=NOW_MS + 120000)
+    assert not engine.rollups_loaded and len(engine.history_records()) == 1
+    engine.load_rollups()
+    assert len(engine.history_records()) == 2 and engine.generation == generation + 1
+
+
+def test_resume_skips_already_merged_keys(tmp_path):
+    push = {push_key(OLD_MS + i * 60000, i): {'temperature': 20.0 + i} for i in range(4)}
+    root = {'0001': {'push': push}}
+    make_engine(root, tmp_path).run_once(now_ms=NOW_MS)
+    (bucket_key, bucket), = root['0001']['rollup']['5m'].items()
+    assert bucket['count'] == 4
+
+    # Interrupted before the checkpoint was saved: the next run reads the same keys again
+    root['0001']['push'][push_key(OLD_MS + 4 * 60000, 4)] = {'temperature': 24.0}
+    resumed = RetentionEngine(FakeReference(root), '0001', state_file=str(tmp_path / 'lost.json'))
+    report = resumed.run_once(now_ms=NOW_MS)
+    assert report['raw_scanned'] == 5 and report['raw_compacted'] == 1
+    bucket = root['0001']['rollup']['5m'][bucket_key]
+    assert bucket['count'] == 5 and bucket['counts']['temperature'] == 5
+    assert bucket['sum']['temperature'] == sum(20.0 + i for i in range(5))
+
+
+def test_dry_run_leaves_live_validator_alone(tmp_path):
+    push = {push_key(OLD_MS + i * 60000, i): {'temperature': 500.0 if i % 2 else 25.0, 'humidity': 80.0 + i % 3}
+            for i in range(6)}
+    root = {'0001': {'push': push}}
+    quarantine = QuarantineStore()
+    validator = BatchValidator(quarantine=quarantine)
+    engine = make_engine(root, tmp_path, validator=validator)
+    for _ in range(3):
+        report = engine.run_once(dry_run=True, now_ms=NOW_MS)
+        assert report['raw_masked'] == 3
+    assert quarantine.list() == [] and validator.stats()['totals']['rows'] == 0
+    assert engine.last_dry_run is report and 'rollup' not in root['0001']
+
+    engine.run_once(now_ms=NOW_MS)
+    assert len(quarantine.list()) == 3
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            with tempfile.TemporaryDirectory() as tmp:
+                test(pathlib.Path(tmp)) if test.__code__.co_argcount else test()
+            print(f"✅ {name}")
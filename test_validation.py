@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Test batch validation (range, STUCK, SPIKE, NaN, quarantine) và WeatherStore
+Chạy: python -m pytest test_validation.py  hoặc  python test_validation.py
+"""
+
+from datetime import datetime, timezone
+
+import numpy as np
+
+from push_ids import encode_firebase_timestamp
+from validation import BatchValidator, QuarantineStore
+from weather_store import WeatherStore
+
+START_MS = 1700000000000
+
+
+def make_items(readings, start=0):
+    """(push_id, record) pairs one minute apart"""
+    return [(encode_firebase_timestamp(START_MS + (start + i) * 60000) + 'abcdefghijkl', dict(reading))
+            for i, reading in enumerate(readings)]
+
+
+def reading(**values):
+    return {'temperature': 25.0, 'humidity': 70.0, 'pressure': 1010.0, **values}
+
+
+def varying(count, start=0):
+    """Readings that are neither stuck nor spiking"""
+    return [reading(temperature=25.0 + 0.1 * ((start + i) % 5), pressure=1010.0 + 0.1 * ((start + i) % 3))
+            for i in range(count)]
+
+
+def test_range_masks_field_and_rejects_without_core():
+    validator = BatchValidator()
+    items = make_items([reading(temperature=120.0), reading(temperature=90.0, humidity=-5.0, pressure=2000.0)])
+    result = validator.validate('0001', items)
+    assert result.stats['accepted'] == 1 and result.stats['rejected'] == 1 and result.stats['masked'] == 1
+    assert np.isnan(result.columns['temperature'][0]) and result.columns['humidity'][0] == 70.0
+    assert result.stats['reasons']['RANGE:temperature'] == 2
+    assert result.stats['reasons']['NO_VALID_CORE'] == 1
+
+
+def test_missing_and_unparseable_values_are_nan():
+    validator = BatchValidator()
+    items = make_items([reading(rain='n/a'), {'temperature': None, 'humidity': 70.0}, {}])
+    result = validator.validate('0001', items)
+    assert result.stats['accepted'] == 2
+    assert np.isnan(result.columns['rain'][0]) and np.isnan(result.columns['pressure'][1])
+    assert np.isnan(result.columns['temperature'][1])
+    assert result.stats['reasons'] == {'EMPTY': 1}
+    record = result.records()[1][1]
+    assert np.isnan(record['temperature']) and record['humidity'] == 70.0     # not replaced by 0
+
+
+def test_stuck_run_across_chunks():
+    validator = BatchValidator(stuck_run=30)
+    pressures = [1000.0 + 0.1 * (i % 4) for i in range(10)]
+    first = validator.validate('0001', make_items(
+        [reading(pressure=p, temperature=25.0 + 0.1 * (i % 5)) for i, p in enumerate(pressures)] +
+        [reading(pressure=1005.0, temperature=25.0 + 0.1 * (i % 5)) for i in range(29)]))
+    assert 'STUCK:pressure' not in first.stats['reasons']            # a run of 29 is fine
+    second = validator.validate('0001', make_items(
+        [reading(pressure=1005.0, temperature=25.0 + 0.1 * (i % 5)) for i in range(2)], start=39))
+    assert second.stats['reasons']['STUCK:pressure'] == 2             # 30th and 31st identical readings
+    assert np.isnan(second.columns['pressure']).all()
+
+
+def test_spike_against_trailing_median():
+    validator = BatchValidator(spike_window=7)
+    readings = varying(10)
+    readings[8] = reading(temperature=40.0)                            # +15 °C vs the median of the 7 before
+    result = validator.validate('0001', make_items(readings))
+    assert result.stats['reasons'] == {'SPIKE:temperature': 1}
+    assert np.isnan(result.columns['temperature'][8]) and not np.isnan(result.columns['temperature'][9])
+
+
+def test_quarantine_reasons_and_limit():
+    quarantine = QuarantineStore(max_items=3)
+    validator = BatchValidator(quarantine=quarantine)
+    items = make_items(varying(8) + [reading(temperature=120.0), reading(humidity=150.0, pressure=500.0, temperature=99.0),
+                                     reading(temperature=25.2)])
+    items.append(('!bad-push-id', reading()))
+    validator.validate('0001', items)
+    entries = quarantine.list()
+    assert [entry['action'] for entry in entries] == ['rejected', 'masked', 'rejected']     # newest first
+    assert set(entries[0]['reasons']) == {'RANGE:temperature', 'RANGE:humidity', 'RANGE:pressure', 'NO_VALID_CORE'}
+    assert entries[1]['reasons'] == ['RANGE:temperature']
+    assert entries[2]['reasons'] == ['BAD_KEY']
+    assert quarantine.list(limit=0) == [] and quarantine.list(limit=-5) == []
+    assert len(quarantine.list(limit=1)) == 1 and quarantine.list(station='0002') == []
+
+
+def test_weather_store_keeps_newest_first():
+    store = WeatherStore()
+    validator = BatchValidator()
+    items = make_items(varying(20))
+    for chunk in (items[:7], items[7:15], items[15:]):
+        store.append('0001', validator.validate('0001', chunk).records(), watermark=chunk[-1][0])
+    assert store.append('0001', validator.validate('0001', items[:3]).records()) == 0     # already held
+    records = store.records('0001')
+    assert len(records) == 20 and store.version('0001') == 3
+    assert [r['datetime'] for r in records] == sorted((r['datetime'] for r in records), reverse=True)
+    since = datetime.fromtimestamp((START_MS + 16 * 60000) / 1000, tz=timezone.utc)
+    assert len(store.records_since('0001', since)) == 3
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,295 @@
+"""
+Batch validation & cleaning cho dữ liệu ingest từ Firebase
+Kiểm tra cả chunk một lần bằng numpy: giới hạn vật lý, cảm biến bị kẹt (stuck),
+giá trị nhảy vọt (spike) so với rolling median. Giá trị thiếu là NaN, không phải 0.
+"""
+
+import threading
+import time
+import warnings
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+
+from push_ids import PUSH_CHARS
+
+# Raw reading fields (in Firebase record order)
+READING_FIELDS = (
+    'temperature', 'humidity', 'pressure', 'rain',
+    'sustain_windSpd', 'sustain_windDir', 'gust_windSpd', 'gust_windDir'
+)
+
+# A row is dropped when none of these survive validation
+CORE_FIELDS = ('temperature', 'humidity', 'pressure')
+
+# Physical limits (inclusive)
+PHYSICAL_RANGES = {
+    'temperature': (-40.0, 70.0),      # °C
+    'humidity': (0.0, 100.0),          # %
+    'pressure': (870.0, 1085.0),       # hPa
+    'rain': (0.0, 1000.0),             # bucket tips per reading
+    'sustain_windSpd': (0.0, 400.0),   # km/h
+    'sustain_windDir': (0.0, 360.0),   # degrees
+    'gust_windSpd': (0.0, 400.0),      # km/h
+    'gust_windDir': (0.0, 360.0),      # degrees
+}
+
+# Max deviation from the rolling median of the previous readings
+SPIKE_THRESHOLDS = {
+    'temperature': 8.0,
+    'humidity': 30.0,
+    'pressure': 15.0,
+}
+
+# Fields where a long run of identical values means a stuck sensor
+STUCK_FIELDS = ('temperature', 'pressure')
+
+# Lookup table: ASCII code -> Push ID character value
+_PUSH_LOOKUP = np.full(256, -1, dtype=np.int64)
+for _index, _char in enumerate(PUSH_CHARS):
+    _PUSH_LOOKUP[ord(_char)] = _index
+_PUSH_POWERS = 64 ** np.arange(7, -1, -1, dtype=np.int64)
+
+
+def decode_timestamps(push_ids):
+    """Vectorized Push ID -> timestamp (ms); -1 where the key is not a valid Push ID"""
+    if not push_ids:
+        return np.empty(0, dtype=np.int64)
+    try:
+        raw = np.array([key[:8].ljust(8) for key in push_ids], dtype='S8')
+    except UnicodeEncodeError:
+        return np.array([_decode_one(key) for key in push_ids], dtype=np.int64)
+    codes = raw.view(np.uint8).reshape(len(push_ids), 8)
+    values = _PUSH_LOOKUP[codes]
+    timestamps = values @ _PUSH_POWERS
+    timestamps[(values < 0).any(axis=1)] = -1
+    return timestamps
+
+
+def _decode_one(key):
+    try:
+        return sum(PUSH_CHARS.index(key[i]) * (64 ** (7 - i)) for i in range(8))
+    except (ValueError, IndexError):
+        return -1
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def to_column(records, field):
+    """Column of floats for one field; missing or unparseable values become NaN"""
+    values = [record.get(field) if isinstance(record, dict) else None for record in records]
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([_to_float(value) for value in values], dtype=float)
+
+
+def run_lengths(values):
+    """Length of the run of identical consecutive values each element belongs to"""
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64)
+    starts = np.ones(len(values), dtype=bool)
+    starts[1:] = values[1:] != values[:-1]
+    run_ids = np.cumsum(starts) - 1
+    return np.bincount(run_ids)[run_ids]
+
+
+def trailing_median(values, window):
+    """Median of the `window` values before each element (NaN-aware, NaN if no history)"""
+    padded = np.concatenate([np.full(window, np.nan), values])
+    windows = np.lib.stride_tricks.sliding_window_view(padded[:-1], window)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(windows, axis=1)
+
+
+class QuarantineStore:
+    """Bounded in-memory store of rejected/masked rows with reason codes"""
+
+    def __init__(self, max_items=1000):
+        self._items = deque(maxlen=max_items)
+        self._lock = threading.Lock()
+
+    def add(self, entries):
+        with self._lock:
+            self._items.extend(entries)
+
+    def list(self, station=None, limit=100):
+        """Newest first, at most `limit` items (none for limit <= 0)"""
+        if limit <= 0:
+            return []
+        with self._lock:
+            items = [item for item in self._items if station is None or item['station'] == station]
+        return items[-limit:][::-1]
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ValidationResult:
+    """Accepted rows of one batch as sorted columns (NaN = missing/masked)"""
+
+    def __init__(self, keys, timestamps, columns, stats):
+        self.keys = keys
+        self.timestamps = timestamps
+        self.columns = columns
+        self.stats = stats
+
+    def records(self, tz=timezone.utc):
+        """Accepted rows as (push_id, record) pairs in the app's record format"""
+        fields = list(self.columns)
+        rows = zip(*(self.columns[field].tolist() for field in fields)) if fields else iter(())
+        pairs = []
+        for key, timestamp, row in zip(self.keys, self.timestamps.tolist(), rows):
+            record = dict(zip(fields, row))
+            record['datetime'] = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).astimezone(tz)
+            pairs.append((key, record))
+        return pairs
+
+
+class BatchValidator:
+    """Validates whole ingest chunks per station, keeping a short tail of history for spike/stuck checks"""
+
+    def __init__(self, quarantine=None, ranges=None, spike_thresholds=None,
+                 spike_window=7, stuck_run=30):
+        self.quarantine = quarantine if quarantine is not None else QuarantineStore()
+        self.ranges = ranges or PHYSICAL_RANGES
+        self.spike_thresholds = spike_thresholds or SPIKE_THRESHOLDS
+        self.spike_window = spike_window
+        self.stuck_run = stuck_run
+        self._tails = {}    # station -> {field: last raw values}
+        self._totals = {'batches': 0, 'rows': 0, 'accepted': 0, 'rejected': 0, 'masked': 0, 'reasons': {}}
+        self._last_batch = None
+        self._lock = threading.Lock()
+
+    def scratch(self):
+        """Copy with the same checks and history but its own quarantine and counters, e.g. for dry runs"""
+        copy = BatchValidator(QuarantineStore(), self.ranges, self.spike_thresholds, self.spike_window, self.stuck_run)
+        with self._lock:
+            copy._tails = {station: dict(tails) for station, tails in self._tails.items()}
+        return copy
+
+    def validate(self, station, raw_items):
+        """
+        Validate a chunk of (push_id, raw_record) pairs.
+        Returns a ValidationResult with accepted rows sorted by push ID.
+        """
+        started = time.time()
+        raw_items = sorted(raw_items, key=lambda pair: pair[0])
+        keys = [key for key, _ in raw_items]
+        raw_records = [record for _, record in raw_items]
+        n = len(keys)
+
+        timestamps = decode_timestamps(keys)
+        columns = {field: to_column(raw_records, field) for field in READING_FIELDS}
+        masks = {}          # reason code -> bool array over rows
+        masked = np.zeros(n, dtype=bool)
+
+        bad_key = timestamps < 0
+        masks['BAD_KEY'] = bad_key
+
+        missing = np.column_stack([np.isnan(columns[field]) for field in READING_FIELDS]) if n else np.zeros((0, 0), dtype=bool)
+        empty = missing.all(axis=1) if n else np.zeros(0, dtype=bool)
+        masks['EMPTY'] = empty
+
+        with self._lock:
+            tail = self._tails.setdefault(station, {})
+            for field in READING_FIELDS:
+                values = columns[field]
+                low, high = self.ranges.get(field, (-np.inf, np.inf))
+                with np.errstate(invalid='ignore'):
+                    out_of_range = (values < low) | (values > high)
+                masks[f'RANGE:{field}'] = out_of_range
+                field_bad = out_of_range.copy()
+
+                # Out-of-range values never count as history for the stuck/spike checks
+                history = tail.get(field, np.empty(0))
+                extended = np.concatenate([history, np.where(out_of_range, np.nan, values)])
+
+                if field in STUCK_FIELDS and self.stuck_run:
+                    stuck = (run_lengths(extended) >= self.stuck_run)[len(history):] & ~np.isnan(values)
+                    masks[f'STUCK:{field}'] = stuck
+                    field_bad |= stuck
+
+                if field in self.spike_thresholds:
+                    median = trailing_median(extended, self.spike_window)[len(history):]
+                    with np.errstate(invalid='ignore'):
+                        spike = (np.abs(values - median) > self.spike_thresholds[field]) & ~out_of_range
+                    masks[f'SPIKE:{field}'] = spike
+                    field_bad |= spike
+
+                keep = max(self.spike_window, self.stuck_run)
+                tail[field] = extended[-keep:]
+
+                masked |= field_bad
+                columns[field] = np.where(field_bad, np.nan, values)
+
+        no_core = np.column_stack([np.isnan(columns[field]) for field in CORE_FIELDS]).all(axis=1) if n else np.zeros(0, dtype=bool)
+        rejected = bad_key | empty | no_core
+        masks['NO_VALID_CORE'] = no_core & ~empty & ~bad_key
+        masked &= ~rejected
+        accepted = ~rejected
+
+        reason_counts = {code: int(mask.sum()) for code, mask in masks.items() if mask.any()}
+        flagged = np.flatnonzero(rejected | masked)
+        if len(flagged):
+            now = datetime.now(timezone.utc).isoformat()
+            active = [(code, mask) for code, mask in masks.items() if mask.any()]
+            self.quarantine.add([
+                {
+                    'station': station,
+                    'push_id': keys[i],
+                    'action': 'rejected' if rejected[i] else 'masked',
+                    'reasons': [code for code, mask in active if mask[i]],
+                    'record': raw_records[i],
+                    'quarantined_at': now,
+                }
+                for i in flagged
+            ])
+
+        index = np.flatnonzero(accepted)
+        duration = time.time() - started
+        stats = {
+            'station': station,
+            'rows': n,
+            'accepted': int(accepted.sum()),
+            'rejected': int(rejected.sum()),
+            'masked': int(masked.sum()),
+            'missing_values': {field: int(np.isnan(columns[field][index]).sum()) for field in READING_FIELDS},
+            'reasons': reason_counts,
+            'duration_ms': round(duration * 1000, 2),
+            'rows_per_sec': int(n / duration) if duration > 0 else None,
+        }
+        self._record_stats(stats)
+
+        return ValidationResult(
+            [keys[i] for i in index],
+            timestamps[index],
+            {field: columns[field][index] for field in READING_FIELDS},
+            stats
+        )
+
+    def _record_stats(self, stats):
+        with self._lock:
+            if not stats['rows']:
+                return
+            self._last_batch = stats
+            self._totals['batches'] += 1
+            for name in ('rows', 'accepted', 'rejected', 'masked'):
+                self._totals[name] += stats[name]
+            for code, count in stats['reasons'].items():
+                self._totals['reasons'][code] = self._totals['reasons'].get(code, 0) + count
+
+    def stats(self):
+        with self._lock:
+            return {
+                'totals': {**self._totals, 'reasons': dict(self._totals['reasons'])},
+                'last_batch': self._last_batch,
+                'quarantined': len(self.quarantine),
+            }
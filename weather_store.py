@@ -0,0 +1,90 @@
+"""
+In-memory store của các bản ghi đã ingest (đã validate) theo từng trạm
+Chỉ các push ID mới hơn watermark được đọc/parse lại từ Firebase
+"""
+
+import threading
+
+
+class WeatherStore:
+    """Validated records per station, newest first, grown incrementally on ingest"""
+
+    def __init__(self):
+        self._records = {}      # station -> list of records (newest first)
+        self._watermarks = {}   # station -> last ingested push ID
+        self._versions = {}     # station -> data version (bumped on every change)
+        self._lock = threading.Lock()
+
+    def watermark(self, station):
+        return self._watermarks.get(station)
+
+    def version(self, station):
+        return self._versions.get(station, 0)
+
+    def append(self, station, pairs, watermark=None):
+        """Add (push_id, record) pairs newer than the watermark; returns the number added"""
+        with self._lock:
+            current = self._watermarks.get(station)
+            fresh = [(key, record) for key, record in pairs if current is None or key > current]
+            if watermark is not None and (current is None or watermark > current):
+                self._watermarks[station] = watermark
+            if not fresh:
+                return 0
+            # Everything in the chunk is newer than what is held: sort the chunk only and put it in front
+            fresh.sort(key=lambda pair: pair[0], reverse=True)
+            self._records[station] = [record for _, record in fresh] + self._records.get(station, [])
+            latest = fresh[0][0]
+            if self._watermarks.get(station) is None or latest > self._watermarks[station]:
+                self._watermarks[station] = latest
+            self._versions[station] = self._versions.get(station, 0) + 1
+            return len(fresh)
+
+    def records(self, station):
+        """Shallow copies of the station's records (callers may mutate them)"""
+        with self._lock:
+            records = self._records.get(station, [])
+            return [dict(record) for record in records]
+
+    def records_since(self, station, since):
+        """Copies of the records newer than `since` (datetime), newest first; cost grows with new data only"""
+        with self._lock:
+            result = []
+            for record in self._records.get(station, []):
+                if record['datetime'] <= since:
+                    break
+                result.append(dict(record))
+            return result
+
+    def latest(self, station):
+        """Copy of the newest record held for a station (None when empty)"""
+        with self._lock:
+            records = self._records.get(station)
+            return dict(records[0]) if records else None
+
+    def count(self, station):
+        return len(self._records.get(station, []))
+
+    def oldest(self, station):
+        """Datetime of the oldest record held for a station (None when empty)"""
+        with self._lock:
+            records = self._records.get(station)
+            return records[-1]['datetime'] if records else None
+
+    def newest(self, station):
+        """Datetime of the newest record held for a station (None when empty)"""
+        with self._lock:
+            records = self._records.get(station)
+            return records[0]['datetime'] if records else None
+
+    def drop_before(self, station, cutoff):
+        """Forget records older than cutoff (e.g. once retention has compacted them)"""
+        with self._lock:
+            records = self._records.get(station, [])
+            kept = [record for record in records if record['datetime'] >= cutoff]
+            if len(kept) != len(records):
+                self._records[station] = kept
+                self._versions[station] = self._versions.get(station, 0) + 1
+            return len(records) - len(kept)
+
+    def __len__(self):
+        return sum(len(records) for records in self._records.values())
@@ -0,0 +1,100 @@
+"""
+Wind rose: histogram hướng × tốc độ gió theo từng ngày, cập nhật (vectorized) khi ingest
+Khi truy vấn chỉ cần cộng các histogram ngày trong khoảng thời gian, không đọc lại reading.
+"""
+
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+from derived_metrics import WIND_VECTORS
+
+DAY_MS = 24 * 60 * 60 * 1000
+EPOCH = date(1970, 1, 1)
+
+SECTORS = 16
+SECTOR_NAMES = ('N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE',
+                'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW')
+# Speed bin lower edges (km/h, roughly Beaufort); below the first edge counts as calm
+SPEED_EDGES = (1, 6, 12, 20, 29, 39, 50)
+
+
+def speed_bin_labels(edges=SPEED_EDGES):
+    labels = [f'{low:g}-{high:g}' for low, high in zip(edges, edges[1:])]
+    return labels + [f'{edges[-1]:g}+']
+
+
+class WindRoseStore:
+    """Per-station, per-day direction × speed counts for sustained and gust wind"""
+
+    def __init__(self, offset_ms=0, speed_edges=SPEED_EDGES, sectors=SECTORS):
+        self.offset_ms = offset_ms     # local time offset, so days start at local midnight
+        self.speed_edges = np.asarray(speed_edges, dtype=float)
+        self.sectors = sectors
+        self._days = {}         # (station, kind, date) -> {'counts': int array sectors × speeds, 'calm': int}
+        self._watermarks = {}   # station -> last ingested timestamp (ms)
+        self._lock = threading.Lock()
+
+    def ingest(self, station, timestamps, columns):
+        """Add a sorted chunk (timestamps in ms, speed/direction columns); rows at or before the watermark are skipped"""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        with self._lock:
+            watermark = self._watermarks.get(station)
+            if watermark is not None:
+                keep = timestamps > watermark
+                timestamps = timestamps[keep]
+                columns = {field: values[keep] for field, values in columns.items()}
+            if not len(timestamps):
+                return 0
+
+            day_numbers, day_index = np.unique((timestamps + self.offset_ms) // DAY_MS, return_inverse=True)
+            day_values = [EPOCH + timedelta(days=int(number)) for number in day_numbers]
+            bins = len(self.speed_edges)
+            for kind, (speed_field, direction_field, _, _) in WIND_VECTORS.items():
+                speed = columns[speed_field]
+                direction = columns[direction_field]
+                valid = ~(np.isnan(speed) | np.isnan(direction))
+                calm = valid & (speed < self.speed_edges[0])
+                windy = valid & ~calm
+                sector = np.floor(np.where(valid, direction, 0) % 360 / (360 / self.sectors) + 0.5).astype(np.int64) % self.sectors
+                speed_bin = np.searchsorted(self.speed_edges, np.where(windy, speed, 0), side='right') - 1
+                flat = (day_index * self.sectors + sector) * bins + speed_bin
+                counts = np.bincount(flat[windy], minlength=len(day_values) * self.sectors * bins)
+                counts = counts.reshape(len(day_values), self.sectors, bins)
+                calms = np.bincount(day_index[calm], minlength=len(day_values))
+                for i, day in enumerate(day_values):
+                    bucket = self._days.setdefault((station, kind, day), {
+                        'counts': np.zeros((self.sectors, bins), dtype=np.int64), 'calm': 0
+                    })
+                    bucket['counts'] += counts[i]
+                    bucket['calm'] += int(calms[i])
+            self._watermarks[station] = int(timestamps[-1])
+        return len(timestamps)
+
+    def days(self, station):
+        """Sorted list of days held for a station"""
+        with self._lock:
+            return sorted({day for s, _, day in self._days if s == station})
+
+    def rose(self, station, kind, start_day, end_day):
+        """Merged counts and frequencies (%) for a day range, or None when there is nothing in it"""
+        with self._lock:
+            buckets = [bucket for (s, k, day), bucket in self._days.items()
+                       if s == station and k == kind and start_day <= day <= end_day]
+            if not buckets:
+                return None
+            counts = sum(bucket['counts'] for bucket in buckets)
+            calm = sum(bucket['calm'] for bucket in buckets)
+        total = int(counts.sum()) + calm
+        scale = 100.0 / total if total else 0.0
+        return {
+            'sectors': list(SECTOR_NAMES) if self.sectors == len(SECTOR_NAMES) else list(range(self.sectors)),
+            'speed_bins': speed_bin_labels(self.speed_edges.tolist()),
+            'counts': counts.tolist(),
+            'frequencies': np.round(counts * scale, 2).tolist(),
+            'calm': calm,
+            'calm_frequency': round(calm * scale, 2),
+            'total': total,
+            'days': len(buckets),
+        }